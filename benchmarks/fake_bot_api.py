@@ -0,0 +1,172 @@
+"""
+Servidor falso de la Bot API de Telegram para pruebas locales.
+
+Responde a los métodos que usa el bot (sendMessage, editMessageText, sendPhoto,
+answerCallbackQuery, getUpdates...) sin salir a la red y aplica los mismos límites
+que Telegram: si un chat o el bot entero superan su ritmo, devuelve 429 con
+retry_after. Así se puede comprobar el planificador de mensajes salientes.
+
+Los updates que se publiquen en /_updates se entregan por getUpdates, y /_stats
+devuelve las llamadas recibidas por método, los 429 y las ediciones repetidas.
+
+Uso:
+    python benchmarks/fake_bot_api.py [--port 8081] [--chat-rate 1] [--global-rate 30]
+    TELEGRAM_API_BASE_URL=http://localhost:8081 python src/virox_telegram.py
+"""
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import defaultdict, deque
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class FakeBotApi:
+    """Bot API en memoria con límites por chat y global al estilo de Telegram"""
+
+    def __init__(self, chat_rate=1.0, global_rate=30.0, latency=0.0, on_message=None):
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.latency = latency
+        # Se llama con (chat_id, method) por cada mensaje nuevo que el bot envía a un chat
+        self.on_message = on_message
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self.not_modified = 0
+        self._next_message_id = 1
+        self._texts = {}
+        self._chat_last = {}
+        self._global_window = deque()
+        self._updates = asyncio.Queue()
+        self._update_id = 1
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle_method)
+        self.app.router.add_get('/bot{token}/{method}', self.handle_method)
+        self.app.router.add_post('/_updates', self.handle_push_update)
+        self.app.router.add_get('/_stats', self.handle_stats)
+
+    def _retry_after(self, chat_id):
+        """Segundos a esperar si la llamada supera algún límite, o 0"""
+        now = time.monotonic()
+        while self._global_window and self._global_window[0] <= now - 1:
+            self._global_window.popleft()
+        if self.global_rate > 0 and len(self._global_window) >= self.global_rate:
+            return 1
+        if chat_id is not None and self.chat_rate > 0:
+            last = self._chat_last.get(chat_id)
+            # Un poco de tolerancia: Telegram no corta en el milisegundo exacto
+            if last is not None and now - last < 0.9 / self.chat_rate:
+                return max(1, round(1 / self.chat_rate))
+            self._chat_last[chat_id] = now
+        self._global_window.append(now)
+        return 0
+
+    def _message(self, chat_id, **fields):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return dict({
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private' if int(chat_id) > 0 else 'group'},
+        }, **fields)
+
+    async def handle_method(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        if not params and request.content_type == 'application/json':
+            params = await request.json()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+
+        chat_id = params.get('chat_id')
+        retry_after = self._retry_after(chat_id) if method not in ('getMe', 'deleteWebhook', 'setWebhook') else 0
+        if retry_after:
+            self.rate_limited += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after},
+            }, status=429)
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot',
+                      'can_join_groups': True, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': False}
+        elif method == 'sendMessage':
+            result = self._message(chat_id, text=params.get('text', ''))
+            self._texts[(str(chat_id), result['message_id'])] = result['text']
+        elif method == 'sendPhoto':
+            result = self._message(chat_id, caption=params.get('caption', ''), photo=[
+                {'file_id': 'photo', 'file_unique_id': 'photo', 'width': 1, 'height': 1}
+            ])
+        elif method == 'editMessageText':
+            key = (str(chat_id), int(params.get('message_id', 0)))
+            if self._texts.get(key) == params.get('text'):
+                self.not_modified += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 400,
+                    'description': 'Bad Request: message is not modified',
+                }, status=400)
+            self._texts[key] = params.get('text')
+            result = self._message(chat_id, text=params.get('text', ''))
+            result['message_id'] = key[1]
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook, deleteMessage...
+            result = True
+        if self.on_message is not None and method in ('sendMessage', 'sendPhoto'):
+            self.on_message(int(chat_id), method)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, params):
+        timeout = float(params.get('timeout', 0) or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            pass
+        while not self._updates.empty() and len(updates) < 100:
+            updates.append(self._updates.get_nowait())
+        return web.json_response({'ok': True, 'result': updates})
+
+    def push_update(self, update):
+        """Encolar un update para getUpdates asignándole update_id"""
+        update = dict(update, update_id=self._update_id)
+        self._update_id += 1
+        self._updates.put_nowait(update)
+
+    async def handle_push_update(self, request):
+        self.push_update(await request.json())
+        return web.json_response({'ok': True})
+
+    def stats(self):
+        return {
+            'calls': dict(self.calls),
+            'rate_limited': self.rate_limited,
+            'not_modified': self.not_modified,
+            'pending_updates': self._updates.qsize(),
+        }
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats(), dumps=lambda data: json.dumps(data, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-rate', type=float, default=1.0, help='Mensajes por segundo por chat')
+    parser.add_argument('--global-rate', type=float, default=30.0, help='Mensajes por segundo en total')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia añadida por llamada (s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    api = FakeBotApi(chat_rate=args.chat_rate, global_rate=args.global_rate, latency=args.latency)
+    web.run_app(api.app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Benchmark de los handlers del bot según el número de wallets del usuario.
+
+Ejecuta los handlers reales (/wallets, /check, /transfer y el envío de una
+private key a handle_messages) con updates sintéticos contra un nodo JSON-RPC
+falso con latencia configurable, la Bot API falsa y un Postgres desechable
+(BENCH_DATABASE_URL). Para cada número de wallets informa de la latencia de cada
+comando y de las llamadas RPC, a la base de datos y a Telegram que hace, y mide
+aparte el PBKDF2 de encryption.get_encryption_key. El resultado se guarda en JSON
+para poder comparar ejecuciones.
+
+/transfer solo encola la solicitud; el trabajo de verdad (desencriptar las
+claves, firmar y emitir cada transferencia) lo hace transfer_worker, así que los
+jobs que encola se procesan después con transfer_worker.process_jobs y se
+informa aparte como 'transfer_worker'. El seguimiento de los recibos no se mide.
+
+Uso:
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/handlers.py \\
+        [--wallets 1,10,100,1000] [--iterations 5] [--rpc-latency 0.02] [--output benchmarks/results/handlers.json]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    configure_env, start_server, message_data, latency_summary, delete_bench_users, seed_user,
+    BENCH_BOT_TOKEN, BENCH_USER_BASE
+)
+from mock_rpc import MockRpcServer  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+TOKEN_ADDRESS = '0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913'
+DESTINATION = '0x4200000000000000000000000000000000000006'
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'handlers.json')
+
+def time_pbkdf2(iterations):
+    """Tiempo medio de una derivación PBKDF2 de get_encryption_key (formato antiguo por wallet)"""
+    from encryption import get_encryption_key
+
+    samples = []
+    for _ in range(iterations):
+        salt = os.urandom(16)
+        started = time.perf_counter()
+        get_encryption_key(salt)
+        samples.append(time.perf_counter() - started)
+    return latency_summary(samples)
+
+def _diff_calls(before, after):
+    return {
+        method: after['calls'].get(method, 0) - before['calls'].get(method, 0)
+        for method in after['calls']
+        if after['calls'].get(method, 0) != before['calls'].get(method, 0)
+    }
+
+async def measure(application, handler, user_id, text_factory, iterations, warmup, rpc, bot_api):
+    """
+    Ejecutar un handler varias veces y medir latencia y llamadas externas
+
+    Returns:
+        dict: Resumen de latencias más la media por ejecución de peticiones RPC
+              (HTTP y por método), préstamos de conexión a Postgres y llamadas a Telegram
+    """
+    from telegram import Update
+    from telegram.ext import CallbackContext
+    from database import get_pool_stats
+
+    samples = []
+    rpc_requests = db_calls = telegram_calls = 0
+    rpc_calls = {}
+    for iteration in range(warmup + iterations):
+        update = Update.de_json(message_data(user_id, text_factory()), application.bot)
+        context = CallbackContext.from_update(update, application)
+        context.args = update.message.text.split()[1:]
+
+        rpc_before = rpc.snapshot()
+        db_before = get_pool_stats()['checkouts']
+        telegram_before = sum(bot_api.calls.values())
+        started = time.perf_counter()
+        await handler(update, context)
+        elapsed = time.perf_counter() - started
+        if iteration < warmup:
+            continue
+
+        samples.append(elapsed)
+        rpc_after = rpc.snapshot()
+        rpc_requests += rpc_after['requests'] - rpc_before['requests']
+        for method, count in _diff_calls(rpc_before, rpc_after).items():
+            rpc_calls[method] = rpc_calls.get(method, 0) + count
+        db_calls += get_pool_stats()['checkouts'] - db_before
+        telegram_calls += sum(bot_api.calls.values()) - telegram_before
+
+    return dict(
+        latency_summary(samples),
+        rpc_requests=rpc_requests / iterations,
+        rpc_calls={method: count / iterations for method, count in sorted(rpc_calls.items())},
+        db_calls=db_calls / iterations,
+        telegram_calls=telegram_calls / iterations,
+    )
+
+async def measure_worker(rpc, user_id):
+    """
+    Procesar con el worker de transferencias todos los jobs en cola
+
+    Los lotes se reclaman y procesan como en transfer_worker.consume, de uno en uno.
+
+    Returns:
+        dict: Jobs procesados, duración total, jobs por segundo, latencia por lote
+              y media por job de peticiones RPC, préstamos de conexión a Postgres y
+              resultados por estado
+    """
+    from database import run_db, claim_transfer_jobs, get_pool_stats
+    from transfer_worker import process_jobs, WORKER_ID, TRANSFER_WORKER_BATCH
+
+    rpc_before = rpc.snapshot()
+    db_before = get_pool_stats()['checkouts']
+    batches = []
+    jobs_done = 0
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        jobs = await run_db(claim_transfer_jobs, WORKER_ID, TRANSFER_WORKER_BATCH)
+        if not jobs:
+            break
+        await process_jobs(jobs)
+        batches.append(time.perf_counter() - batch_started)
+        jobs_done += len(jobs)
+    elapsed = time.perf_counter() - started
+    rpc_after = rpc.snapshot()
+    per_job = jobs_done or 1
+    return dict(
+        latency_summary(batches),
+        jobs=jobs_done,
+        duration_s=elapsed,
+        jobs_per_s=jobs_done / elapsed if elapsed else 0.0,
+        rpc_requests=(rpc_after['requests'] - rpc_before['requests']) / per_job,
+        rpc_calls={method: count / per_job for method, count in sorted(_diff_calls(rpc_before, rpc_after).items())},
+        db_calls=(get_pool_stats()['checkouts'] - db_before) / per_job,
+        statuses=await run_db(_job_statuses, user_id),
+    )
+
+def _job_statuses(user_id):
+    from database import db_connection
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT status, COUNT(*) FROM transfer_jobs WHERE user_id = %s GROUP BY status', (user_id,))
+        return dict(cur.fetchall())
+
+async def run(args, rpc, bot_api):
+    import virox_telegram as bot
+    from telegram.ext import Application
+    from web3_utils import rpc_pool
+    from crypto_pool import shutdown_crypto_pool
+
+    # El bot configura logging a INFO al importarse; aquí solo interesan los avisos
+    logging.getLogger().setLevel(logging.WARNING)
+
+    runners = [
+        await start_server(rpc.app, args.host, args.rpc_port),
+        await start_server(bot_api.app, args.host, args.bot_api_port),
+    ]
+    # Sin el planificador de mensajes: se mide el handler, no los límites de Telegram
+    application = (
+        Application.builder()
+        .token(BENCH_BOT_TOKEN)
+        .base_url(f'http://{args.host}:{args.bot_api_port}/bot')
+        .build()
+    )
+    await application.initialize()
+
+    commands = [
+        ('wallets', bot.wallets_command, lambda: '/wallets'),
+        ('check', bot.check_command, lambda: f'/check {TOKEN_ADDRESS}'),
+        ('transfer', bot.transfer_command, lambda: f'/transfer {TOKEN_ADDRESS}'),
+        # Va la última: cada ejecución añade una wallet al usuario
+        ('handle_messages', bot.handle_messages, lambda: '0x' + os.urandom(32).hex()),
+    ]
+    user_ids = [BENCH_USER_BASE + count for count in args.wallets]
+    results = {}
+    try:
+        await asyncio.to_thread(delete_bench_users, user_ids)
+        for count, user_id in zip(args.wallets, user_ids):
+            print(f"Preparando usuario con {count} wallets...", flush=True)
+            await seed_user(user_id, count, DESTINATION)
+            results[str(count)] = {}
+            for name, handler, text_factory in commands:
+                results[str(count)][name] = await measure(
+                    application, handler, user_id, text_factory, args.iterations, args.warmup, rpc, bot_api
+                )
+                summary = results[str(count)][name]
+                print(f"  {name:<16} p50 {summary['p50_ms']:>9.1f} ms  rpc {summary['rpc_requests']:>6.1f}  "
+                      f"db {summary['db_calls']:>6.1f}  telegram {summary['telegram_calls']:>4.1f}", flush=True)
+                if name == 'transfer':
+                    # Lo que /transfer dejó en la cola, como lo procesaría el worker
+                    worker = results[str(count)]['transfer_worker'] = await measure_worker(rpc, user_id)
+                    print(f"  {'transfer_worker':<16} {worker['jobs']:>6} jobs en {worker['duration_s']:>7.2f} s  "
+                          f"({worker['jobs_per_s']:>7.1f} jobs/s)  rpc/job {worker['rpc_requests']:>5.1f}  "
+                          f"db/job {worker['db_calls']:>5.1f}", flush=True)
+    finally:
+        await asyncio.to_thread(delete_bench_users, user_ids)
+        await application.shutdown()
+        await rpc_pool.close_async()
+        await asyncio.to_thread(shutdown_crypto_pool)
+        for runner in runners:
+            await runner.cleanup()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--wallets', default='1,10,100,1000',
+                        help='Números de wallets a probar, separados por comas')
+    parser.add_argument('--iterations', type=int, default=5, help='Ejecuciones medidas por comando')
+    parser.add_argument('--warmup', type=int, default=1, help='Ejecuciones previas sin medir por comando')
+    parser.add_argument('--rpc-latency', type=float, default=0.02, help='Latencia del nodo falso por petición (s)')
+    parser.add_argument('--pbkdf2-iterations', type=int, default=10, help='Derivaciones PBKDF2 a medir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--rpc-port', type=int, default=8546)
+    parser.add_argument('--bot-api-port', type=int, default=8081)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+    args.wallets = [int(count) for count in args.wallets.split(',')]
+
+    configure_env(f'http://{args.host}:{args.rpc_port}', f'http://{args.host}:{args.bot_api_port}')
+    rpc = MockRpcServer(latency=args.rpc_latency)
+    bot_api = FakeBotApi(chat_rate=0, global_rate=0)
+
+    pbkdf2 = time_pbkdf2(args.pbkdf2_iterations)
+    print(f"PBKDF2 (get_encryption_key): {pbkdf2['mean_ms']:.1f} ms de media", flush=True)
+    results = asyncio.run(run(args, rpc, bot_api))
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'rpc_latency_s': args.rpc_latency,
+        },
+        'pbkdf2': pbkdf2,
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Resultados guardados en {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Generador de carga de extremo a extremo: miles de usuarios de Telegram simulados.
+
+Cada usuario simulado se registra (/start, añadir wallet, enviar su private key,
+configurar el destino) y después repite una mezcla configurable de acciones
+(/check, /transfer, /wallets, botones, nuevas claves) con un tiempo de reflexión
+entre ellas, esperando siempre la respuesta del bot antes de seguir. Los updates
+entran por la cola de la aplicación real (los mismos handlers, planificador de
+mensajes y procesador de updates que en producción) y las respuestas se recogen
+en la Bot API falsa; la red es el nodo JSON-RPC falso y la base de datos un
+Postgres desechable (BENCH_DATABASE_URL).
+
+La carga sube por etapas (usuarios:segundos). Por etapa se informa del
+throughput, de la latencia p50/p95/p99 por acción y total, de los timeouts y del
+retraso del event loop, junto con las métricas del bot (/stats).
+
+Uso:
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/loadgen.py \\
+        [--stages 100:30,500:30,1000:60,2000:60] [--mix check:40,wallets:15,...] [--output benchmarks/results/loadgen.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    configure_env, start_server, message_data, callback_data, latency_summary, percentile,
+    delete_bench_users, BENCH_USER_BASE, SRC_DIR
+)
+from mock_rpc import MockRpcServer  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+TOKEN_ADDRESS = '0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913'
+DESTINATION = '0x4200000000000000000000000000000000000006'
+# Los usuarios de la prueba de carga no coinciden con los del benchmark de handlers
+LOADGEN_USER_BASE = BENCH_USER_BASE + 1_000_000
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'loadgen.json')
+DEFAULT_MIX = 'check:40,wallets:15,view_wallets:15,start:10,private_key:10,transfer:10'
+
+# Acción -> (función que crea los datos del update, mensajes que responde el bot)
+ACTIONS = {
+    'start': (lambda user_id: message_data(user_id, '/start'), 2),
+    'add_wallet': (lambda user_id: callback_data(user_id, 'add_wallet'), 1),
+    'private_key': (lambda user_id: message_data(user_id, '0x' + os.urandom(32).hex()), 1),
+    'set_destination': (lambda user_id: callback_data(user_id, 'set_destination'), 1),
+    'destination': (lambda user_id: message_data(user_id, DESTINATION), 1),
+    'view_wallets': (lambda user_id: callback_data(user_id, 'view_wallets'), 1),
+    'wallets': (lambda user_id: message_data(user_id, '/wallets'), 1),
+    'check': (lambda user_id: message_data(user_id, f'/check {TOKEN_ADDRESS}'), 1),
+    'transfer': (lambda user_id: message_data(user_id, f'/transfer {TOKEN_ADDRESS}'), 1),
+}
+ONBOARDING = ('start', 'add_wallet', 'private_key', 'set_destination', 'destination')
+
+class StageMetrics:
+    """Latencias, timeouts y retraso del event loop recogidos durante una etapa"""
+
+    def __init__(self, users, duration):
+        self.users = users
+        self.duration = duration
+        self.latencies = {}
+        self.timeouts = {}
+        self.loop_lag = []
+
+    def record(self, action, latency):
+        self.latencies.setdefault(action, []).append(latency)
+
+    def record_timeout(self, action):
+        self.timeouts[action] = self.timeouts.get(action, 0) + 1
+
+    def report(self, elapsed):
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {
+            'users': self.users,
+            'duration_s': elapsed,
+            'completed': len(all_latencies),
+            'throughput_per_s': len(all_latencies) / elapsed if elapsed else 0.0,
+            'timeouts': sum(self.timeouts.values()),
+            'latency': latency_summary(all_latencies),
+            'actions': {
+                action: dict(latency_summary(latencies), timeouts=self.timeouts.get(action, 0))
+                for action, latencies in sorted(self.latencies.items())
+            },
+            'loop_lag': {
+                'p50_ms': percentile(self.loop_lag, 0.50) * 1000,
+                'p99_ms': percentile(self.loop_lag, 0.99) * 1000,
+                'max_ms': max(self.loop_lag) * 1000 if self.loop_lag else 0.0,
+            },
+        }
+
+class LoadGenerator:
+    """
+    Usuarios simulados que envían updates a la aplicación y esperan sus respuestas.
+
+    Cada acción espera a que la Bot API falsa reciba los mensajes que el bot
+    responde a ese chat; la latencia es desde que el update entra en la cola de
+    la aplicación hasta el último de esos mensajes.
+
+    Las respuestas no dicen a qué update responden, así que las que faltaban
+    cuando una acción agotó su espera se esperan aparte antes de la siguiente
+    acción del usuario (como mucho reply_timeout más): así una respuesta tardía
+    no se cuenta como respuesta de la acción siguiente.
+    """
+
+    def __init__(self, application, mix, think_time, reply_timeout, seed):
+        self.application = application
+        self.mix = mix
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.seed = seed
+        self.stage = None
+        self.unexpected_messages = 0
+        # Respuestas que llegaron tras el timeout de su acción y las que nunca llegaron
+        self.late_replies = 0
+        self.lost_replies = 0
+        self._waiters = {}
+        # Usuario -> [respuestas tardías pendientes, future que se completa al recibirlas]
+        self._late = {}
+        self._users = []
+        self._stopping = asyncio.Event()
+
+    def on_message(self, chat_id, method):
+        """Llamado por la Bot API falsa por cada mensaje que el bot envía"""
+        late = self._late.get(chat_id)
+        if late is not None:
+            self.late_replies += 1
+            waiters = self._late
+        else:
+            waiters = self._waiters
+        waiter = waiters.get(chat_id)
+        if waiter is None:
+            self.unexpected_messages += 1
+            return
+        waiter[0] -= 1
+        if waiter[0] <= 0:
+            del waiters[chat_id]
+            if not waiter[1].done():
+                waiter[1].set_result(time.perf_counter())
+
+    async def _drain(self, user_id):
+        """Esperar las respuestas tardías de la acción anterior, o darlas por perdidas"""
+        late = self._late.get(user_id)
+        if late is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(late[1]), timeout=self.reply_timeout)
+        except asyncio.TimeoutError:
+            if self._late.pop(user_id, None) is not None:
+                self.lost_replies += late[0]
+
+    async def _act(self, user_id, action):
+        from telegram import Update
+
+        await self._drain(user_id)
+        make_data, replies = ACTIONS[action]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[user_id] = [replies, future]
+        update = Update.de_json(make_data(user_id), self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        try:
+            finished = await asyncio.wait_for(future, timeout=self.reply_timeout)
+            self.stage.record(action, finished - started)
+        except asyncio.TimeoutError:
+            waiter = self._waiters.pop(user_id, None)
+            if waiter is not None and waiter[0] > 0:
+                self._late[user_id] = [waiter[0], asyncio.get_running_loop().create_future()]
+            self.stage.record_timeout(action)
+
+    async def _user(self, user_id, spawn_delay):
+        rng = random.Random(self.seed * 1_000_003 + user_id)
+        actions, weights = zip(*self.mix.items())
+        await asyncio.sleep(spawn_delay)
+        for action in ONBOARDING:
+            if self._stopping.is_set():
+                return
+            await self._act(user_id, action)
+        while not self._stopping.is_set():
+            await asyncio.sleep(rng.expovariate(1 / self.think_time) if self.think_time > 0 else 0)
+            if self._stopping.is_set():
+                return
+            await self._act(user_id, rng.choices(actions, weights)[0])
+
+    def spawn(self, count, spawn_window):
+        """Añadir usuarios hasta tener count, repartiendo sus inicios en spawn_window segundos"""
+        while len(self._users) < count:
+            user_id = LOADGEN_USER_BASE + len(self._users)
+            delay = random.uniform(0, spawn_window)
+            self._users.append(asyncio.create_task(self._user(user_id, delay)))
+
+    async def stop(self):
+        self._stopping.set()
+        await asyncio.gather(*self._users, return_exceptions=True)
+
+async def monitor_loop_lag(generator, interval=0.05):
+    """Medir cuánto se retrasa el event loop respecto a un sleep de interval segundos"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        if generator.stage is not None:
+            generator.stage.loop_lag.append(max(0.0, loop.time() - started - interval))
+
+async def run(args, rpc, bot_api):
+    import virox_telegram as bot
+    from web3_utils import rpc_pool
+
+    logging.getLogger().setLevel(logging.WARNING)
+    runners = [
+        await start_server(rpc.app, args.host, args.rpc_port),
+        await start_server(bot_api.app, args.host, args.bot_api_port),
+    ]
+    application = bot.build_application()
+    generator = LoadGenerator(application, args.mix, args.think_time, args.reply_timeout, args.seed)
+    bot_api.on_message = generator.on_message
+    max_users = max(users for users, _ in args.stages)
+    user_ids = [LOADGEN_USER_BASE + index for index in range(max_users)]
+
+    stages = []
+    await asyncio.to_thread(delete_bench_users, user_ids)
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    lag_task = asyncio.create_task(monitor_loop_lag(generator))
+    try:
+        for users, duration in args.stages:
+            generator.stage = StageMetrics(users, duration)
+            rpc_before = rpc.snapshot()['requests']
+            rate_limited_before = bot_api.rate_limited
+            late_before, lost_before = generator.late_replies, generator.lost_replies
+            generator.spawn(users, args.spawn_window)
+            started = time.perf_counter()
+            await asyncio.sleep(duration)
+            report = generator.stage.report(time.perf_counter() - started)
+            report['rpc_requests'] = rpc.snapshot()['requests'] - rpc_before
+            report['telegram_rate_limited'] = bot_api.rate_limited - rate_limited_before
+            report['late_replies'] = generator.late_replies - late_before
+            report['lost_replies'] = generator.lost_replies - lost_before
+            report['bot_stats'] = bot.get_bot_stats()
+            stages.append(report)
+            print(f"{users:>6} usuarios  {report['throughput_per_s']:>8.1f} acciones/s  "
+                  f"p50 {report['latency']['p50_ms']:>8.1f} ms  p95 {report['latency']['p95_ms']:>8.1f} ms  "
+                  f"p99 {report['latency']['p99_ms']:>8.1f} ms  timeouts {report['timeouts']:>5}  "
+                  f"lag p99 {report['loop_lag']['p99_ms']:>7.1f} ms", flush=True)
+    finally:
+        generator.stage = None
+        lag_task.cancel()
+        await generator.stop()
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+        await rpc_pool.close_async()
+        await asyncio.to_thread(delete_bench_users, user_ids)
+        for runner in runners:
+            await runner.cleanup()
+    return stages, {
+        'unexpected_messages': generator.unexpected_messages,
+        'late_replies': generator.late_replies,
+        'lost_replies': generator.lost_replies,
+    }
+
+def parse_pairs(text, value_type):
+    """'a:1,b:2' -> [('a', 1), ('b', 2)]"""
+    pairs = []
+    for item in text.split(','):
+        key, value = item.split(':')
+        pairs.append((key.strip(), value_type(value)))
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stages', default='100:30,500:30,1000:60,2000:60',
+                        help='Etapas usuarios:segundos; los usuarios se acumulan de una etapa a la siguiente')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Peso de cada acción tras el registro')
+    parser.add_argument('--think-time', type=float, default=2.0, help='Tiempo medio entre acciones de un usuario (s)')
+    parser.add_argument('--spawn-window', type=float, default=5.0, help='Segundos en los que arrancan los usuarios nuevos')
+    parser.add_argument('--reply-timeout', type=float, default=30.0, help='Espera máxima de una respuesta (s)')
+    parser.add_argument('--rpc-latency', type=float, default=0.05, help='Latencia del nodo falso por petición (s)')
+    parser.add_argument('--telegram-chat-rate', type=float, default=1.0, help='Mensajes por segundo por chat')
+    parser.add_argument('--telegram-global-rate', type=float, default=30.0,
+                        help='Mensajes por segundo en total (en el planificador y en la Bot API falsa)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--rpc-port', type=int, default=8546)
+    parser.add_argument('--bot-api-port', type=int, default=8081)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+    args.stages = [(int(users), float(duration)) for users, duration in parse_pairs(args.stages, float)]
+    args.mix = dict(parse_pairs(args.mix, float))
+    unknown = set(args.mix) - set(ACTIONS)
+    if unknown:
+        parser.error(f"Acciones desconocidas en --mix: {', '.join(sorted(unknown))}")
+    output = os.path.abspath(args.output)
+
+    configure_env(f'http://{args.host}:{args.rpc_port}', f'http://{args.host}:{args.bot_api_port}')
+    os.environ['TELEGRAM_CHAT_RATE'] = str(args.telegram_chat_rate)
+    os.environ['TELEGRAM_GLOBAL_RATE'] = str(args.telegram_global_rate)
+    # El bot busca su logo con una ruta relativa a src/
+    os.chdir(SRC_DIR)
+
+    random.seed(args.seed)
+    rpc = MockRpcServer(latency=args.rpc_latency)
+    bot_api = FakeBotApi(chat_rate=args.telegram_chat_rate, global_rate=args.telegram_global_rate)
+    stages, replies = asyncio.run(run(args, rpc, bot_api))
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'stages': args.stages,
+            'mix': args.mix,
+            'think_time_s': args.think_time,
+            'rpc_latency_s': args.rpc_latency,
+            'telegram_chat_rate': args.telegram_chat_rate,
+            'telegram_global_rate': args.telegram_global_rate,
+            'seed': args.seed,
+        },
+        'stages': stages,
+        'replies': replies,
+        'bot_api': bot_api.stats(),
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True, default=str)
+    print(f"Resultados guardados en {output}")
+
+if __name__ == '__main__':
+    main()
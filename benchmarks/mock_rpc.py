@@ -0,0 +1,161 @@
+"""
+Servidor JSON-RPC falso de Base para benchmarks y pruebas de carga.
+
+Responde a lo que usa el bot (eth_call a Multicall3.aggregate3 y a tokens ERC20,
+batches de eth_getBalance y eth_getTransactionReceipt, y lo necesario para firmar
+y enviar transferencias) con datos deterministas y una latencia configurable por
+petición HTTP. Cuenta las peticiones HTTP y las llamadas por método, así que
+permite medir cuántas llamadas RPC hace cada comando. Con fail_status responde
+a todo con ese código HTTP, para simular un proveedor caído, y con
+revert_addresses el balanceOf de esas direcciones revierte.
+
+Uso:
+    python benchmarks/mock_rpc.py [--port 8546] [--latency 0.05]
+    BASE_RPC_URL=http://localhost:8546 python src/virox_telegram.py
+"""
+import json
+import asyncio
+import hashlib
+import argparse
+import logging
+from collections import defaultdict
+from aiohttp import web
+from eth_abi import encode, decode
+
+logger = logging.getLogger(__name__)
+
+CHAIN_ID = 8453
+MULTICALL3_ADDRESS = '0xca11bde05977b3631167028862be2a173976ca11'
+SELECTOR_AGGREGATE3 = bytes.fromhex('82ad56cb')
+SELECTOR_NAME = bytes.fromhex('06fdde03')
+SELECTOR_SYMBOL = bytes.fromhex('95d89b41')
+SELECTOR_DECIMALS = bytes.fromhex('313ce567')
+SELECTOR_BALANCE_OF = bytes.fromhex('70a08231')
+SELECTOR_TRANSFER = bytes.fromhex('a9059cbb')
+BLOCK_NUMBER = 20_000_000
+
+def mock_balance(address):
+    """Balance determinista de una dirección; una de cada cuatro queda a cero"""
+    value = int(address, 16)
+    return 0 if value % 4 == 0 else (value % 1000 + 1) * 10 ** 15
+
+class MockRpcServer:
+    """Nodo JSON-RPC en memoria con latencia y fallos configurables y contadores por método"""
+
+    def __init__(self, latency=0.0, token_decimals=18, fail_status=None, revert_addresses=()):
+        self.latency = latency
+        # Código HTTP con el que fallan todas las peticiones (None: responder con normalidad)
+        self.fail_status = fail_status
+        # Direcciones (minúsculas) cuyo balanceOf revierte
+        self.revert_addresses = {address.lower() for address in revert_addresses}
+        self.token_decimals = token_decimals
+        self.requests = 0
+        self.calls = defaultdict(int)
+        self.app = web.Application()
+        self.app.router.add_post('/', self.handle)
+        self.app.router.add_get('/_stats', self.handle_stats)
+
+    def reset(self):
+        self.requests = 0
+        self.calls.clear()
+
+    def snapshot(self):
+        """Copia de los contadores, para restarla después de una medición"""
+        return {'requests': self.requests, 'calls': dict(self.calls)}
+
+    async def handle(self, request):
+        body = await request.json()
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_status is not None:
+            return web.json_response({'error': 'fallo simulado'}, status=self.fail_status)
+        if isinstance(body, list):
+            return web.json_response([self._respond(item) for item in body])
+        return web.json_response(self._respond(body))
+
+    async def handle_stats(self, request):
+        return web.json_response(self.snapshot(), dumps=lambda data: json.dumps(data, indent=2))
+
+    def _respond(self, item):
+        method = item.get('method')
+        self.calls[method] += 1
+        try:
+            result = self._call(method, item.get('params') or [])
+        except NotImplementedError:
+            return {'jsonrpc': '2.0', 'id': item.get('id'),
+                    'error': {'code': -32601, 'message': f'Método no soportado: {method}'}}
+        return {'jsonrpc': '2.0', 'id': item.get('id'), 'result': result}
+
+    def _call(self, method, params):
+        if method == 'eth_chainId':
+            return hex(CHAIN_ID)
+        if method == 'eth_blockNumber':
+            return hex(BLOCK_NUMBER)
+        if method == 'eth_gasPrice':
+            return hex(10 ** 7)
+        if method == 'eth_estimateGas':
+            return hex(65000)
+        if method == 'eth_getTransactionCount':
+            return '0x0'
+        if method == 'eth_getBalance':
+            return hex(mock_balance(params[0]))
+        if method == 'eth_call':
+            call = params[0]
+            data = bytes.fromhex((call.get('data') or call.get('input') or '0x')[2:])
+            return '0x' + self._eth_call(call['to'].lower(), data).hex()
+        if method == 'eth_sendRawTransaction':
+            return '0x' + hashlib.sha256(bytes.fromhex(params[0][2:])).hexdigest()
+        if method == 'eth_getTransactionReceipt':
+            return {
+                'transactionHash': params[0], 'status': '0x1', 'blockNumber': hex(BLOCK_NUMBER),
+                'blockHash': '0x' + '11' * 32, 'gasUsed': hex(52000), 'logs': [],
+            }
+        if method == 'eth_getBlockByNumber':
+            number = BLOCK_NUMBER if params[0] == 'latest' else int(params[0], 16)
+            return {'number': hex(number), 'hash': '0x' + number.to_bytes(32, 'big').hex(),
+                    'parentHash': '0x' + (number - 1).to_bytes(32, 'big').hex(),
+                    'timestamp': hex(1700000000 + number), 'transactions': []}
+        if method == 'eth_getLogs':
+            return []
+        raise NotImplementedError(method)
+
+    def _eth_call(self, target, data):
+        if target == MULTICALL3_ADDRESS and data[:4] == SELECTOR_AGGREGATE3:
+            (calls,) = decode(['(address,bool,bytes)[]'], data[4:])
+            results = [self._token_call(call_data) for _, _, call_data in calls]
+            return encode(['(bool,bytes)[]'], [results])
+        return self._token_call(data)[1]
+
+    def _token_call(self, data):
+        """Respuesta (success, return_data) de un token ERC20 falso"""
+        selector = data[:4]
+        if selector == SELECTOR_NAME:
+            return True, encode(['string'], ['Mock Token'])
+        if selector == SELECTOR_SYMBOL:
+            return True, encode(['string'], ['MOCK'])
+        if selector == SELECTOR_DECIMALS:
+            return True, encode(['uint8'], [self.token_decimals])
+        if selector == SELECTOR_BALANCE_OF:
+            address = '0x' + data[16:36].hex()
+            if address in self.revert_addresses:
+                return False, b''
+            return True, encode(['uint256'], [mock_balance(address)])
+        if selector == SELECTOR_TRANSFER:
+            return True, encode(['bool'], [True])
+        return False, b''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8546)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia añadida por petición HTTP (s)')
+    parser.add_argument('--fail-status', type=int, default=None, help='Responder a todo con este código HTTP')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    server = MockRpcServer(latency=args.latency, fail_status=args.fail_status)
+    web.run_app(server.app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+import functools
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Comandos que un mismo usuario puede tener en curso a la vez
+ADMISSION_MAX_INFLIGHT_PER_USER = int(os.getenv('ADMISSION_MAX_INFLIGHT_PER_USER', '2'))
+
+class AdmissionController:
+    """
+    Control de admisión de los comandos costosos del bot.
+
+    Limita los comandos en curso por usuario y agrupa los duplicados de un
+    comando que ya se está procesando para el mismo (usuario, comando, argumentos):
+    el duplicado no hace trabajo propio, espera al comando en curso y devuelve su
+    resultado (o lanza su error), así que el usuario recibe una sola respuesta, la
+    del primero.
+
+    Solo tiene sentido para los comandos de UPDATE_CONCURRENT_COMMANDS: los demás,
+    como /transfer, ya los procesa PerUserUpdateProcessor de uno en uno por
+    usuario, así que nunca tienen otro en curso con el que solaparse o agruparse.
+    """
+
+    def __init__(self, max_per_user=ADMISSION_MAX_INFLIGHT_PER_USER):
+        self.max_per_user = max_per_user
+        self._per_user = {}
+        # (usuario, comando, argumentos) -> future con el resultado del comando en curso
+        self._in_flight = {}
+        self._admitted = 0
+        self._coalesced = 0
+        self._rejected = 0
+
+    def guard(self, command, handler):
+        """Envolver un handler de PTB con el control de admisión"""
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            user = update.effective_user
+            if user is None:
+                return await handler(update, context)
+
+            # Todos los argumentos: /transfer status 1 y /transfer status 2 no son duplicados
+            arguments = ' '.join(context.args or []).lower()
+            key = (user.id, command, arguments)
+            running = self._in_flight.get(key)
+            if running is not None:
+                self._coalesced += 1
+                # shield: cancelar el duplicado no cancela el comando en curso
+                return await asyncio.shield(running)
+            if self._per_user.get(user.id, 0) >= self.max_per_user:
+                self._rejected += 1
+                logger.info(f"Comando /{command} rechazado para usuario {user.id}: demasiados en curso")
+                await update.effective_message.reply_text(
+                    "⏳ Tienes demasiados comandos en curso. Espera a que terminen e inténtalo de nuevo."
+                )
+                return
+
+            self._admitted += 1
+            future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+            self._per_user[user.id] = self._per_user.get(user.id, 0) + 1
+            try:
+                result = await handler(update, context)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                # Los duplicados reciben el mismo error; si no hay ninguno, no se avisa de que nadie lo leyó
+                future.set_exception(e)
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                del self._in_flight[key]
+                # Sin comandos en curso el usuario no ocupa memoria
+                remaining = self._per_user[user.id] - 1
+                if remaining:
+                    self._per_user[user.id] = remaining
+                else:
+                    del self._per_user[user.id]
+        return wrapper
+
+    def stats(self):
+        """Obtener comandos en curso, admitidos, agrupados y rechazados"""
+        return {
+            'in_flight': len(self._in_flight),
+            'users_in_flight': len(self._per_user),
+            'admitted': self._admitted,
+            'coalesced': self._coalesced,
+            'rejected': self._rejected,
+        }
+
+admission = AdmissionController()
@@ -0,0 +1,95 @@
+import os
+import logging
+from dotenv import load_dotenv
+from web3 import Web3
+from database import run_db, get_indexer_state, get_indexed_balances, seed_token_balances
+from web3_utils import get_token_balances, get_token_balances_async, get_token_metadata, get_token_metadata_async
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima (segundos) del cursor del indexador para servir balances desde el índice
+INDEX_MAX_STALENESS = float(os.getenv('INDEX_MAX_STALENESS', '30'))
+# Bloques que el cursor puede ir por detrás de la cabeza de la cadena: mientras el
+# indexador se pone al día actualiza el cursor a menudo, pero sigue atrasado
+INDEX_MAX_LAG_BLOCKS = int(os.getenv('INDEX_MAX_LAG_BLOCKS', '5'))
+
+def _fresh_cursor():
+    """Bloque del cursor del indexador si está al día, o None"""
+    try:
+        state = get_indexer_state()
+    except Exception as e:
+        logger.warning(f"No se pudo leer el estado del indexador: {e}")
+        return None
+    if state is None or state['age'] > INDEX_MAX_STALENESS:
+        return None
+    if state['lag'] is None or state['lag'] > INDEX_MAX_LAG_BLOCKS:
+        return None
+    return state['block_number']
+
+def get_check_balances(addresses, token_address):
+    """
+    Obtener los balances de un token para /check, desde el índice si es posible
+
+    Si el indexador está al día y todas las direcciones están indexadas para el
+    token, no se hace ninguna llamada de balance a la red. Si falta alguna, se
+    leen todas con Multicall3 en el bloque del cursor y se siembran en el índice
+    para que el indexador las mantenga a partir de ahí.
+
+    Returns:
+        dict: Igual que get_token_balances, con 'source' ('index' o 'rpc')
+    """
+    token = Web3.to_checksum_address(token_address)
+    addresses = [Web3.to_checksum_address(address) for address in addresses]
+    block_number = _fresh_cursor()
+    if block_number is None:
+        return dict(get_token_balances(addresses, token), source='rpc')
+
+    indexed = get_indexed_balances(token, addresses)
+    if all(address.lower() in indexed for address in addresses):
+        return _indexed_result(get_token_metadata(token), addresses, indexed)
+
+    result = get_token_balances(addresses, token, block_identifier=block_number)
+    _seed_missing(token, result, indexed, block_number)
+    return dict(result, source='rpc')
+
+async def get_check_balances_async(addresses, token_address):
+    """Versión async de get_check_balances"""
+    token = Web3.to_checksum_address(token_address)
+    addresses = [Web3.to_checksum_address(address) for address in addresses]
+    block_number = await run_db(_fresh_cursor)
+    if block_number is None:
+        return dict(await get_token_balances_async(addresses, token), source='rpc')
+
+    indexed = await run_db(get_indexed_balances, token, addresses)
+    if all(address.lower() in indexed for address in addresses):
+        return _indexed_result(await get_token_metadata_async(token), addresses, indexed)
+
+    result = await get_token_balances_async(addresses, token, block_identifier=block_number)
+    await run_db(_seed_missing, token, result, indexed, block_number)
+    return dict(result, source='rpc')
+
+def _indexed_result(metadata, addresses, indexed):
+    wallets = []
+    for address in addresses:
+        balance = indexed[address.lower()]
+        wallets.append({
+            'address': address,
+            'balance': balance,
+            'readable_balance': balance / (10 ** metadata['decimals']),
+            'error': None,
+        })
+    return {'token': metadata, 'wallets': wallets, 'source': 'index'}
+
+def _seed_missing(token, result, indexed, block_number):
+    missing = {
+        wallet['address']: wallet['balance']
+        for wallet in result['wallets']
+        if wallet['error'] is None and wallet['address'].lower() not in indexed
+    }
+    try:
+        if missing and not seed_token_balances(token, missing, block_number):
+            logger.info(f"El indexador avanzó mientras se sembraba {token}; se sembrará en la próxima consulta")
+    except Exception as e:
+        logger.warning(f"Error al sembrar balances de {token}: {e}")
@@ -0,0 +1,103 @@
+import os
+import re
+import logging
+from dotenv import load_dotenv
+from database import save_wallets_bulk_async, get_or_create_user_data_key_async
+from encryption import new_wrapped_data_key, unwrap_data_key, KEY_VERSION_ENVELOPE
+from crypto_pool import encrypt_new_wallets
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Límites de una importación en bloque
+BULK_IMPORT_MAX_KEYS = int(os.getenv('BULK_IMPORT_MAX_KEYS', '5000'))
+BULK_IMPORT_MAX_BYTES = int(os.getenv('BULK_IMPORT_MAX_BYTES', str(1024 * 1024)))
+
+_KEY_PATTERN = re.compile(r'^(0x)?[0-9a-fA-F]{64}$')
+_HEX_PATTERN = re.compile(r'^(0x)?[0-9a-fA-F]+$')
+_SEPARATORS = re.compile(r'[\s,;]+')
+
+def parse_private_keys(text):
+    """
+    Extraer las claves privadas de un texto pegado o de un fichero TXT/CSV
+
+    Se separa por espacios, saltos de línea, comas y puntos y coma. Los fragmentos
+    hexadecimales de longitud incorrecta cuentan como inválidos; el resto (por
+    ejemplo las cabeceras de un CSV) se ignora.
+
+    Returns:
+        tuple: (claves normalizadas y sin repetir, duplicadas en el texto, inválidas)
+    """
+    keys = []
+    seen = set()
+    duplicates = 0
+    invalid = 0
+    for token in _SEPARATORS.split(text):
+        token = token.strip('"\'')
+        if not token:
+            continue
+        if _KEY_PATTERN.match(token):
+            key = '0x' + token[-64:].lower()
+            if key in seen:
+                duplicates += 1
+            else:
+                seen.add(key)
+                keys.append(key)
+        elif _HEX_PATTERN.match(token) and len(token) >= 32:
+            invalid += 1
+    return keys, duplicates, invalid
+
+def is_key_list(text):
+    """
+    Indicar si un mensaje es una lista de claves para importar en bloque
+
+    Tiene que tener varios fragmentos (con los mismos separadores que
+    parse_private_keys) y alguno con forma de clave privada (64 caracteres hex).
+    """
+    tokens = [token.strip('"\'') for token in _SEPARATORS.split(text)]
+    tokens = [token for token in tokens if token]
+    return len(tokens) > 1 and any(_KEY_PATTERN.match(token) for token in tokens)
+
+async def import_private_keys(user_id, text):
+    """
+    Importar en bloque las claves privadas de un texto
+
+    Las claves se validan y encriptan en paralelo en el executor de criptografía y
+    se guardan con un único INSERT multi-fila en una transacción.
+
+    Returns:
+        dict: Contadores added, duplicate e invalid
+    """
+    keys, duplicates, invalid = parse_private_keys(text)
+    if len(keys) > BULK_IMPORT_MAX_KEYS:
+        raise ValueError(f"Como máximo se pueden importar {BULK_IMPORT_MAX_KEYS} claves a la vez")
+    if not keys:
+        return {'added': 0, 'duplicate': duplicates, 'invalid': invalid}
+
+    wrapped_key = await get_or_create_user_data_key_async(user_id, new_wrapped_data_key())
+    data_key = unwrap_data_key(wrapped_key)
+
+    rows = []
+    for result in await encrypt_new_wallets(keys, data_key):
+        if result['error']:
+            invalid += 1
+            continue
+        rows.append((result['address'], result['encrypted_key'], '', KEY_VERSION_ENVELOPE))
+
+    inserted = await save_wallets_bulk_async(user_id, rows)
+    duplicates += len(rows) - len(inserted)
+    logger.info(
+        f"Importación en bloque para usuario {user_id}: "
+        f"{len(inserted)} añadidas, {duplicates} duplicadas, {invalid} inválidas"
+    )
+    return {'added': len(inserted), 'duplicate': duplicates, 'invalid': invalid}
+
+def format_import_summary(summary):
+    """Formatear el resumen de una importación en bloque"""
+    return (
+        "📥 Importación completada\n"
+        f"✅ Añadidas: {summary['added']}\n"
+        f"♻️ Duplicadas: {summary['duplicate']}\n"
+        f"❌ Inválidas: {summary['invalid']}"
+    )
@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from eth_account import Account
+from dotenv import load_dotenv
+from encryption import decrypt_wallet_key, encrypt_with_data_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tipo de executor para el trabajo de CPU: 'thread' o 'process'
+CRYPTO_EXECUTOR = os.getenv('CRYPTO_EXECUTOR', 'thread')
+CRYPTO_WORKERS = int(os.getenv('CRYPTO_WORKERS', str(os.cpu_count() or 1)))
+# Máximo de tareas de criptografía en vuelo desde el event loop
+CRYPTO_MAX_CONCURRENCY = int(os.getenv('CRYPTO_MAX_CONCURRENCY', str(CRYPTO_WORKERS * 2)))
+
+_executor = None
+_executor_lock = threading.Lock()
+_semaphores = {}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if CRYPTO_EXECUTOR == 'process':
+                    _executor = ProcessPoolExecutor(max_workers=CRYPTO_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix='crypto')
+                logger.info(f"Executor de criptografía creado ({CRYPTO_EXECUTOR}, {CRYPTO_WORKERS} workers)")
+    return _executor
+
+def _get_semaphore():
+    # Un semáforo por event loop: asyncio.Semaphore no se puede compartir entre loops
+    loop = asyncio.get_running_loop()
+    # Los scripts abren un loop por llamada (run_sync): los cerrados se olvidan
+    for stale in [stale for stale in list(_semaphores) if stale.is_closed()]:
+        _semaphores.pop(stale, None)
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(CRYPTO_MAX_CONCURRENCY)
+    return semaphore
+
+def shutdown_crypto_pool():
+    """Detener el executor de criptografía"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+async def run_crypto(func, *args):
+    """Ejecutar una función de CPU en el executor respetando el límite de concurrencia"""
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+
+# Funciones de nivel de módulo para que se puedan serializar hacia el pool de procesos
+
+def _unlock_wallets(wallets, data_key):
+    results = []
+    for wallet in wallets:
+        try:
+            private_key = decrypt_wallet_key(wallet, data_key)
+            results.append({
+                'address': Account.from_key(private_key).address,
+                'private_key': private_key,
+                'error': None,
+            })
+        except Exception as e:
+            results.append({'address': wallet['address'], 'private_key': None, 'error': str(e)})
+    return results
+
+def _encrypt_new_wallet(private_key, data_key):
+    address = Account.from_key(private_key).address
+    return address, encrypt_with_data_key(private_key, data_key, address)
+
+def _encrypt_new_wallets(private_keys, data_key):
+    results = []
+    for private_key in private_keys:
+        try:
+            address, encrypted_key = _encrypt_new_wallet(private_key, data_key)
+            results.append({'address': address, 'encrypted_key': encrypted_key, 'error': None})
+        except Exception as e:
+            results.append({'address': None, 'encrypted_key': None, 'error': str(e)})
+    return results
+
+def _split(items):
+    # Un trozo por worker para no pagar una tarea por elemento
+    chunk_size = -(-len(items) // CRYPTO_WORKERS)
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+async def decrypt_wallets(wallets, data_key):
+    """
+    Desencriptar todas las wallets de un usuario y derivar sus direcciones
+
+    Args:
+        wallets: Filas de get_user_wallets
+        data_key: Data key del usuario ya desenvuelta (None si solo tiene wallets antiguas)
+
+    Returns:
+        list: Un dict por wallet, en el mismo orden, con address, private_key y error
+    """
+    if not wallets:
+        return []
+    results = await asyncio.gather(*(run_crypto(_unlock_wallets, chunk, data_key) for chunk in _split(wallets)))
+    return [wallet for chunk in results for wallet in chunk]
+
+async def encrypt_new_wallet(private_key, data_key):
+    """
+    Validar una clave privada nueva y encriptarla con la data key del usuario
+
+    Returns:
+        tuple: (dirección, clave encriptada)
+    """
+    return await run_crypto(_encrypt_new_wallet, private_key, data_key)
+
+async def encrypt_new_wallets(private_keys, data_key):
+    """
+    Validar y encriptar en paralelo una lista de claves privadas nuevas
+
+    Returns:
+        list: Un dict por clave, en el mismo orden, con address, encrypted_key y error
+    """
+    if not private_keys:
+        return []
+    results = await asyncio.gather(
+        *(run_crypto(_encrypt_new_wallets, chunk, data_key) for chunk in _split(private_keys))
+    )
+    return [wallet for chunk in results for wallet in chunk]
@@ -1,8 +1,18 @@
 import os
+import time
+import select
+import asyncio
+import threading
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2 import pool as pg_pool, sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import DictCursor, execute_values
 from dotenv import load_dotenv
 import logging
+from user_cache import user_cache, USER_CACHE_CHANNEL
 
 # Configuración de logging
 logging.basicConfig(
@@ -13,169 +23,650 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Configuración del pool de conexiones
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Segundos de inactividad tras los cuales se verifica la conexión antes de entregarla
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+
+def get_database_url():
+    """Obtener la URL de la base de datos desde las variables de entorno"""
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL no está configurada en las variables de entorno")
+    return database_url
+
 def get_db_connection():
-    """Obtener conexión a la base de datos PostgreSQL"""
+    """Obtener una conexión dedicada (fuera del pool) a la base de datos PostgreSQL"""
     try:
-        # Intentar obtener la URL de la base de datos
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-            raise ValueError("DATABASE_URL no está configurada en las variables de entorno")
-        
-        # Establecer la conexión
-        conn = psycopg2.connect(database_url)
+        conn = psycopg2.connect(get_database_url())
         logger.info("Conexión a la base de datos establecida exitosamente")
         return conn
     except Exception as e:
         logger.error(f"Error al conectar a la base de datos: {e}")
         raise
 
+class ConnectionPool:
+    """
+    Pool de conexiones PostgreSQL con health checks y estadísticas.
+
+    Envuelve un ThreadedConnectionPool de psycopg2: cuando todas las conexiones
+    están en uso, los llamadores esperan (hasta DB_POOL_TIMEOUT) en lugar de
+    recibir un PoolError inmediato.
+    """
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._discarded = 0
+        self._total_checkout_time = 0.0
+        self._max_checkout_time = 0.0
+
+    def _is_healthy(self, conn):
+        """Verificar que la conexión sigue viva si lleva tiempo inactiva"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Conexión descartada por health check fallido: {e}")
+            return False
+
+    def _discard(self, conn):
+        """Cerrar una conexión y sacarla del pool"""
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self._discarded += 1
+
+    def getconn(self):
+        """Obtener una conexión sana del pool, esperando si está agotado"""
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise pg_pool.PoolError(
+                f"Tiempo de espera agotado ({self.timeout}s) para obtener una conexión del pool"
+            )
+
+        try:
+            # Como mucho se recorre el pool entero más una conexión nueva
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                self._discard(conn)
+            else:
+                raise psycopg2.OperationalError("No se pudo obtener una conexión sana del pool")
+        except Exception:
+            self._slots.release()
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_checkout_time += elapsed
+            self._max_checkout_time = max(self._max_checkout_time, elapsed)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Devolver una conexión al pool (o cerrarla si está rota)"""
+        try:
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        """Cerrar todas las conexiones del pool"""
+        self._pool.closeall()
+        self._last_used.clear()
+
+    def stats(self):
+        """Obtener estadísticas de uso del pool"""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'discarded': self._discarded,
+                'avg_checkout_ms': (self._total_checkout_time / checkouts * 1000) if checkouts else 0.0,
+                'max_checkout_ms': self._max_checkout_time * 1000,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Obtener (creando si hace falta) el pool de conexiones global"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_database_url())
+                logger.info(f"Pool de conexiones creado (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+    return _pool
+
+def close_pool():
+    """Cerrar el pool de conexiones global"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logger.info("Pool de conexiones cerrado")
+
+@contextmanager
+def db_connection():
+    """Context manager que presta una conexión del pool y la devuelve al terminar"""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+# Executor dedicado para las llamadas a la base de datos desde código async
+_db_executor = None
+_queued_calls = 0
+_queued_lock = threading.Lock()
+
+def _get_executor():
+    global _db_executor
+    if _db_executor is None:
+        with _pool_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix='db')
+    return _db_executor
+
+def _run_dequeued(func, *args, **kwargs):
+    global _queued_calls
+    with _queued_lock:
+        _queued_calls -= 1
+    return func(*args, **kwargs)
+
+async def run_db(func, *args, **kwargs):
+    """Ejecutar una función de base de datos en el executor sin bloquear el event loop"""
+    global _queued_calls
+    with _queued_lock:
+        _queued_calls += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(),
+        functools.partial(_run_dequeued, func, *args, **kwargs)
+    )
+
+def get_pool_stats():
+    """
+    Obtener estadísticas del pool de conexiones
+
+    Returns:
+        dict: conexiones en uso, hilos esperando conexión, llamadas async en cola
+              y latencia de checkout (media y máxima, en ms)
+    """
+    stats = get_pool().stats()
+    with _queued_lock:
+        stats['queued'] = _queued_calls
+    return stats
+
+def ping_db():
+    """Comprobar que el pool puede prestar una conexión que responde"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        conn.rollback()
+    return True
+
+def _notify_user_change(cur, user_id):
+    """Avisar a las demás instancias (al hacer commit) de que cambiaron los datos de un usuario"""
+    cur.execute('SELECT pg_notify(%s, %s)', (USER_CACHE_CHANNEL, str(user_id)))
+
+# Escucha de LISTEN/NOTIFY para invalidar la caché de usuarios entre instancias
+USER_CACHE_LISTEN = os.getenv('USER_CACHE_LISTEN', 'true').lower() == 'true'
+_listener_thread = None
+_listener_stop = threading.Event()
+
+def _listen_for_invalidations():
+    while not _listener_stop.is_set():
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL('LISTEN {}').format(sql.Identifier(USER_CACHE_CHANNEL)))
+            # Mientras no se escuchaba se pudieron perder avisos
+            user_cache.clear()
+            logger.info(f"Escuchando invalidaciones de caché en el canal {USER_CACHE_CHANNEL}")
+
+            while not _listener_stop.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        user_cache.invalidate(int(notify.payload))
+                    except ValueError:
+                        user_cache.clear()
+        except Exception as e:
+            logger.error(f"Error en la escucha de invalidaciones de caché: {e}")
+            user_cache.clear()
+            _listener_stop.wait(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def start_user_cache_listener():
+    """Arrancar el hilo que aplica las invalidaciones de caché enviadas por otras instancias"""
+    global _listener_thread
+    if not USER_CACHE_LISTEN:
+        return
+    if _listener_thread is None or not _listener_thread.is_alive():
+        _listener_stop.clear()
+        _listener_thread = threading.Thread(
+            target=_listen_for_invalidations, name='user-cache-listener', daemon=True
+        )
+        _listener_thread.start()
+
+def stop_user_cache_listener():
+    """Detener el hilo de invalidaciones de caché"""
+    _listener_stop.set()
+
+def get_user_cache_stats():
+    """Obtener aciertos, fallos e invalidaciones de la caché de usuarios"""
+    return user_cache.stats()
+
 def init_db():
     """Inicializar la base de datos"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Crear tabla de wallets
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS wallets (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                address TEXT NOT NULL,
-                private_key TEXT NOT NULL,
-                salt TEXT NOT NULL,
-                is_default BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, address)
-            )
-        ''')
-        
-        # Crear tabla de destinos
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS destinations (
-                user_id BIGINT PRIMARY KEY,
-                address TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        logger.info("Base de datos inicializada correctamente")
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+
+                # Crear tabla de wallets
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS wallets (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        address TEXT NOT NULL,
+                        private_key TEXT NOT NULL,
+                        salt TEXT NOT NULL,
+                        is_default BOOLEAN DEFAULT FALSE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE(user_id, address)
+                    )
+                ''')
+
+                # Versión del formato de encriptación de cada fila (1 = Fernet por salt, 2 = envelope)
+                cur.execute('ALTER TABLE wallets ADD COLUMN IF NOT EXISTS key_version INTEGER NOT NULL DEFAULT 1')
+
+                # Crear tabla de data keys por usuario (envueltas con la master key)
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS user_keys (
+                        user_id BIGINT PRIMARY KEY,
+                        wrapped_key TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                # Crear tabla de destinos
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS destinations (
+                        user_id BIGINT PRIMARY KEY,
+                        address TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                # Crear tabla de metadata de tokens (name/symbol/decimals no cambian)
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS token_metadata (
+                        address TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        symbol TEXT NOT NULL,
+                        decimals INTEGER NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+                # Estado de conversación por usuario (backend 'postgres' de state_store.py)
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS user_states (
+                        user_id BIGINT PRIMARY KEY,
+                        state TEXT NOT NULL,
+                        expires_at TIMESTAMP NOT NULL
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS user_states_expires_idx ON user_states (expires_at)')
+
+                # Cola de transferencias: una solicitud por /transfer y un job por wallet
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS transfer_requests (
+                        id SERIAL PRIMARY KEY,
+                        idempotency_key TEXT NOT NULL UNIQUE,
+                        user_id BIGINT NOT NULL,
+                        token TEXT NOT NULL,
+                        destination TEXT NOT NULL,
+                        chat_id BIGINT,
+                        message_id BIGINT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS transfer_requests_user_idx ON transfer_requests (user_id, id)')
+                # Instancia del bot que edita el mensaje de progreso y cuándo renovó su reserva
+                cur.execute('ALTER TABLE transfer_requests ADD COLUMN IF NOT EXISTS tracked_by TEXT')
+                cur.execute('ALTER TABLE transfer_requests ADD COLUMN IF NOT EXISTS tracked_at TIMESTAMP')
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS transfer_jobs (
+                        id SERIAL PRIMARY KEY,
+                        request_id INTEGER NOT NULL REFERENCES transfer_requests (id) ON DELETE CASCADE,
+                        idempotency_key TEXT NOT NULL UNIQUE,
+                        user_id BIGINT NOT NULL,
+                        address TEXT NOT NULL,
+                        token TEXT NOT NULL,
+                        destination TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        locked_by TEXT,
+                        locked_at TIMESTAMP,
+                        sent_at TIMESTAMP,
+                        checked_at TIMESTAMP,
+                        tx_hash TEXT,
+                        nonce BIGINT,
+                        readable_balance DOUBLE PRECISION,
+                        error TEXT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS transfer_jobs_queue_idx ON transfer_jobs (status, run_after)')
+                cur.execute('CREATE INDEX IF NOT EXISTS transfer_jobs_request_idx ON transfer_jobs (request_id, id)')
+
+                # Índice de balances ERC20 mantenido por src/indexer.py
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS token_balances (
+                        token TEXT NOT NULL,
+                        address TEXT NOT NULL,
+                        balance NUMERIC(78, 0) NOT NULL,
+                        block_number BIGINT NOT NULL,
+                        seeded_block BIGINT NOT NULL,
+                        PRIMARY KEY (token, address)
+                    )
+                ''')
+
+                # Deltas aplicados en los bloques recientes, para deshacerlos si hay un reorg
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS balance_deltas (
+                        block_number BIGINT NOT NULL,
+                        token TEXT NOT NULL,
+                        address TEXT NOT NULL,
+                        delta NUMERIC(78, 0) NOT NULL
+                    )
+                ''')
+                cur.execute('CREATE INDEX IF NOT EXISTS balance_deltas_block_idx ON balance_deltas (block_number)')
+
+                # Hashes de los bloques recientes indexados y cursor del indexador
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS indexed_blocks (
+                        block_number BIGINT PRIMARY KEY,
+                        block_hash TEXT NOT NULL
+                    )
+                ''')
+                # Nonces por dirección compartidos entre los workers de transferencias
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS wallet_nonces (
+                        address TEXT PRIMARY KEY,
+                        next_nonce BIGINT,
+                        released BIGINT[] NOT NULL DEFAULT '{}',
+                        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS indexer_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        block_number BIGINT NOT NULL,
+                        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Cabeza de la cadena vista en la última escritura del cursor, para medir el retraso en bloques
+                cur.execute('ALTER TABLE indexer_state ADD COLUMN IF NOT EXISTS head_block BIGINT')
+
+                conn.commit()
+                logger.info("Base de datos inicializada correctamente")
+            except Exception:
+                conn.rollback()
+                raise
     except Exception as e:
         logger.error(f"Error al inicializar la base de datos: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def save_wallet(user_id: int, address: str, private_key: bytes, salt: str) -> bool:
+def save_wallet(user_id: int, address: str, private_key, salt: str, key_version: int = 1) -> bool:
     """
     Guardar una wallet en la base de datos
-    
+
     Args:
         user_id: ID del usuario de Telegram
         address: Dirección de la wallet
         private_key: Clave privada encriptada
-        salt: Salt usado para la encriptación
-    
+        salt: Salt usado para la encriptación (vacío en el formato envelope)
+        key_version: Versión del formato de encriptación de private_key
+
     Returns:
         bool: True si se guardó correctamente, False en caso contrario
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Verificar si el usuario ya tiene wallets
-        cur.execute('SELECT COUNT(*) FROM wallets WHERE user_id = %s', (user_id,))
-        count = cur.fetchone()[0]
-        
-        # Si es la primera wallet, establecerla como predeterminada
-        is_default = count == 0
-        
-        # Insertar la nueva wallet
-        cur.execute(
-            'INSERT INTO wallets (user_id, address, private_key, salt, is_default) VALUES (%s, %s, %s, %s, %s)',
-            (user_id, address, private_key, salt, is_default)
-        )
-        
-        conn.commit()
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+
+                # Verificar si el usuario ya tiene wallets
+                cur.execute('SELECT COUNT(*) FROM wallets WHERE user_id = %s', (user_id,))
+                count = cur.fetchone()[0]
+
+                # Si es la primera wallet, establecerla como predeterminada
+                is_default = count == 0
+
+                # Insertar la nueva wallet
+                cur.execute(
+                    'INSERT INTO wallets (user_id, address, private_key, salt, is_default, key_version) '
+                    'VALUES (%s, %s, %s, %s, %s, %s)',
+                    (user_id, address, private_key, salt, is_default, key_version)
+                )
+                _notify_user_change(cur, user_id)
+
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        user_cache.invalidate(user_id)
         logger.info(f"Wallet guardada correctamente para usuario {user_id}")
         return True
     except Exception as e:
         logger.error(f"Error al guardar wallet: {e}")
-        if conn:
-            conn.rollback()
         return False
-    finally:
-        if conn:
-            conn.close()
 
-def get_user_wallets(user_id):
-    """Obtener las wallets de un usuario"""
+def save_wallets_bulk(user_id, wallets):
+    """
+    Guardar varias wallets de un usuario con un único INSERT multi-fila
+
+    Las direcciones que el usuario ya tiene se ignoran. Si el usuario no tenía
+    wallets, la primera del lote queda como predeterminada.
+
+    Args:
+        user_id: ID del usuario de Telegram
+        wallets: Lista de tuplas (address, private_key, salt, key_version)
+
+    Returns:
+        list: Direcciones insertadas (las que faltan eran duplicadas)
+    """
+    if not wallets:
+        return []
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT EXISTS (SELECT 1 FROM wallets WHERE user_id = %s)', (user_id,))
+            has_wallets = cur.fetchone()[0]
+
+            rows = [
+                (user_id, address, private_key, salt, not has_wallets and index == 0, key_version)
+                for index, (address, private_key, salt, key_version) in enumerate(wallets)
+            ]
+            inserted = execute_values(
+                cur,
+                'INSERT INTO wallets (user_id, address, private_key, salt, is_default, key_version) '
+                'VALUES %s ON CONFLICT (user_id, address) DO NOTHING RETURNING address',
+                rows,
+                page_size=len(rows),
+                fetch=True
+            )
+            if inserted:
+                _notify_user_change(cur, user_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    user_cache.invalidate(user_id)
+    logger.info(f"{len(inserted)} wallets guardadas en bloque para usuario {user_id}")
+    return [row[0] for row in inserted]
+
+# Proyecciones de la tabla wallets: cada llamador pide solo las columnas que necesita
+WALLET_COLUMNS = ('id', 'address', 'private_key', 'salt', 'is_default', 'key_version', 'created_at')
+WALLET_LIST_COLUMNS = ('address', 'is_default')
+WALLET_KEY_COLUMNS = ('address', 'private_key', 'salt', 'is_default', 'key_version')
+
+def get_user_wallets(user_id, columns=WALLET_KEY_COLUMNS):
+    """
+    Obtener las wallets de un usuario
+
+    Args:
+        user_id: ID del usuario de Telegram
+        columns: Columnas a leer (WALLET_LIST_COLUMNS para listados sin material de claves)
+
+    Returns:
+        list: Un diccionario por wallet con las columnas pedidas
+    """
+    unknown = set(columns) - set(WALLET_COLUMNS)
+    if unknown:
+        raise ValueError(f"Columnas de wallets desconocidas: {', '.join(sorted(unknown))}")
+
+    cache_key = ('wallets', tuple(columns))
+    found, cached = user_cache.get(user_id, cache_key)
+    if found:
+        return [dict(wallet) for wallet in cached]
+    version = user_cache.version()
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute('''
-            SELECT address, private_key, salt, is_default 
-            FROM wallets 
-            WHERE user_id = %s 
-            ORDER BY is_default DESC, created_at DESC
-        ''', (user_id,))
-        results = cur.fetchall()
-        
-        # Convertir los resultados a una lista de diccionarios
-        wallets = []
-        for row in results:
-            # Asegurarse de que private_key sea bytes
-            private_key = row['private_key']
-            if isinstance(private_key, str):
-                private_key = private_key.encode()
-                
-            wallets.append({
-                'address': row['address'],
-                'private_key': private_key,
-                'salt': row['salt'],
-                'is_default': row['is_default']
-            })
-            
+        wallets = read_user_wallets(user_id, columns)
+        user_cache.set(user_id, cache_key, wallets, version)
         logger.info(f"Wallets obtenidas para el usuario {user_id}")
-        return wallets
+        return [dict(wallet) for wallet in wallets]
     except Exception as e:
         logger.error(f"Error al obtener wallets: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+def read_user_wallets(user_id, columns=WALLET_KEY_COLUMNS):
+    """
+    Leer las wallets de un usuario directamente de Postgres, sin la caché
+
+    A diferencia de get_user_wallets, los errores de la base de datos se propagan:
+    lo usan los workers, que no reciben las invalidaciones de la caché y tienen
+    que distinguir un fallo temporal de un usuario sin wallets.
+    """
+    unknown = set(columns) - set(WALLET_COLUMNS)
+    if unknown:
+        raise ValueError(f"Columnas de wallets desconocidas: {', '.join(sorted(unknown))}")
+
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        cur.execute(
+            sql.SQL(
+                'SELECT {} FROM wallets WHERE user_id = %s ORDER BY is_default DESC, created_at DESC'
+            ).format(sql.SQL(', ').join(sql.Identifier(column) for column in columns)),
+            (user_id,)
+        )
+        results = cur.fetchall()
+
+    # Convertir los resultados a una lista de diccionarios
+    wallets = []
+    for row in results:
+        wallet = dict(row)
+        # Asegurarse de que private_key sea bytes
+        if isinstance(wallet.get('private_key'), str):
+            wallet['private_key'] = wallet['private_key'].encode()
+        wallets.append(wallet)
+    return wallets
 
 def save_destination(user_id, address):
     """Guardar la dirección de destino en la base de datos"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            'INSERT INTO destinations (user_id, address) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET address = %s',
-            (user_id, address, address)
-        )
-        conn.commit()
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    'INSERT INTO destinations (user_id, address) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET address = %s',
+                    (user_id, address, address)
+                )
+                _notify_user_change(cur, user_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        user_cache.invalidate(user_id)
         logger.info(f"Dirección de destino guardada para el usuario {user_id}")
         return True
     except Exception as e:
         logger.error(f"Error al guardar dirección de destino: {e}")
         return False
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
 
 def get_user_destination(user_id):
     """Obtener la dirección de destino de un usuario"""
+    found, cached = user_cache.get(user_id, 'destination')
+    if found:
+        return cached
+    version = user_cache.version()
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT address FROM destinations WHERE user_id = %s', (user_id,))
-        result = cur.fetchone()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT address FROM destinations WHERE user_id = %s', (user_id,))
+            result = cur.fetchone()
+        user_cache.set(user_id, 'destination', result[0] if result else None, version)
         if result:
             logger.info(f"Dirección de destino obtenida para el usuario {user_id}")
             return result[0]
@@ -183,46 +674,974 @@ def get_user_destination(user_id):
     except Exception as e:
         logger.error(f"Error al obtener dirección de destino: {e}")
         return None
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
 
 def delete_user_wallets(user_id):
     """Eliminar todas las wallets de un usuario"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('DELETE FROM wallets WHERE user_id = %s', (user_id,))
-        conn.commit()
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+                cur.execute('DELETE FROM wallets WHERE user_id = %s', (user_id,))
+                _notify_user_change(cur, user_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        user_cache.invalidate(user_id)
         logger.info(f"Wallets eliminadas para el usuario {user_id}")
         return True
     except Exception as e:
         logger.error(f"Error al eliminar wallets: {e}")
         return False
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+
+def get_user_data_key(user_id):
+    """Obtener la data key envuelta de un usuario (o None si todavía no tiene)"""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT wrapped_key FROM user_keys WHERE user_id = %s', (user_id,))
+            result = cur.fetchone()
+        return result[0] if result else None
+    except Exception as e:
+        logger.error(f"Error al obtener data key del usuario {user_id}: {e}")
+        raise
+
+def get_or_create_user_data_key(user_id, wrapped_key):
+    """
+    Guardar la data key envuelta de un usuario si todavía no tiene una
+
+    Args:
+        user_id: ID del usuario de Telegram
+        wrapped_key: Data key nueva (envuelta) a usar si el usuario no tiene ninguna
+
+    Returns:
+        str: La data key envuelta vigente del usuario (la existente o la nueva)
+    """
+    try:
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    'INSERT INTO user_keys (user_id, wrapped_key) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING',
+                    (user_id, wrapped_key)
+                )
+                # Si otra petición la creó antes, se devuelve la que ganó
+                cur.execute('SELECT wrapped_key FROM user_keys WHERE user_id = %s', (user_id,))
+                result = cur.fetchone()[0]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return result
+    except Exception as e:
+        logger.error(f"Error al guardar data key del usuario {user_id}: {e}")
+        raise
+
+def get_wallets_by_version(key_version, after_id=0, limit=500):
+    """Obtener un lote de wallets de una versión de formato, ordenadas por id (para migraciones)"""
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        cur.execute('''
+            SELECT id, user_id, address, private_key, salt, key_version
+            FROM wallets
+            WHERE key_version = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        ''', (key_version, after_id, limit))
+        return [dict(row) for row in cur.fetchall()]
+
+def update_wallet_ciphertexts(rows, from_version, to_version):
+    """
+    Reescribir la clave encriptada de varias wallets en una sola transacción
+
+    Args:
+        rows: Lista de tuplas (id, private_key, salt)
+        from_version: Versión esperada actual (las filas ya migradas no se tocan)
+        to_version: Nueva versión del formato
+
+    Returns:
+        int: Número de filas actualizadas
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            updated = 0
+            user_ids = set()
+            for wallet_id, private_key, salt in rows:
+                cur.execute(
+                    'UPDATE wallets SET private_key = %s, salt = %s, key_version = %s '
+                    'WHERE id = %s AND key_version = %s RETURNING user_id',
+                    (private_key, salt, to_version, wallet_id, from_version)
+                )
+                for (user_id,) in cur.fetchall():
+                    user_ids.add(user_id)
+                    updated += 1
+            for user_id in user_ids:
+                _notify_user_change(cur, user_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    return updated
+
+def get_stored_token_metadata(address):
+    """Obtener la metadata guardada de un token (o None si no está)"""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute('SELECT address, name, symbol, decimals FROM token_metadata WHERE address = %s', (address,))
+            row = cur.fetchone()
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error al obtener metadata del token {address}: {e}")
+        return None
+
+def get_recent_token_metadata(limit):
+    """Obtener la metadata de los tokens consultados más recientemente"""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute(
+                'SELECT address, name, symbol, decimals FROM token_metadata ORDER BY created_at DESC LIMIT %s',
+                (limit,)
+            )
+            rows = cur.fetchall()
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Error al obtener metadata de tokens: {e}")
+        return []
+
+def save_token_metadata(address, name, symbol, decimals):
+    """Guardar la metadata de un token"""
+    try:
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    'INSERT INTO token_metadata (address, name, symbol, decimals) VALUES (%s, %s, %s, %s) '
+                    'ON CONFLICT (address) DO NOTHING',
+                    (address, name, symbol, decimals)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar metadata del token {address}: {e}")
+        return False
+
+def get_user_state(user_id):
+    """Obtener el estado de conversación de un usuario, o None si no tiene o expiró"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            'SELECT state FROM user_states WHERE user_id = %s AND expires_at > CURRENT_TIMESTAMP',
+            (user_id,)
+        )
+        row = cur.fetchone()
+        conn.rollback()
+    return row[0] if row else None
+
+def set_user_state(user_id, state, ttl):
+    """Guardar (o reemplazar) el estado de conversación de un usuario durante ttl segundos"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO user_states (user_id, state, expires_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                ON CONFLICT (user_id) DO UPDATE SET state = EXCLUDED.state, expires_at = EXCLUDED.expires_at
+            ''', (user_id, state, ttl))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def clear_user_state(user_id):
+    """Borrar el estado de conversación de un usuario"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM user_states WHERE user_id = %s', (user_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def purge_expired_user_states():
+    """Borrar los estados expirados y devolver cuántos se borraron"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM user_states WHERE expires_at <= CURRENT_TIMESTAMP')
+            conn.commit()
+            return cur.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+
+# Columnas de un job con la misma forma que los resultados de send_transfer
+TRANSFER_JOB_COLUMNS = '''
+    id, request_id, user_id, address, token, destination, status, attempts,
+    tx_hash, nonce, readable_balance, error
+'''
+
+def create_transfer_request(idempotency_key, user_id, token, destination, addresses, empty_addresses=()):
+    """
+    Encolar una solicitud de transferencia con un job por wallet
+
+    Si ya existe una solicitud con la misma idempotency_key (por ejemplo, Telegram
+    reenvía el mismo update) se devuelve esa sin crear jobs nuevos. Cada job lleva
+    su propia clave (solicitud, wallet, token), así que nunca se duplica.
+
+    Args:
+        idempotency_key: Clave única de la solicitud
+        addresses: Wallets con balance que hay que transferir
+        empty_addresses: Wallets sin balance, que se guardan ya terminadas como 'empty'
+
+    Returns:
+        tuple: (id de la solicitud, True si se creó ahora)
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO transfer_requests (idempotency_key, user_id, token, destination)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (idempotency_key) DO NOTHING
+                RETURNING id
+            ''', (idempotency_key, user_id, token, destination))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute('SELECT id FROM transfer_requests WHERE idempotency_key = %s', (idempotency_key,))
+                request_id = cur.fetchone()[0]
+                conn.commit()
+                return request_id, False
+
+            request_id = row[0]
+            jobs = [(address, 'queued') for address in addresses]
+            jobs += [(address, 'empty') for address in empty_addresses]
+            if jobs:
+                execute_values(
+                    cur,
+                    'INSERT INTO transfer_jobs (request_id, idempotency_key, user_id, address, token, destination, '
+                    'status, readable_balance) VALUES %s ON CONFLICT (idempotency_key) DO NOTHING',
+                    [(request_id, f"{idempotency_key}:{address.lower()}:{token.lower()}", user_id, address,
+                      token, destination, status, 0.0 if status == 'empty' else None)
+                     for address, status in jobs]
+                )
+            conn.commit()
+            return request_id, True
+        except Exception:
+            conn.rollback()
+            raise
+
+def set_transfer_request_message(request_id, chat_id, message_id, tracked_by=None):
+    """
+    Guardar el mensaje de Telegram donde se muestra el progreso de una solicitud
+
+    Args:
+        tracked_by: Instancia del bot que edita el mensaje (ver claim_transfer_requests)
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_requests
+                SET chat_id = %s, message_id = %s, tracked_by = %s,
+                    tracked_at = CASE WHEN %s IS NULL THEN NULL ELSE CURRENT_TIMESTAMP END
+                WHERE id = %s
+            ''', (chat_id, message_id, tracked_by, tracked_by, request_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def claim_transfer_jobs(worker_id, limit):
+    """
+    Reservar jobs en cola para un worker con FOR UPDATE SKIP LOCKED
+
+    Varios workers pueden reclamar a la vez sin bloquearse ni repetir jobs.
+
+    Returns:
+        list: Los jobs reclamados, ya en estado 'running'
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute(f'''
+                UPDATE transfer_jobs
+                SET status = 'running', attempts = attempts + 1, locked_by = %s,
+                    locked_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM transfer_jobs
+                    WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                    ORDER BY run_after, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING {TRANSFER_JOB_COLUMNS}
+            ''', (worker_id, limit))
+            jobs = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+            return jobs
+        except Exception:
+            conn.rollback()
+            raise
+
+def touch_transfer_jobs(job_ids, worker_id):
+    """Renovar el lock de los jobs que un worker sigue procesando"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_jobs SET locked_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND status = 'running' AND locked_by = %s
+            ''', (list(job_ids), worker_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def mark_transfer_job_signed(job_id, tx_hash, nonce):
+    """
+    Guardar el hash y el nonce de la transacción firmada de un job, antes de emitirla
+
+    Si el worker muere después, el job ya no vuelve a la cola de envío sino a la
+    de recibos (ver requeue_stale_transfer_jobs), así que no se emite dos veces.
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_jobs
+                SET tx_hash = %s, nonce = %s, sent_at = CURRENT_TIMESTAMP, checked_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (tx_hash, nonce, job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def requeue_stale_transfer_jobs(lock_timeout):
+    """
+    Recuperar los jobs 'running' de workers que murieron sin terminarlos
+
+    Los que no llegaron a firmar vuelven a la cola; los que ya tienen tx_hash
+    pudieron emitirse, así que pasan a 'sent' y se resuelven por su recibo.
+
+    Returns:
+        int: Jobs recuperados
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_jobs
+                SET status = CASE WHEN tx_hash IS NULL THEN 'queued' ELSE 'sent' END,
+                    locked_by = NULL, locked_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ''', (lock_timeout,))
+            conn.commit()
+            return cur.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+
+def finish_transfer_job(job_id, result):
+    """Guardar el resultado de send_transfer (o de su recibo) en un job"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_jobs
+                SET status = %s, tx_hash = COALESCE(%s, tx_hash), nonce = COALESCE(%s, nonce),
+                    readable_balance = COALESCE(%s, readable_balance), error = %s,
+                    sent_at = CASE WHEN %s = 'sent' THEN CURRENT_TIMESTAMP ELSE sent_at END,
+                    locked_by = NULL, locked_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (result['status'], result.get('tx_hash'), result.get('nonce'), result.get('readable_balance'),
+                  result.get('error'), result['status'], job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def retry_transfer_job(job_id, error, delay):
+    """
+    Devolver un job a la cola para reintentarlo dentro de delay segundos
+
+    Se olvida la transacción del intento anterior: no llegó a emitirse o la red la descartó.
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_jobs
+                SET status = 'queued', error = %s, run_after = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    tx_hash = NULL, nonce = NULL, sent_at = NULL, checked_at = NULL,
+                    locked_by = NULL, locked_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (error, delay, job_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def claim_sent_transfer_jobs(limit, poll_interval, slow_after, slow_interval):
+    """
+    Reservar jobs emitidos cuyo recibo no se ha consultado en poll_interval segundos
+
+    Los emitidos hace más de slow_after segundos se consultan cada slow_interval.
+
+    Returns:
+        list: Los jobs con su antigüedad desde la emisión en 'age' (segundos)
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute(f'''
+                UPDATE transfer_jobs
+                SET checked_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM transfer_jobs
+                    WHERE status = 'sent'
+                      AND (checked_at IS NULL OR checked_at < CURRENT_TIMESTAMP - make_interval(secs => CASE
+                          WHEN sent_at < CURRENT_TIMESTAMP - make_interval(secs => %s) THEN %s ELSE %s
+                      END))
+                    ORDER BY checked_at NULLS FIRST, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING {TRANSFER_JOB_COLUMNS}, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - sent_at)) AS age
+            ''', (slow_after, slow_interval, poll_interval, limit))
+            jobs = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+            return jobs
+        except Exception:
+            conn.rollback()
+            raise
+
+def get_transfer_request(request_id, user_id=None):
+    """
+    Obtener una solicitud de transferencia con sus jobs
+
+    Args:
+        user_id: Si se indica, solo se devuelve si la solicitud es de ese usuario
+
+    Returns:
+        dict: Columnas de la solicitud y 'jobs', o None si no existe
+    """
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        if user_id is None:
+            cur.execute('SELECT * FROM transfer_requests WHERE id = %s', (request_id,))
+        else:
+            cur.execute('SELECT * FROM transfer_requests WHERE id = %s AND user_id = %s', (request_id, user_id))
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        request = dict(row)
+        cur.execute(f'SELECT {TRANSFER_JOB_COLUMNS} FROM transfer_jobs WHERE request_id = %s ORDER BY id', (request_id,))
+        request['jobs'] = [dict(job) for job in cur.fetchall()]
+        conn.rollback()
+    return request
+
+def get_latest_transfer_request_id(user_id):
+    """Obtener el id de la última solicitud de transferencia de un usuario, o None"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT MAX(id) FROM transfer_requests WHERE user_id = %s', (user_id,))
+        row = cur.fetchone()
+        conn.rollback()
+    return row[0] if row else None
+
+def claim_transfer_requests(owner, lease):
+    """
+    Reservar para una instancia del bot las solicitudes activas que nadie sigue
+
+    Una solicitud está activa si tiene mensaje de progreso y jobs sin terminar, y
+    está libre si no tiene dueño o si su dueño no renovó la reserva en lease
+    segundos (la instancia murió). Con FOR UPDATE SKIP LOCKED dos instancias nunca
+    se llevan la misma, así que cada mensaje lo edita una sola.
+
+    Returns:
+        list: Las solicitudes reservadas (id, chat_id, message_id)
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute('''
+                UPDATE transfer_requests
+                SET tracked_by = %s, tracked_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT r.id FROM transfer_requests r
+                    WHERE r.message_id IS NOT NULL
+                      AND (r.tracked_by IS NULL OR r.tracked_by = %s
+                           OR r.tracked_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                      AND EXISTS (
+                          SELECT 1 FROM transfer_jobs j
+                          WHERE j.request_id = r.id AND j.status IN ('queued', 'running', 'sent')
+                      )
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, chat_id, message_id
+            ''', (owner, owner, lease))
+            rows = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+
+def touch_transfer_requests(request_ids, owner):
+    """
+    Renovar la reserva de las solicitudes que sigue una instancia
+
+    Returns:
+        list: Ids que siguen siendo suyos (otra instancia pudo quedarse los que no renovó a tiempo)
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE transfer_requests SET tracked_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND tracked_by = %s
+                RETURNING id
+            ''', (list(request_ids), owner))
+            ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            return ids
+        except Exception:
+            conn.rollback()
+            raise
+
+def get_transfer_jobs(request_ids):
+    """Obtener los jobs de varias solicitudes, agrupados por solicitud"""
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        cur.execute(
+            f'SELECT {TRANSFER_JOB_COLUMNS} FROM transfer_jobs WHERE request_id = ANY(%s) ORDER BY id',
+            (list(request_ids),)
+        )
+        jobs = {}
+        for row in cur.fetchall():
+            jobs.setdefault(row['request_id'], []).append(dict(row))
+        conn.rollback()
+    return jobs
+
+def _lock_wallet_nonce(cur, address):
+    # La fila bloqueada serializa el reparto de nonces de la dirección entre procesos
+    cur.execute('INSERT INTO wallet_nonces (address) VALUES (%s) ON CONFLICT (address) DO NOTHING', (address,))
+    cur.execute('SELECT next_nonce, released FROM wallet_nonces WHERE address = %s FOR UPDATE', (address,))
+    return cur.fetchone()
+
+def reserve_wallet_nonce(address, fetch_nonce):
+    """
+    Reservar el siguiente nonce libre de una dirección (reutilizando primero los liberados)
+
+    Args:
+        address: Dirección en minúsculas
+        fetch_nonce: Función (address) -> nonce pendiente según la red, solo se
+                     llama si la dirección todavía no tiene nonce guardado
+
+    Returns:
+        int: El nonce reservado
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            next_nonce, released = _lock_wallet_nonce(cur, address)
+            if released:
+                nonce = min(released)
+                cur.execute(
+                    'UPDATE wallet_nonces SET released = array_remove(released, %s), '
+                    'updated_at = CURRENT_TIMESTAMP WHERE address = %s',
+                    (nonce, address)
+                )
+            else:
+                nonce = next_nonce if next_nonce is not None else fetch_nonce(address)
+                cur.execute(
+                    'UPDATE wallet_nonces SET next_nonce = %s, updated_at = CURRENT_TIMESTAMP WHERE address = %s',
+                    (nonce + 1, address)
+                )
+            conn.commit()
+            return nonce
+        except Exception:
+            conn.rollback()
+            raise
+
+def release_wallet_nonce(address, nonce):
+    """Devolver un nonce reservado cuya transacción no llegó a emitirse"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            next_nonce, released = _lock_wallet_nonce(cur, address)
+            if next_nonce is not None and nonce == next_nonce - 1:
+                cur.execute('UPDATE wallet_nonces SET next_nonce = %s WHERE address = %s', (nonce, address))
+            elif nonce not in released:
+                cur.execute(
+                    'UPDATE wallet_nonces SET released = array_append(released, %s) WHERE address = %s',
+                    (nonce, address)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def set_wallet_nonce(address, chain_nonce, allow_lower=False):
+    """
+    Resincronizar el siguiente nonce de una dirección con la red
+
+    El siguiente nonce nunca baja, salvo con allow_lower: un nodo atrasado devuelve
+    un nonce menor y bajarlo repartiría otra vez nonces que otros workers tienen en
+    curso. Los liberados por debajo de chain_nonce ya se usaron y se olvidan.
+
+    Args:
+        address: Dirección en minúsculas
+        chain_nonce: Nonce pendiente de la dirección según la red
+        allow_lower: Bajar el siguiente nonce hasta chain_nonce (el nodo respondió
+                     'nonce too high': los nonces por encima nunca se emitieron)
+
+    Returns:
+        int: El siguiente nonce guardado
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO wallet_nonces (address, next_nonce) VALUES (%s, %s)
+                ON CONFLICT (address) DO UPDATE
+                SET next_nonce = CASE WHEN %s THEN EXCLUDED.next_nonce
+                                      ELSE GREATEST(wallet_nonces.next_nonce, EXCLUDED.next_nonce) END,
+                    released = CASE WHEN %s THEN '{}'
+                                    ELSE ARRAY(SELECT nonce FROM unnest(wallet_nonces.released) AS nonce
+                                               WHERE nonce >= EXCLUDED.next_nonce ORDER BY nonce) END,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING next_nonce
+            ''', (address, chain_nonce, allow_lower, allow_lower))
+            next_nonce = cur.fetchone()[0]
+            conn.commit()
+            return next_nonce
+        except Exception:
+            conn.rollback()
+            raise
+
+def recover_wallet_nonce_gaps(address, chain_nonce, candidates):
+    """
+    Liberar los nonces de las transacciones candidatas que la red no tiene
+
+    El siguiente nonce nunca baja (solo sube si la red va por delante): los nonces
+    reservados por transacciones que otros workers tienen en curso siguen siendo suyos.
+
+    Args:
+        address: Dirección en minúsculas
+        chain_nonce: Mayor nonce pendiente de la dirección entre los endpoints
+        candidates: Nonces de transacciones emitidas que llevan demasiado sin recibo
+
+    Returns:
+        list: Nonces candidatos que la red no tiene: sus transacciones se descartaron
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            next_nonce, released = _lock_wallet_nonce(cur, address)
+            if next_nonce is None or chain_nonce > next_nonce:
+                next_nonce = chain_nonce
+            dropped = sorted(nonce for nonce in set(candidates) if nonce >= chain_nonce)
+            # Los liberados por debajo de chain_nonce ya se usaron fuera de este reparto
+            released = [nonce for nonce in released if nonce >= chain_nonce]
+            released += [nonce for nonce in dropped if nonce < next_nonce and nonce not in released]
+            cur.execute(
+                "UPDATE wallet_nonces SET next_nonce = %s, released = %s, updated_at = CURRENT_TIMESTAMP "
+                "WHERE address = %s",
+                (next_nonce, released, address)
+            )
+            conn.commit()
+            return dropped
+        except Exception:
+            conn.rollback()
+            raise
+
+def get_tracked_addresses():
+    """Obtener todas las direcciones de wallets guardadas (en minúsculas, sin repetir)"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT DISTINCT LOWER(address) FROM wallets')
+        return [row[0] for row in cur.fetchall()]
+
+def get_indexer_state():
+    """
+    Obtener el cursor del indexador
+
+    Returns:
+        dict: block_number, age (segundos desde la última actualización) y lag (bloques
+              por detrás de la cabeza vista en esa actualización, None si no se guardó),
+              o None si nunca se ejecutó
+    """
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        cur.execute('''
+            SELECT block_number, head_block, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - updated_at)) AS age
+            FROM indexer_state WHERE id = 1
+        ''')
+        row = cur.fetchone()
+    if row is None:
+        return None
+    lag = row['head_block'] - row['block_number'] if row['head_block'] is not None else None
+    return {'block_number': row['block_number'], 'age': float(row['age']), 'lag': lag}
+
+def get_indexed_block_hashes(from_block):
+    """Obtener los hashes guardados de los bloques indexados desde from_block"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            'SELECT block_number, block_hash FROM indexed_blocks WHERE block_number >= %s ORDER BY block_number',
+            (from_block,)
+        )
+        return dict(cur.fetchall())
+
+def get_indexed_balances(token, addresses):
+    """
+    Obtener los balances indexados de un token para varias direcciones
+
+    Returns:
+        dict: Dirección (minúsculas) -> balance en unidades mínimas; las que faltan no están indexadas
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            'SELECT address, balance FROM token_balances WHERE token = %s AND address = ANY(%s)',
+            (token.lower(), [address.lower() for address in addresses])
+        )
+        return {address: int(balance) for address, balance in cur.fetchall()}
+
+def seed_token_balances(token, balances, block_number):
+    """
+    Guardar balances leídos de la red en el bloque del cursor del indexador
+
+    Solo se guardan si el cursor sigue en block_number, así el indexador aplica
+    exactamente los deltas de los bloques posteriores.
+
+    Returns:
+        bool: True si se guardaron
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT block_number FROM indexer_state WHERE id = 1 FOR UPDATE')
+            row = cur.fetchone()
+            if row is None or row[0] != block_number:
+                conn.rollback()
+                return False
+            execute_values(
+                cur,
+                'INSERT INTO token_balances (token, address, balance, block_number, seeded_block) '
+                'VALUES %s ON CONFLICT (token, address) DO NOTHING',
+                [(token.lower(), address.lower(), balance, block_number, block_number)
+                 for address, balance in balances.items()]
+            )
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+
+def save_indexed_range(deltas, block_hashes, to_block, reorg_depth, tracked, head):
+    """
+    Aplicar los deltas de un rango de bloques y avanzar el cursor en una transacción
+
+    Args:
+        deltas: Lista de tuplas (block_number, token, address, delta) ordenadas por bloque
+        block_hashes: Dict block_number -> hash de los bloques del rango
+        to_block: Último bloque del rango (nuevo cursor)
+        reorg_depth: Bloques de historial que se conservan para poder deshacer reorgs
+        tracked: Direcciones (minúsculas) cuyos logs se consultaron en el rango
+        head: Cabeza de la cadena al leer el rango
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT block_number FROM indexer_state WHERE id = 1 FOR UPDATE')
+            # Las filas sembradas para direcciones que el indexador no vigiló en este
+            # rango no tienen sus deltas; se borran y se vuelven a sembrar
+            cur.execute('DELETE FROM token_balances WHERE NOT (address = ANY(%s))', (list(tracked),))
+            for block_number, token, address, delta in deltas:
+                # Las filas sembradas en este bloque o después ya incluyen el delta
+                cur.execute(
+                    'UPDATE token_balances SET balance = balance + %s, block_number = %s '
+                    'WHERE token = %s AND address = %s AND block_number < %s',
+                    (delta, block_number, token, address, block_number)
+                )
+                if cur.rowcount:
+                    cur.execute(
+                        'INSERT INTO balance_deltas (block_number, token, address, delta) VALUES (%s, %s, %s, %s)',
+                        (block_number, token, address, delta)
+                    )
+            if block_hashes:
+                execute_values(
+                    cur,
+                    'INSERT INTO indexed_blocks (block_number, block_hash) VALUES %s '
+                    'ON CONFLICT (block_number) DO UPDATE SET block_hash = EXCLUDED.block_hash',
+                    list(block_hashes.items())
+                )
+            cur.execute(
+                'INSERT INTO indexer_state (id, block_number, head_block) VALUES (1, %s, %s) '
+                'ON CONFLICT (id) DO UPDATE SET block_number = EXCLUDED.block_number, '
+                'head_block = EXCLUDED.head_block, updated_at = CURRENT_TIMESTAMP',
+                (to_block, head)
+            )
+            cur.execute('DELETE FROM balance_deltas WHERE block_number <= %s', (to_block - reorg_depth,))
+            cur.execute('DELETE FROM indexed_blocks WHERE block_number <= %s', (to_block - reorg_depth,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def touch_indexer_state(head):
+    """Marcar el índice como al día sin avanzar el cursor (no hay bloques nuevos)"""
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                'UPDATE indexer_state SET head_block = %s, updated_at = CURRENT_TIMESTAMP WHERE id = 1', (head,)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def rollback_index(to_block):
+    """
+    Deshacer el índice hasta to_block tras un reorg
+
+    Se restan los deltas aplicados en los bloques posteriores y se borran las filas
+    sembradas en bloques que ya no son canónicos (se volverán a sembrar).
+    """
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT block_number FROM indexer_state WHERE id = 1 FOR UPDATE')
+            cur.execute('DELETE FROM token_balances WHERE seeded_block > %s', (to_block,))
+            cur.execute('''
+                UPDATE token_balances b
+                SET balance = b.balance - d.total, block_number = %s
+                FROM (
+                    SELECT token, address, SUM(delta) AS total
+                    FROM balance_deltas
+                    WHERE block_number > %s
+                    GROUP BY token, address
+                ) d
+                WHERE b.token = d.token AND b.address = d.address
+            ''', (to_block, to_block))
+            cur.execute('DELETE FROM balance_deltas WHERE block_number > %s', (to_block,))
+            cur.execute('DELETE FROM indexed_blocks WHERE block_number > %s', (to_block,))
+            cur.execute(
+                'UPDATE indexer_state SET block_number = %s, updated_at = CURRENT_TIMESTAMP WHERE id = 1',
+                (to_block,)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    logger.warning(f"Índice de balances revertido hasta el bloque {to_block}")
 
 def drop_wallets_table():
     """Eliminar la tabla wallets"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Eliminar la tabla wallets
-        cur.execute('DROP TABLE IF EXISTS wallets CASCADE')
-        
-        conn.commit()
-        logger.info("Tabla wallets eliminada correctamente")
+        with db_connection() as conn:
+            try:
+                cur = conn.cursor()
+
+                # Eliminar la tabla wallets
+                cur.execute('DROP TABLE IF EXISTS wallets CASCADE')
+
+                conn.commit()
+                logger.info("Tabla wallets eliminada correctamente")
+            except Exception:
+                conn.rollback()
+                raise
     except Exception as e:
         logger.error(f"Error al eliminar la tabla wallets: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close() 
\ No newline at end of file
+
+# Versiones async para los handlers de Telegram: se ejecutan en el executor
+# de base de datos y no bloquean el event loop mientras esperan al pool.
+
+async def ping_db_async():
+    """Versión async de ping_db"""
+    return await run_db(ping_db)
+
+async def get_user_state_async(user_id):
+    """Versión async de get_user_state"""
+    return await run_db(get_user_state, user_id)
+
+async def set_user_state_async(user_id, state, ttl):
+    """Versión async de set_user_state"""
+    return await run_db(set_user_state, user_id, state, ttl)
+
+async def clear_user_state_async(user_id):
+    """Versión async de clear_user_state"""
+    return await run_db(clear_user_state, user_id)
+
+async def purge_expired_user_states_async():
+    """Versión async de purge_expired_user_states"""
+    return await run_db(purge_expired_user_states)
+
+async def create_transfer_request_async(idempotency_key, user_id, token, destination, addresses, empty_addresses=()):
+    """Versión async de create_transfer_request"""
+    return await run_db(create_transfer_request, idempotency_key, user_id, token, destination,
+                        addresses, empty_addresses)
+
+async def set_transfer_request_message_async(request_id, chat_id, message_id, tracked_by=None):
+    """Versión async de set_transfer_request_message"""
+    return await run_db(set_transfer_request_message, request_id, chat_id, message_id, tracked_by)
+
+async def get_transfer_request_async(request_id, user_id=None):
+    """Versión async de get_transfer_request"""
+    return await run_db(get_transfer_request, request_id, user_id)
+
+async def get_latest_transfer_request_id_async(user_id):
+    """Versión async de get_latest_transfer_request_id"""
+    return await run_db(get_latest_transfer_request_id, user_id)
+
+async def save_wallet_async(user_id: int, address: str, private_key, salt: str, key_version: int = 1) -> bool:
+    """Versión async de save_wallet"""
+    return await run_db(save_wallet, user_id, address, private_key, salt, key_version)
+
+async def save_wallets_bulk_async(user_id, wallets):
+    """Versión async de save_wallets_bulk"""
+    return await run_db(save_wallets_bulk, user_id, wallets)
+
+async def get_user_data_key_async(user_id):
+    """Versión async de get_user_data_key"""
+    return await run_db(get_user_data_key, user_id)
+
+async def get_or_create_user_data_key_async(user_id, wrapped_key):
+    """Versión async de get_or_create_user_data_key"""
+    return await run_db(get_or_create_user_data_key, user_id, wrapped_key)
+
+async def read_user_wallets_async(user_id, columns=WALLET_KEY_COLUMNS):
+    """Versión async de read_user_wallets"""
+    return await run_db(read_user_wallets, user_id, columns)
+
+async def get_user_wallets_async(user_id, columns=WALLET_KEY_COLUMNS):
+    """Versión async de get_user_wallets"""
+    return await run_db(get_user_wallets, user_id, columns)
+
+async def save_destination_async(user_id, address):
+    """Versión async de save_destination"""
+    return await run_db(save_destination, user_id, address)
+
+async def get_user_destination_async(user_id):
+    """Versión async de get_user_destination"""
+    return await run_db(get_user_destination, user_id)
+
+async def delete_user_wallets_async(user_id):
+    """Versión async de delete_user_wallets"""
+    return await run_db(delete_user_wallets, user_id)
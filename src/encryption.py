@@ -1,11 +1,14 @@
 import os
+import threading
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
 import logging
 from typing import Union
 from dotenv import load_dotenv
+from cache import LRUCache
 
 # Cargar variables de entorno
 load_dotenv()
@@ -17,6 +20,57 @@ if not ENCRYPTION_KEY:
 
 logger = logging.getLogger(__name__)
 
+# Versiones del formato de las claves privadas guardadas (columna wallets.key_version)
+KEY_VERSION_LEGACY = 1    # Fernet con clave PBKDF2 derivada del salt de cada fila
+KEY_VERSION_ENVELOPE = 2  # AES-GCM con la data key del usuario, envuelta por la master key
+CURRENT_KEY_VERSION = KEY_VERSION_ENVELOPE
+
+# Salt fijo de la master key: cambiarlo invalida todas las data keys envueltas
+MASTER_KEY_SALT = os.getenv('MASTER_KEY_SALT', 'virox-master-key-v2')
+_NONCE_SIZE = 12
+_DATA_KEY_AAD = b'virox-data-key'
+
+# Caché de instancias Fernet derivadas por salt (evita repetir PBKDF2 en cada comando)
+KEY_CACHE_SIZE = int(os.getenv('KEY_CACHE_SIZE', '1024'))
+KEY_CACHE_TTL = float(os.getenv('KEY_CACHE_TTL', '900'))
+# Cada cuántos segundos se vacía la caché por completo (0 para desactivarlo)
+KEY_CACHE_CLEAR_INTERVAL = float(os.getenv('KEY_CACHE_CLEAR_INTERVAL', '3600'))
+
+_fernet_cache = LRUCache(maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+_cleaner_thread = None
+_cleaner_lock = threading.Lock()
+_cleaner_stop = threading.Event()
+
+def clear_key_cache():
+    """Vaciar la caché de claves derivadas"""
+    _fernet_cache.clear()
+    logger.info("Caché de claves de encriptación vaciada")
+
+def get_key_cache_stats():
+    """Obtener aciertos, fallos y tasa de acierto de la caché de claves derivadas"""
+    return _fernet_cache.stats()
+
+def _clear_periodically(interval):
+    while not _cleaner_stop.wait(interval):
+        clear_key_cache()
+
+def start_key_cache_cleaner(interval=KEY_CACHE_CLEAR_INTERVAL):
+    """Arrancar (una sola vez) el hilo que vacía la caché de claves cada interval segundos"""
+    global _cleaner_thread
+    if interval <= 0:
+        return
+    with _cleaner_lock:
+        if _cleaner_thread is None or not _cleaner_thread.is_alive():
+            _cleaner_stop.clear()
+            _cleaner_thread = threading.Thread(
+                target=_clear_periodically, args=(interval,), name='key-cache-cleaner', daemon=True
+            )
+            _cleaner_thread.start()
+
+def stop_key_cache_cleaner():
+    """Detener el hilo de limpieza de la caché de claves"""
+    _cleaner_stop.set()
+
 def get_encryption_key(salt: Union[str, bytes]) -> bytes:
     """Generar una clave de encriptación usando el salt y la clave de encriptación"""
     try:
@@ -39,6 +93,18 @@ def get_encryption_key(salt: Union[str, bytes]) -> bytes:
         logger.error(f"Error al generar clave de encriptación: {e}")
         raise
 
+def get_fernet(salt: Union[str, bytes]) -> Fernet:
+    """Obtener el cifrador Fernet para un salt, derivando la clave solo si no está en caché"""
+    if isinstance(salt, str):
+        salt = salt.encode()
+
+    fernet = _fernet_cache.get(salt)
+    if fernet is None:
+        fernet = Fernet(get_encryption_key(salt))
+        _fernet_cache.set(salt, fernet)
+        start_key_cache_cleaner()
+    return fernet
+
 def encrypt_private_key(private_key: str, salt: Union[str, bytes]) -> bytes:
     """Encriptar una clave privada usando Fernet"""
     try:
@@ -50,11 +116,8 @@ def encrypt_private_key(private_key: str, salt: Union[str, bytes]) -> bytes:
         if isinstance(salt, str):
             salt = salt.encode()
             
-        # Generar la clave de encriptación
-        key = get_encryption_key(salt)
-        
-        # Crear el cifrador Fernet
-        f = Fernet(key)
+        # Obtener el cifrador Fernet (la clave derivada se reutiliza desde la caché)
+        f = get_fernet(salt)
         
         # Encriptar la clave privada
         encrypted_data = f.encrypt(private_key.encode())
@@ -69,20 +132,93 @@ def decrypt_private_key(encrypted_data: bytes, salt: Union[str, bytes]) -> str:
         # Asegurarse de que los datos encriptados sean bytes
         if not isinstance(encrypted_data, bytes):
             raise ValueError("Los datos encriptados deben ser bytes")
+        
+        # Filas antiguas: psycopg2 guardó los bytes como bytea ('\\x...') en la columna TEXT
+        if encrypted_data.startswith(b'\\x'):
+            encrypted_data = bytes.fromhex(encrypted_data[2:].decode())
             
         # Asegurarse de que el salt sea bytes
         if isinstance(salt, str):
             salt = salt.encode()
             
-        # Generar la clave de encriptación
-        key = get_encryption_key(salt)
-        
-        # Crear el cifrador Fernet
-        f = Fernet(key)
+        # Obtener el cifrador Fernet (la clave derivada se reutiliza desde la caché)
+        f = get_fernet(salt)
         
         # Desencriptar la clave privada
         decrypted_data = f.decrypt(encrypted_data)
         return decrypted_data.decode()
     except Exception as e:
         logger.error(f"Error al desencriptar clave privada: {e}")
-        raise 
\ No newline at end of file
+        raise
+
+def _derive_master_key() -> AESGCM:
+    """Derivar la master key a partir de ENCRYPTION_KEY (una sola vez por proceso)"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=MASTER_KEY_SALT.encode(),
+        iterations=100000,
+    )
+    return AESGCM(kdf.derive(ENCRYPTION_KEY.encode()))
+
+_master_key = _derive_master_key()
+
+def _seal(aesgcm: AESGCM, plaintext: bytes, aad: bytes) -> str:
+    nonce = os.urandom(_NONCE_SIZE)
+    return base64.urlsafe_b64encode(nonce + aesgcm.encrypt(nonce, plaintext, aad)).decode()
+
+def _open(aesgcm: AESGCM, sealed: Union[str, bytes], aad: bytes) -> bytes:
+    raw = base64.urlsafe_b64decode(sealed)
+    return aesgcm.decrypt(raw[:_NONCE_SIZE], raw[_NONCE_SIZE:], aad)
+
+def new_wrapped_data_key() -> str:
+    """Generar una data key aleatoria para un usuario y devolverla envuelta con la master key"""
+    return _seal(_master_key, AESGCM.generate_key(bit_length=256), _DATA_KEY_AAD)
+
+def unwrap_data_key(wrapped_key: Union[str, bytes]) -> bytes:
+    """Desenvolver una data key de usuario con la master key"""
+    try:
+        return _open(_master_key, wrapped_key, _DATA_KEY_AAD)
+    except Exception as e:
+        logger.error(f"Error al desenvolver data key: {e}")
+        raise
+
+def encrypt_with_data_key(private_key: str, data_key: bytes, address: str) -> str:
+    """Encriptar una clave privada con la data key del usuario (formato KEY_VERSION_ENVELOPE)"""
+    try:
+        if not isinstance(private_key, str):
+            raise ValueError("La clave privada debe ser un string")
+
+        # La dirección va como dato asociado: el ciphertext no sirve en otra fila
+        return _seal(AESGCM(data_key), private_key.encode(), address.lower().encode())
+    except Exception as e:
+        logger.error(f"Error al encriptar clave privada: {e}")
+        raise
+
+def decrypt_with_data_key(encrypted_data: Union[str, bytes], data_key: bytes, address: str) -> str:
+    """Desencriptar una clave privada en formato KEY_VERSION_ENVELOPE"""
+    try:
+        return _open(AESGCM(data_key), encrypted_data, address.lower().encode()).decode()
+    except Exception as e:
+        logger.error(f"Error al desencriptar clave privada: {e}")
+        raise
+
+def decrypt_wallet_key(wallet: dict, data_key: bytes = None) -> str:
+    """
+    Desencriptar la clave privada de una wallet según su versión de formato
+
+    Args:
+        wallet: Fila de wallets con private_key, salt, address y key_version
+        data_key: Data key del usuario ya desenvuelta (necesaria para KEY_VERSION_ENVELOPE)
+
+    Returns:
+        str: Clave privada en claro
+    """
+    version = wallet.get('key_version', KEY_VERSION_LEGACY)
+    if version == KEY_VERSION_LEGACY:
+        return decrypt_private_key(wallet['private_key'], wallet['salt'])
+    if version == KEY_VERSION_ENVELOPE:
+        if data_key is None:
+            raise ValueError(f"Falta la data key del usuario para la wallet {wallet['address']}")
+        return decrypt_with_data_key(wallet['private_key'], data_key, wallet['address'])
+    raise ValueError(f"Versión de formato de clave desconocida: {version}")
@@ -0,0 +1,198 @@
+"""
+Indexador en segundo plano de los balances ERC20 de las wallets guardadas.
+
+Sigue los eventos Transfer en los que participa alguna wallet del bot y aplica
+los deltas a la tabla token_balances, de modo que /check pueda responder desde
+Postgres. Los balances se siembran con una lectura Multicall3 en el bloque del
+cursor la primera vez que se consultan (ver balance_index.py), así que no hace
+falta recorrer la cadena desde el génesis. Los reorgs se detectan comparando los
+hashes de los últimos bloques indexados y se deshacen con el historial de deltas.
+
+Uso:
+    python src/indexer.py
+"""
+import os
+import time
+import logging
+from dotenv import load_dotenv
+from database import (
+    init_db, get_tracked_addresses, get_indexer_state, get_indexed_block_hashes,
+    save_indexed_range, touch_indexer_state, rollback_index
+)
+from web3_utils import rpc_batch, rpc_pool, RPCError
+
+load_dotenv()
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Segundos entre vueltas, bloques por rango de eth_getLogs, profundidad de reorg
+# que se puede deshacer y direcciones por filtro de topics
+INDEXER_POLL_INTERVAL = float(os.getenv('INDEXER_POLL_INTERVAL', '2'))
+INDEXER_BLOCK_RANGE = int(os.getenv('INDEXER_BLOCK_RANGE', '500'))
+INDEXER_REORG_DEPTH = int(os.getenv('INDEXER_REORG_DEPTH', '64'))
+INDEXER_ADDRESS_CHUNK = int(os.getenv('INDEXER_ADDRESS_CHUNK', '500'))
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+def _check(results):
+    for result in results:
+        if isinstance(result, RPCError):
+            raise result
+    return results
+
+def _address_topic(address):
+    return '0x' + address[2:].lower().rjust(64, '0')
+
+def _topic_address(topic):
+    return '0x' + topic[-40:].lower()
+
+def get_block_hashes(block_numbers, url=None):
+    """Obtener el hash de varios bloques con un batch de eth_getBlockByNumber"""
+    blocks = _check(rpc_batch([('eth_getBlockByNumber', [hex(number), False]) for number in block_numbers], url=url))
+    return {number: block['hash'] for number, block in zip(block_numbers, blocks) if block}
+
+def get_transfer_logs(addresses, from_block, to_block, url=None):
+    """
+    Obtener los eventos Transfer de cualquier token en los que alguna dirección
+    es emisora o receptora, en un único batch de eth_getLogs
+    """
+    calls = []
+    block_range = {'fromBlock': hex(from_block), 'toBlock': hex(to_block)}
+    for start in range(0, len(addresses), INDEXER_ADDRESS_CHUNK):
+        topics = [_address_topic(address) for address in addresses[start:start + INDEXER_ADDRESS_CHUNK]]
+        calls.append(('eth_getLogs', [dict(block_range, topics=[TRANSFER_TOPIC, topics])]))
+        calls.append(('eth_getLogs', [dict(block_range, topics=[TRANSFER_TOPIC, None, topics])]))
+
+    # Una transferencia entre dos wallets del bot aparece en ambas consultas
+    logs = {}
+    for chunk in _check(rpc_batch(calls, url=url)):
+        for log in chunk:
+            if not log.get('removed'):
+                logs[(log['transactionHash'], log['logIndex'])] = log
+    return list(logs.values())
+
+def compute_deltas(logs, tracked):
+    """
+    Convertir eventos Transfer en deltas de balance por (bloque, token, dirección)
+
+    Returns:
+        list: Tuplas (block_number, token, address, delta) ordenadas por bloque
+    """
+    deltas = {}
+    for log in logs:
+        # Los Transfer de ERC721 indexan el tokenId y tienen cuatro topics
+        if len(log['topics']) != 3 or log['data'] in ('0x', ''):
+            continue
+        block_number = int(log['blockNumber'], 16)
+        token = log['address'].lower()
+        value = int(log['data'][:66], 16)
+        sender = _topic_address(log['topics'][1])
+        receiver = _topic_address(log['topics'][2])
+        if sender in tracked:
+            key = (block_number, token, sender)
+            deltas[key] = deltas.get(key, 0) - value
+        if receiver in tracked:
+            key = (block_number, token, receiver)
+            deltas[key] = deltas.get(key, 0) + value
+    return sorted((key + (delta,) for key, delta in deltas.items() if delta), key=lambda item: item[0])
+
+def detect_reorg(cursor, url=None):
+    """
+    Comprobar que los últimos bloques indexados siguen en la cadena canónica
+
+    Returns:
+        int: Último bloque común con la cadena si hubo reorg, o None
+    """
+    stored = get_indexed_block_hashes(cursor - INDEXER_REORG_DEPTH + 1)
+    if cursor not in stored:
+        return None
+    if get_block_hashes([cursor], url).get(cursor) == stored[cursor]:
+        return None
+
+    canonical = get_block_hashes(sorted(stored), url)
+    common = min(stored) - 1
+    for number in sorted(stored):
+        if canonical.get(number) != stored[number]:
+            break
+        common = number
+    if common < min(stored):
+        logger.error(f"Reorg más profundo que INDEXER_REORG_DEPTH ({INDEXER_REORG_DEPTH}) en el bloque {cursor}")
+    return common
+
+def index_once():
+    """
+    Indexar el siguiente rango de bloques
+
+    Returns:
+        bool: True si quedan bloques pendientes hasta la cabeza de la cadena
+    """
+    # Toda la vuelta pregunta al mismo nodo: otro más atrasado no devolvería los
+    # logs de bloques que aún no tiene y el cursor los saltaría
+    url = rpc_pool.pick_url()
+    head = int(_check(rpc_batch([('eth_blockNumber', [])], url=url))[0], 16)
+    state = get_indexer_state()
+    tracked = get_tracked_addresses()
+
+    if state is None:
+        logger.info(f"Indexador sin cursor; empezando en el bloque {head}")
+        save_indexed_range([], get_block_hashes([head], url), head, INDEXER_REORG_DEPTH, tracked, head)
+        return False
+
+    cursor = state['block_number']
+    common = detect_reorg(cursor, url)
+    if common is not None:
+        logger.warning(f"Reorg detectado: revirtiendo del bloque {cursor} al {common}")
+        rollback_index(common)
+        cursor = common
+
+    if cursor >= head:
+        touch_indexer_state(head)
+        return False
+
+    from_block = cursor + 1
+    to_block = min(head, cursor + INDEXER_BLOCK_RANGE)
+    hash_from = max(from_block, to_block - INDEXER_REORG_DEPTH + 1)
+    block_hashes = get_block_hashes(list(range(hash_from, to_block + 1)), url)
+
+    # El cursor solo avanza hasta el último bloque que el nodo ya tiene
+    missing = [number for number in range(hash_from, to_block + 1) if number not in block_hashes]
+    if missing:
+        if missing[0] == hash_from:
+            logger.warning(f"El nodo aún no tiene el bloque {hash_from}; reintentando")
+            return False
+        logger.warning(f"El nodo aún no tiene el bloque {missing[0]}; indexando hasta el {missing[0] - 1}")
+        to_block = missing[0] - 1
+        block_hashes = {number: block_hash for number, block_hash in block_hashes.items() if number <= to_block}
+
+    logs = get_transfer_logs(tracked, from_block, to_block, url) if tracked else []
+
+    # Si algún log viene de un bloque que ya no es canónico, se reintenta en la próxima vuelta
+    for log in logs:
+        block_number = int(log['blockNumber'], 16)
+        if block_number in block_hashes and block_hashes[block_number] != log['blockHash']:
+            logger.warning(f"Los logs del bloque {block_number} no coinciden con su hash; reintentando")
+            return False
+
+    deltas = compute_deltas(logs, set(tracked))
+    save_indexed_range(deltas, block_hashes, to_block, INDEXER_REORG_DEPTH, tracked, head)
+    logger.info(f"Indexados los bloques {from_block}-{to_block}: {len(logs)} transferencias, {len(deltas)} deltas")
+    return to_block < head and not missing
+
+def main():
+    init_db()
+    logger.info("Indexador de balances iniciado")
+    while True:
+        try:
+            if index_once():
+                continue
+        except Exception as e:
+            logger.error(f"Error en el indexador: {e}")
+        time.sleep(INDEXER_POLL_INTERVAL)
+
+if __name__ == '__main__':
+    main()
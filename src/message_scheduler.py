@@ -0,0 +1,177 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from dotenv import load_dotenv
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from cache import LRUCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Límites de Telegram: mensajes por segundo en total, por chat privado y por grupo
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', str(20 / 60)))
+# Reintentos tras un RetryAfter antes de dar el error por bueno
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+# Chats con limitador propio en memoria
+TELEGRAM_CHAT_LIMITERS = int(os.getenv('TELEGRAM_CHAT_LIMITERS', '10000'))
+
+# Prioridades: las respuestas a comandos pasan delante de las notificaciones de progreso
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Ediciones en las que solo importa la última si se acumulan varias
+_EDIT_ENDPOINTS = ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup')
+
+class _PriorityGate:
+    """Deja pasar peticiones a un ritmo fijo, atendiendo antes las de mayor prioridad"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._heap = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        self._paused_until = 0.0
+        # Turno del siguiente envío; se guarda entre dispatchers para espaciar también
+        # los envíos que llegan de uno en uno, no solo los que esperan a la vez
+        self._next_slot = 0.0
+
+    def pause(self, seconds):
+        """Detener los envíos durante seconds (Telegram pidió esperar)"""
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+    def depth(self):
+        return len(self._heap)
+
+    async def acquire(self, priority):
+        if self.rate <= 0:
+            # Sin límite de ritmo, pero una pausa pedida por Telegram se respeta igual
+            wait = self._paused_until - asyncio.get_running_loop().time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._heap:
+            wait = max(self._next_slot, self._paused_until) - loop.time()
+            if wait > 0:
+                # Al despertar se vuelve a mirar: pudo llegar una pausa o una petición más prioritaria
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+                self._next_slot = max(loop.time(), self._next_slot) + 1 / self.rate
+
+class MessageScheduler(BaseRateLimiter):
+    """
+    Planificador de los mensajes salientes del bot (rate limiter de PTB).
+
+    Todas las llamadas a la Bot API pasan por aquí: primero esperan al límite de
+    su chat y después al límite global. En los dos las respuestas interactivas
+    pasan delante de las notificaciones en bloque, así que una ráfaga de ediciones
+    de progreso no retrasa la respuesta a un comando del mismo chat. Si varias
+    ediciones del mismo mensaje esperan a la vez solo se envía la última, y tras un
+    RetryAfter se pausa el chat (o todo el bot) antes de reintentar.
+
+    Para marcar una llamada como notificación en bloque se pasa
+    rate_limit_args={'priority': PRIORITY_BULK}.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 group_rate=TELEGRAM_GROUP_RATE, max_retries=TELEGRAM_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._gate = _PriorityGate(global_rate)
+        self._chat_gates = LRUCache(maxsize=TELEGRAM_CHAT_LIMITERS)
+        self._edit_versions = {}
+        self._sent = 0
+        self._coalesced = 0
+        self._retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_gate(self, chat_id):
+        gate = self._chat_gates.get(chat_id)
+        if gate is None:
+            # Los ids de grupos y canales son negativos
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            gate = _PriorityGate(rate)
+            self._chat_gates.set(chat_id, gate)
+        return gate
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_INTERACTIVE)
+        chat_id = data.get('chat_id')
+
+        edit_key = None
+        if endpoint in _EDIT_ENDPOINTS and chat_id is not None:
+            edit_key = (chat_id, data.get('message_id'))
+            version = self._edit_versions.get(edit_key, (0, 0))[0] + 1
+            pending = self._edit_versions.get(edit_key, (0, 0))[1] + 1
+            self._edit_versions[edit_key] = (version, pending)
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                if chat_id is not None:
+                    await self._chat_gate(chat_id).acquire(priority)
+                await self._gate.acquire(priority)
+
+                # Si llegó una edición más reciente del mismo mensaje, esta ya no hace falta
+                if edit_key is not None and self._edit_versions[edit_key][0] != version:
+                    self._coalesced += 1
+                    return True
+
+                try:
+                    result = await callback(*args, **kwargs)
+                    self._sent += 1
+                    return result
+                except RetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self._retries += 1
+                    retry_after = float(e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds')
+                                        else e.retry_after)
+                    logger.warning(f"Telegram pidió esperar {retry_after}s ({endpoint}, chat {chat_id})")
+                    # La pausa retrasa también al resto de mensajes en cola del chat, no solo a este;
+                    # el reintento espera a que termine al volver a pedir turno
+                    if chat_id is not None:
+                        self._chat_gate(chat_id).pause(retry_after)
+                    else:
+                        self._gate.pause(retry_after)
+        finally:
+            if edit_key is not None:
+                version_now, pending = self._edit_versions[edit_key]
+                if pending > 1:
+                    self._edit_versions[edit_key] = (version_now, pending - 1)
+                else:
+                    del self._edit_versions[edit_key]
+
+    def stats(self):
+        """Obtener mensajes enviados, ediciones agrupadas, reintentos y cola global"""
+        return {
+            'sent': self._sent,
+            'coalesced_edits': self._coalesced,
+            'retries': self._retries,
+            'queue_depth': self._gate.depth(),
+            'pending_edits': len(self._edit_versions),
+        }
+
+message_scheduler = MessageScheduler()
@@ -0,0 +1,106 @@
+"""
+Re-encriptar las wallets del formato antiguo (Fernet con PBKDF2 por fila) al
+formato envelope (AES-GCM con la data key de cada usuario).
+
+Uso:
+    python src/migrate_encryption.py [--chunk-size 200] [--workers N] [--dry-run]
+"""
+import os
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+from database import (
+    init_db, get_wallets_by_version, update_wallet_ciphertexts, get_user_data_key,
+    get_or_create_user_data_key
+)
+from encryption import (
+    decrypt_private_key, encrypt_with_data_key, new_wrapped_data_key, unwrap_data_key,
+    KEY_VERSION_LEGACY, KEY_VERSION_ENVELOPE
+)
+
+load_dotenv()
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def reencrypt_wallet(wallet, data_key):
+    """Desencriptar una wallet del formato antiguo y encriptarla con la data key del usuario"""
+    encrypted_data = wallet['private_key']
+    if isinstance(encrypted_data, str):
+        encrypted_data = encrypted_data.encode()
+    private_key = decrypt_private_key(encrypted_data, wallet['salt'])
+    return wallet['id'], encrypt_with_data_key(private_key, data_key, wallet['address'])
+
+def load_data_keys(user_ids, dry_run):
+    """Obtener (creando si hace falta) la data key de cada usuario del lote"""
+    data_keys = {}
+    for user_id in user_ids:
+        if dry_run:
+            wrapped_key = get_user_data_key(user_id) or new_wrapped_data_key()
+        else:
+            wrapped_key = get_or_create_user_data_key(user_id, new_wrapped_data_key())
+        data_keys[user_id] = unwrap_data_key(wrapped_key)
+    return data_keys
+
+def migrate(chunk_size, workers, dry_run=False):
+    """
+    Migrar todas las wallets del formato antiguo por lotes
+
+    Cada lote se re-encripta en paralelo en el pool de procesos y se guarda en
+    una única transacción; las filas que fallan se dejan en el formato antiguo.
+
+    Returns:
+        tuple: (wallets migradas, wallets con error)
+    """
+    after_id = 0
+    migrated = 0
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            wallets = get_wallets_by_version(KEY_VERSION_LEGACY, after_id, chunk_size)
+            if not wallets:
+                break
+            after_id = wallets[-1]['id']
+
+            data_keys = load_data_keys({wallet['user_id'] for wallet in wallets}, dry_run)
+            futures = {
+                executor.submit(reencrypt_wallet, wallet, data_keys[wallet['user_id']]): wallet
+                for wallet in wallets
+            }
+
+            updates = []
+            for future in as_completed(futures):
+                wallet = futures[future]
+                try:
+                    wallet_id, encrypted_key = future.result()
+                    updates.append((wallet_id, encrypted_key, ''))
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Error al migrar wallet {wallet['id']} ({wallet['address']}): {e}")
+
+            if dry_run:
+                migrated += len(updates)
+            else:
+                migrated += update_wallet_ciphertexts(updates, KEY_VERSION_LEGACY, KEY_VERSION_ENVELOPE)
+            logger.info(f"Lote hasta id {after_id}: {migrated} migradas, {failed} con error")
+
+    return migrated, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrar las wallets al formato de encriptación envelope")
+    parser.add_argument('--chunk-size', type=int, default=200, help="Wallets por lote/transacción")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument('--dry-run', action='store_true', help="Re-encriptar sin escribir en la base de datos")
+    args = parser.parse_args()
+
+    init_db()
+    migrated, failed = migrate(args.chunk_size, args.workers, args.dry_run)
+    logger.info(f"Migración terminada: {migrated} wallets migradas, {failed} con error")
+
+if __name__ == '__main__':
+    main()
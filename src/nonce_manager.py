@@ -0,0 +1,218 @@
+import heapq
+import logging
+import threading
+from database import reserve_wallet_nonce, release_wallet_nonce, set_wallet_nonce, recover_wallet_nonce_gaps
+
+logger = logging.getLogger(__name__)
+
+# Fragmentos de los mensajes de error de los nodos que indican un nonce desincronizado
+NONCE_ERROR_MARKERS = (
+    'nonce too low',
+    'nonce too high',
+    'replacement transaction underpriced',
+    'invalid nonce',
+)
+# El nodo ya tiene exactamente esa transacción firmada (p. ej. al reenviarla tras un timeout):
+# no es un error de nonce, la transacción está emitida
+ALREADY_KNOWN_MARKERS = (
+    'already known',
+    'known transaction',
+)
+
+def is_nonce_error(error):
+    """Indicar si una excepción del nodo se debe a un nonce desincronizado"""
+    message = str(error).lower()
+    return any(marker in message for marker in NONCE_ERROR_MARKERS)
+
+def is_nonce_too_high(error):
+    """Indicar si el nodo rechazó la transacción por un nonce por encima del suyo"""
+    return 'nonce too high' in str(error).lower()
+
+def is_already_known(error):
+    """Indicar si el nodo rechazó la transacción porque ya la tenía"""
+    message = str(error).lower()
+    return any(marker in message for marker in ALREADY_KNOWN_MARKERS)
+
+class _AddressState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_nonce = None
+        self.in_flight = set()
+        self.released = []
+
+class NonceManager:
+    """
+    Reparte nonces por dirección en memoria, sin consultar la red en cada transacción.
+
+    Solo consulta a la red la primera vez que ve una dirección, al resincronizar
+    tras un error de nonce y al recuperar huecos de transacciones descartadas.
+    """
+
+    def __init__(self, fetch_nonce, fetch_highest_nonce=None):
+        """
+        Args:
+            fetch_nonce: Función (address) -> nonce pendiente según la red
+                         (eth_getTransactionCount con 'pending')
+            fetch_highest_nonce: Función (address) -> mayor nonce pendiente entre todos
+                                 los endpoints, para no dar por descartada una transacción
+                                 que un nodo atrasado aún no ha visto (por defecto fetch_nonce)
+        """
+        self._fetch_nonce = fetch_nonce
+        self._fetch_highest_nonce = fetch_highest_nonce or fetch_nonce
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, address):
+        with self._lock:
+            state = self._states.get(address)
+            if state is None:
+                state = self._states[address] = _AddressState()
+            return state
+
+    def reserve(self, address):
+        """Reservar el siguiente nonce libre de una dirección (reutilizando primero los liberados)"""
+        state = self._state(address)
+        with state.lock:
+            if state.released:
+                nonce = heapq.heappop(state.released)
+            else:
+                if state.next_nonce is None:
+                    state.next_nonce = self._fetch_nonce(address)
+                nonce = state.next_nonce
+                state.next_nonce += 1
+            state.in_flight.add(nonce)
+            return nonce
+
+    def release(self, address, nonce):
+        """Devolver un nonce reservado cuya transacción no llegó a emitirse"""
+        state = self._state(address)
+        with state.lock:
+            state.in_flight.discard(nonce)
+            if state.next_nonce is not None and nonce == state.next_nonce - 1:
+                state.next_nonce -= 1
+            elif nonce not in state.released:
+                heapq.heappush(state.released, nonce)
+
+    def confirm(self, address, nonce):
+        """Marcar como minada la transacción que usó un nonce"""
+        state = self._state(address)
+        with state.lock:
+            state.in_flight.discard(nonce)
+
+    def resync(self, address, allow_lower=False):
+        """
+        Volver a leer el nonce de una dirección de la red
+
+        El siguiente nonce nunca baja, salvo con allow_lower (el nodo respondió
+        'nonce too high'): un nodo atrasado devuelve un nonce menor y bajarlo
+        repartiría otra vez nonces de transacciones en curso. Los liberados por
+        debajo del nonce de la red ya se usaron y se olvidan.
+        """
+        state = self._state(address)
+        with state.lock:
+            chain_nonce = self._fetch_nonce(address)
+            if allow_lower or state.next_nonce is None:
+                state.next_nonce = chain_nonce
+                state.released = []
+            else:
+                state.next_nonce = max(state.next_nonce, chain_nonce)
+                state.released = [nonce for nonce in state.released if nonce >= chain_nonce]
+                heapq.heapify(state.released)
+            state.in_flight = {nonce for nonce in state.in_flight if nonce < state.next_nonce}
+            logger.info(f"Nonce de {address} resincronizado con la red: {state.next_nonce}")
+            return state.next_nonce
+
+    def recover_gaps(self, address, candidates):
+        """
+        Detectar transacciones descartadas por la red y liberar sus nonces
+
+        Solo se comprueban los candidatos: nonces de transacciones emitidas (con su
+        hash guardado) que llevan más de TRANSFER_RECEIPT_TIMEOUT sin recibo. Si ningún
+        endpoint tiene un nonce pendiente por encima, la transacción no está en ningún
+        mempool y su nonce vuelve a repartirse para rellenar el hueco. El siguiente
+        nonce nunca baja: los reservados por transacciones en curso siguen siendo suyos.
+
+        Returns:
+            list: Nonces candidatos cuya transacción ha descartado la red
+        """
+        state = self._state(address)
+        with state.lock:
+            chain_nonce = self._fetch_highest_nonce(address)
+            if state.next_nonce is None or chain_nonce > state.next_nonce:
+                state.next_nonce = chain_nonce
+            dropped = sorted(nonce for nonce in set(candidates) if nonce >= chain_nonce)
+            state.in_flight -= set(dropped)
+            state.released = [nonce for nonce in state.released if nonce >= chain_nonce]
+            for nonce in dropped:
+                if nonce < state.next_nonce and nonce not in state.released:
+                    state.released.append(nonce)
+            heapq.heapify(state.released)
+            if dropped:
+                logger.warning(f"Transacciones descartadas para {address}, nonces {dropped}")
+            return dropped
+
+    def stats(self):
+        """Obtener el número de direcciones seguidas y de nonces en vuelo"""
+        with self._lock:
+            states = list(self._states.values())
+        return {
+            'addresses': len(states),
+            'in_flight': sum(len(state.in_flight) for state in states),
+        }
+
+class PostgresNonceManager:
+    """
+    Reparto de nonces con la misma interfaz que NonceManager, guardado en Postgres.
+
+    Cada reserva bloquea la fila de la dirección en wallet_nonces (SELECT ... FOR
+    UPDATE), así que varios procesos de transfer_worker pueden emitir desde la misma
+    wallet sin repetir nonces. Solo se consulta la red la primera vez que se ve una
+    dirección, al resincronizar y al recuperar huecos.
+    """
+
+    def __init__(self, fetch_nonce, fetch_highest_nonce=None):
+        """
+        Args:
+            fetch_nonce: Función (address) -> nonce pendiente según la red
+                         (eth_getTransactionCount con 'pending')
+            fetch_highest_nonce: Función (address) -> mayor nonce pendiente entre todos
+                                 los endpoints (por defecto fetch_nonce)
+        """
+        self._fetch_nonce = fetch_nonce
+        self._fetch_highest_nonce = fetch_highest_nonce or fetch_nonce
+        self._reserved = 0
+
+    def reserve(self, address):
+        """Reservar el siguiente nonce libre de una dirección (reutilizando primero los liberados)"""
+        nonce = reserve_wallet_nonce(address.lower(), lambda _: self._fetch_nonce(address))
+        self._reserved += 1
+        return nonce
+
+    def release(self, address, nonce):
+        """Devolver un nonce reservado cuya transacción no llegó a emitirse"""
+        release_wallet_nonce(address.lower(), nonce)
+
+    def confirm(self, address, nonce):
+        """Las transacciones minadas no necesitan estado: el nonce ya avanzó en la tabla"""
+
+    def resync(self, address, allow_lower=False):
+        """Volver a leer el nonce de una dirección de la red y guardarlo (ver NonceManager.resync)"""
+        next_nonce = set_wallet_nonce(address.lower(), self._fetch_nonce(address), allow_lower)
+        logger.info(f"Nonce de {address} resincronizado con la red: {next_nonce}")
+        return next_nonce
+
+    def recover_gaps(self, address, candidates):
+        """
+        Detectar transacciones descartadas por la red y liberar sus nonces (ver NonceManager.recover_gaps)
+
+        Returns:
+            list: Nonces candidatos cuya transacción ha descartado la red
+        """
+        dropped = recover_wallet_nonce_gaps(address.lower(), self._fetch_highest_nonce(address), candidates)
+        if dropped:
+            logger.warning(f"Transacciones descartadas para {address}, nonces {dropped}")
+        return dropped
+
+    def stats(self):
+        """Obtener el número de nonces reservados por este proceso"""
+        return {'backend': 'postgres', 'reserved': self._reserved}
@@ -0,0 +1,81 @@
+import time
+import asyncio
+import threading
+
+class TokenBucket:
+    """
+    Token bucket compartido por hilos y por código async.
+
+    Las peticiones que superan el ritmo no fallan: reservan sus tokens por
+    adelantado (el saldo puede quedar negativo) y esperan el tiempo necesario
+    para que se repongan, así que se atienden en orden de llegada. Con rate <= 0
+    el limitador está desactivado.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._max_waiting = 0
+        self._acquired = 0
+        self._delayed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _reserve(self, cost):
+        """Reservar cost tokens y devolver cuántos segundos hay que esperar"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= cost
+            self._acquired += 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if delay > 0:
+                self._delayed += 1
+                self._total_wait += delay
+                self._max_wait = max(self._max_wait, delay)
+                self._waiting += 1
+                self._max_waiting = max(self._max_waiting, self._waiting)
+            return delay
+
+    def _done_waiting(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, cost=1):
+        """Esperar (bloqueando el hilo) hasta poder gastar cost tokens"""
+        delay = self._reserve(cost)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done_waiting()
+
+    async def acquire_async(self, cost=1):
+        """Esperar (sin bloquear el event loop) hasta poder gastar cost tokens"""
+        delay = self._reserve(cost)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done_waiting()
+
+    def stats(self):
+        """Obtener profundidad de la cola de espera y tiempos de espera"""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'queue_depth': self._waiting,
+                'max_queue_depth': self._max_waiting,
+                'acquired': self._acquired,
+                'delayed': self._delayed,
+                'avg_wait_ms': self._total_wait / self._delayed * 1000 if self._delayed else 0.0,
+                'max_wait_ms': self._max_wait * 1000,
+            }
@@ -0,0 +1,167 @@
+import os
+import socket
+import asyncio
+import logging
+import telegram.error
+from dotenv import load_dotenv
+from database import run_db, get_transfer_jobs, claim_transfer_requests, touch_transfer_requests
+from web3_utils import format_transfer_result
+from message_scheduler import PRIORITY_BULK
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos se consulta el progreso de las solicitudes seguidas
+RECEIPT_POLL_INTERVAL = float(os.getenv('RECEIPT_POLL_INTERVAL', '2'))
+# Segundos sin renovar tras los que otra instancia puede quedarse las solicitudes de una caída
+RECEIPT_TRACKER_LEASE = float(os.getenv('RECEIPT_TRACKER_LEASE', '60'))
+
+# Estados de una transferencia que todavía pueden cambiar (en cola, emitiéndose o sin recibo)
+PENDING_STATUSES = ('queued', 'running', 'sent')
+
+def request_header(request_id):
+    """Cabecera del mensaje de progreso de una solicitud de transferencia"""
+    return f"🔄 Transferencias de la solicitud #{request_id}\n\n"
+
+def format_sweep_message(header, results):
+    """Construir el mensaje de progreso de un barrido: una línea por wallet y un resumen"""
+    message = header
+    for result in results:
+        message += f"📝 {format_transfer_result(result)}\n"
+
+    confirmed = sum(1 for result in results if result['status'] == 'confirmed')
+    pending = sum(1 for result in results if result['status'] in PENDING_STATUSES)
+    message += f"\n📊 {confirmed}/{len(results)} transferencias confirmadas"
+    if pending:
+        message += f"\n⏳ {pending} pendientes de confirmación"
+    return message
+
+class _Sweep:
+    def __init__(self, bot, chat_id, message_id, header):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.header = header
+        self.snapshot = None
+
+class ReceiptTracker:
+    """
+    Sigue en segundo plano el progreso de las solicitudes de transferencia encoladas.
+
+    Los workers de la cola guardan el estado de cada job en transfer_jobs; en cada
+    vuelta se leen de una vez los jobs de todas las solicitudes seguidas y se edita
+    el mensaje de Telegram de las que cambiaron, hasta que todas sus wallets terminan.
+
+    Con varias instancias del bot cada solicitud la sigue una sola: la que la creó
+    o la que la reclamó (transfer_requests.tracked_by). Cada instancia renueva su
+    reserva cada lease / 3 segundos y, al hacerlo, reclama las solicitudes de las
+    instancias que dejaron de renovarla.
+    """
+
+    def __init__(self, poll_interval=RECEIPT_POLL_INTERVAL, lease=RECEIPT_TRACKER_LEASE, owner=None):
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._sweeps = {}
+        self._task = None
+        self._bot = None
+        self._next_claim = 0.0
+
+    def track(self, bot, chat_id, message_id, header, request_id):
+        """
+        Empezar a seguir una solicitud cuyo progreso se muestra en message_id
+
+        La solicitud tiene que estar reservada para esta instancia (tracked_by=owner
+        en set_transfer_request_message), o se deja de seguir al renovar las reservas.
+        """
+        self._sweeps[request_id] = _Sweep(bot, chat_id, message_id, header)
+
+    def stats(self):
+        """Obtener el número de solicitudes seguidas"""
+        return {'sweeps': len(self._sweeps)}
+
+    async def start(self, bot=None):
+        """
+        Arrancar la tarea de seguimiento en el event loop actual
+
+        Si se pasa el bot, se retoman las solicitudes que quedaron a medias antes
+        de un reinicio y, mientras corre, las de otras instancias que se caigan.
+        """
+        self._bot = bot
+        try:
+            await self.renew()
+        except Exception as e:
+            logger.error(f"Error al retomar las solicitudes de transferencia: {e}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detener la tarea de seguimiento"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if asyncio.get_running_loop().time() >= self._next_claim:
+                    await self.renew()
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Error en el seguimiento de transferencias: {e}")
+
+    async def renew(self):
+        """Renovar la reserva de las solicitudes seguidas y reclamar las que nadie sigue"""
+        self._next_claim = asyncio.get_running_loop().time() + self.lease / 3
+        if self._sweeps:
+            owned = set(await run_db(touch_transfer_requests, list(self._sweeps), self.owner))
+            for request_id in list(self._sweeps):
+                if request_id not in owned:
+                    # Otra instancia se la quedó porque esta tardó demasiado en renovar
+                    logger.warning(f"La solicitud {request_id} la sigue otra instancia")
+                    del self._sweeps[request_id]
+        if self._bot is not None:
+            for request in await run_db(claim_transfer_requests, self.owner, self.lease):
+                if request['id'] not in self._sweeps:
+                    self.track(self._bot, request['chat_id'], request['message_id'],
+                               request_header(request['id']), request['id'])
+
+    async def poll(self):
+        """Leer una vez el progreso de las solicitudes y actualizar los mensajes que cambiaron"""
+        if not self._sweeps:
+            return
+
+        jobs_by_request = await run_db(get_transfer_jobs, list(self._sweeps))
+        for request_id in list(self._sweeps):
+            jobs = jobs_by_request.get(request_id, [])
+            sweep = self._sweeps[request_id]
+            snapshot = [(job['status'], job['tx_hash'], job['error']) for job in jobs]
+            if snapshot != sweep.snapshot:
+                sweep.snapshot = snapshot
+                await self._edit(sweep, jobs)
+            if not any(job['status'] in PENDING_STATUSES for job in jobs):
+                del self._sweeps[request_id]
+
+    async def _edit(self, sweep, jobs):
+        try:
+            await sweep.bot.edit_message_text(
+                format_sweep_message(sweep.header, jobs),
+                chat_id=sweep.chat_id,
+                message_id=sweep.message_id,
+                # El progreso es una notificación en bloque: cede el paso a las respuestas
+                rate_limit_args={'priority': PRIORITY_BULK}
+            )
+        except telegram.error.BadRequest as e:
+            # Telegram rechaza las ediciones que no cambian el texto
+            if 'not modified' not in str(e).lower():
+                logger.error(f"Error al actualizar el progreso del barrido: {e}")
+        except Exception as e:
+            logger.error(f"Error al actualizar el progreso del barrido: {e}")
+
+receipt_tracker = ReceiptTracker()
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from web3.providers.base import JSONBaseProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+from rate_limiter import TokenBucket
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Endpoints JSON-RPC separados por comas (BASE_RPC_URL si no se configura)
+BASE_RPC_URLS = [url.strip() for url in os.getenv('BASE_RPC_URLS', os.getenv('BASE_RPC_URL') or '').split(',')
+                 if url.strip()]
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', '30'))
+# Conexiones keep-alive por endpoint
+RPC_POOL_CONNECTIONS = int(os.getenv('RPC_POOL_CONNECTIONS', '20'))
+# Peticiones recientes con las que se calcula la tasa de errores de cada endpoint
+RPC_HEALTH_WINDOW = int(os.getenv('RPC_HEALTH_WINDOW', '50'))
+# Fallos seguidos que abren el circuito de un endpoint y segundos que queda abierto
+RPC_BREAKER_FAILURES = int(os.getenv('RPC_BREAKER_FAILURES', '5'))
+RPC_BREAKER_COOLDOWN = float(os.getenv('RPC_BREAKER_COOLDOWN', '30'))
+# Límite global de peticiones por segundo al proveedor (0 lo desactiva); las que
+# lo superan esperan en cola en lugar de fallar
+RPC_RATE_LIMIT = float(os.getenv('RPC_RATE_LIMIT', '0'))
+RPC_RATE_BURST = float(os.getenv('RPC_RATE_BURST', str(max(RPC_RATE_LIMIT, 1))))
+
+# Peso de la última medida en la media móvil de latencia
+_LATENCY_ALPHA = 0.2
+# Penalización de la latencia por cada unidad de tasa de error
+_ERROR_PENALTY = 10
+
+class NoHealthyEndpoint(Exception):
+    """Todos los endpoints tienen el circuito abierto o fallaron en esta petición"""
+
+class Endpoint:
+    """
+    Un endpoint JSON-RPC con su sesión keep-alive, su salud y su circuit breaker.
+
+    El circuito se abre tras RPC_BREAKER_FAILURES fallos seguidos; pasado el
+    cooldown se deja pasar una sola petición de prueba (half-open) y, si va
+    bien, se vuelve a cerrar.
+    """
+
+    def __init__(self, url, window=RPC_HEALTH_WINDOW, pool_connections=RPC_POOL_CONNECTIONS):
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._latency = None
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._requests = 0
+
+    def error_rate(self):
+        with self._lock:
+            return self._error_rate()
+
+    def _error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def score(self):
+        """Latencia esperada penalizada por la tasa de errores (menor es mejor), o None sin medidas"""
+        with self._lock:
+            if self._latency is None:
+                return None
+            return self._latency * (1 + _ERROR_PENALTY * self._error_rate())
+
+    def acquire(self):
+        """
+        Reservar el endpoint para una petición
+
+        Con el circuito abierto solo se acepta la petición de prueba al acabar el cooldown.
+
+        Returns:
+            None si no acepta la petición ahora, True si es la petición de prueba
+            (quien la reservó tiene que llamar a release) o False si es una normal
+        """
+        with self._lock:
+            if self._consecutive_failures < RPC_BREAKER_FAILURES:
+                return False
+            if time.monotonic() < self._open_until or self._probing:
+                return None
+            self._probing = True
+            return True
+
+    def record(self, latency, ok):
+        """
+        Registrar el resultado de una petición
+
+        Los fallos también entran en la media de latencia (el pool pasa el timeout
+        como medida), para que un endpoint que solo falla no parezca el más rápido.
+        """
+        with self._lock:
+            self._requests += 1
+            self._outcomes.append(ok)
+            self._latency = latency if self._latency is None else (
+                _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * self._latency
+            )
+            if ok:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= RPC_BREAKER_FAILURES:
+                if time.monotonic() >= self._open_until:
+                    logger.warning(f"Circuito abierto para {self.url} tras {self._consecutive_failures} fallos")
+                self._open_until = time.monotonic() + RPC_BREAKER_COOLDOWN
+
+    def release(self):
+        """
+        Liberar la petición de prueba al terminar, con o sin resultado
+
+        Solo la llama la petición que la reservó: una normal que empezó antes de
+        abrirse el circuito y acaba después no deja pasar otra prueba.
+        """
+        with self._lock:
+            self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'url': self.url,
+                'requests': self._requests,
+                'latency_ms': self._latency * 1000 if self._latency is not None else None,
+                'error_rate': self._error_rate(),
+                'circuit': 'open' if self._consecutive_failures >= RPC_BREAKER_FAILURES else 'closed',
+            }
+
+def _cost(payload):
+    return len(payload) if isinstance(payload, list) else 1
+
+class ProviderPool:
+    """
+    Pool de endpoints JSON-RPC que envía cada petición al más sano.
+
+    Los endpoints se ordenan por latencia media penalizada por su tasa de errores;
+    si uno falla (error de conexión, timeout, HTTP 429 o 5xx) la petición se repite
+    en el siguiente, salvo que no sea segura de repetir.
+    """
+
+    def __init__(self, urls=None, timeout=RPC_TIMEOUT, rate_limit=RPC_RATE_LIMIT, rate_burst=RPC_RATE_BURST):
+        urls = urls or BASE_RPC_URLS
+        if not urls:
+            raise ValueError("No hay endpoints RPC configurados (BASE_RPC_URLS o BASE_RPC_URL)")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = timeout
+        # Cada petición de un batch cuenta contra el límite del proveedor, en cada intento
+        self.limiter = TokenBucket(rate_limit, rate_burst)
+        # Una sesión aiohttp por event loop, compartida por todos los endpoints
+        self._sessions = {}
+        # Sesión keep-alive para las peticiones a URLs que no son del pool (ver post_to)
+        self._session = requests.Session()
+
+    def _candidates(self):
+        scores = [(endpoint, endpoint.score()) for endpoint in self.endpoints]
+        measured = [score for _, score in scores if score is not None]
+        # Un endpoint sin medidas cuenta como la media de los demás: se prueba, pero no gana siempre
+        neutral = sum(measured) / len(measured) if measured else 0.0
+        # A igualdad de puntuación se reparte al azar
+        return [endpoint for endpoint, _ in sorted(
+            scores, key=lambda item: (neutral if item[1] is None else item[1], random.random())
+        )]
+
+    def _send(self, timeout, retry_on_timeout, cost=1, **kwargs):
+        timeout = timeout or self.timeout
+        last_error = None
+        for endpoint in self._candidates():
+            # La petición de prueba de un circuito abierto solo se reserva si se llega a usar
+            probe = endpoint.acquire()
+            if probe is None:
+                continue
+            try:
+                # Un reintento en otro endpoint también es tráfico: paga sus tokens otra vez
+                self.limiter.acquire(cost)
+                start = time.monotonic()
+                response = endpoint.session.post(endpoint.url, timeout=timeout, **kwargs)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                endpoint.record(timeout, False)
+                logger.warning(f"Error en el endpoint RPC {endpoint.url}: {e}")
+                last_error = e
+                if isinstance(e, requests.Timeout) and not retry_on_timeout:
+                    raise
+                continue
+            else:
+                endpoint.record(time.monotonic() - start, True)
+                return response
+            finally:
+                # Sin esto, una excepción no prevista dejaría el circuito esperando una prueba que no llega
+                if probe:
+                    endpoint.release()
+        raise NoHealthyEndpoint(f"Ningún endpoint RPC disponible: {last_error}")
+
+    def post(self, payload, timeout=None, retry_on_timeout=True):
+        """
+        Enviar un payload JSON-RPC (petición o batch) y devolver el cuerpo decodificado
+
+        Args:
+            payload: Petición o lista de peticiones JSON-RPC
+            timeout: Timeout HTTP en segundos (por defecto el del pool)
+            retry_on_timeout: Si es False, un timeout no se repite en otro endpoint
+                (la petición pudo llegar al nodo, p. ej. un eth_sendRawTransaction)
+        """
+        return self._send(timeout, retry_on_timeout, cost=_cost(payload), json=payload).json()
+
+    def post_to(self, url, payload, timeout=None):
+        """
+        Enviar un payload JSON-RPC a un endpoint concreto, sin failover ni circuit breaker
+
+        Para consultas que tienen que preguntar a cada nodo (p. ej. el mayor nonce
+        pendiente). Pagan sus tokens en el límite global como el resto de peticiones.
+        """
+        endpoint = next((endpoint for endpoint in self.endpoints if endpoint.url == url), None)
+        session = endpoint.session if endpoint is not None else self._session
+        self.limiter.acquire(_cost(payload))
+        response = session.post(url, json=payload, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def pick_url(self):
+        """
+        Elegir el endpoint más sano con el circuito cerrado
+
+        Para fijar a un mismo nodo una serie de consultas que tienen que ser
+        coherentes entre sí (p. ej. la cabeza y los logs de un rango), con post_to.
+        """
+        for endpoint in self._candidates():
+            probe = endpoint.acquire()
+            if probe is False:
+                return endpoint.url
+            if probe:
+                endpoint.release()
+        raise NoHealthyEndpoint("Ningún endpoint RPC con el circuito cerrado")
+
+    def post_raw(self, data, timeout=None, retry_on_timeout=True):
+        """Enviar un cuerpo JSON-RPC ya codificado y devolver la respuesta sin decodificar"""
+        return self._send(
+            timeout, retry_on_timeout, data=data, headers={'Content-Type': 'application/json'}
+        ).content
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=RPC_POOL_CONNECTIONS, keepalive_timeout=60)
+            session = self._sessions[loop] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def close_async(self):
+        """Cerrar la sesión aiohttp del event loop actual"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def _send_async(self, timeout, retry_on_timeout, cost=1, **kwargs):
+        session = self._get_session()
+        timeout = timeout or self.timeout
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        last_error = None
+        for endpoint in self._candidates():
+            probe = endpoint.acquire()
+            if probe is None:
+                continue
+            try:
+                await self.limiter.acquire_async(cost)
+                start = time.monotonic()
+                async with session.post(endpoint.url, timeout=client_timeout, **kwargs) as response:
+                    if response.status == 429 or response.status >= 500:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status,
+                            message=f"HTTP {response.status}"
+                        )
+                    response.raise_for_status()
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                endpoint.record(timeout, False)
+                logger.warning(f"Error en el endpoint RPC {endpoint.url}: {e!r}")
+                last_error = e
+                if isinstance(e, asyncio.TimeoutError) and not retry_on_timeout:
+                    raise
+                continue
+            else:
+                endpoint.record(time.monotonic() - start, True)
+                return body
+            finally:
+                # También si la tarea se cancela a mitad de la petición de prueba
+                if probe:
+                    endpoint.release()
+        raise NoHealthyEndpoint(f"Ningún endpoint RPC disponible: {last_error!r}")
+
+    async def post_async(self, payload, timeout=None, retry_on_timeout=True):
+        """Versión async de post, con la sesión aiohttp compartida"""
+        return json.loads(await self._send_async(timeout, retry_on_timeout, cost=_cost(payload), json=payload))
+
+    async def post_raw_async(self, data, timeout=None, retry_on_timeout=True):
+        """Versión async de post_raw, con la sesión aiohttp compartida"""
+        return await self._send_async(
+            timeout, retry_on_timeout, data=data, headers={'Content-Type': 'application/json'}
+        )
+
+    def stats(self):
+        """Obtener latencia, tasa de errores y estado del circuito de cada endpoint"""
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    def limiter_stats(self):
+        """Obtener la cola y los tiempos de espera del límite global de peticiones"""
+        return self.limiter.stats()
+
+class PooledProvider(JSONBaseProvider):
+    """Provider de Web3 que envía las peticiones a través de un ProviderPool"""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        # Reenviar una transacción firmada tras un timeout podría duplicarla
+        body = self.pool.post_raw(request_data, retry_on_timeout=method != 'eth_sendRawTransaction')
+        return self.decode_rpc_response(body)
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.stats()['circuit'] == 'closed' for endpoint in self.pool.endpoints)
+
+class PooledAsyncProvider(AsyncJSONBaseProvider):
+    """Provider de AsyncWeb3 que envía las peticiones a través de un ProviderPool"""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        body = await self.pool.post_raw_async(request_data, retry_on_timeout=method != 'eth_sendRawTransaction')
+        return self.decode_rpc_response(body)
+
+    async def is_connected(self, show_traceback=False):
+        return any(endpoint.stats()['circuit'] == 'closed' for endpoint in self.pool.endpoints)
@@ -0,0 +1,137 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+from cache import LRUCache
+from database import (
+    get_user_state_async, set_user_state_async, clear_user_state_async, purge_expired_user_states_async
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Backend del estado de conversación: 'memory' (un proceso) o 'postgres' (compartido entre instancias)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+# Segundos que dura un estado sin completarse y usuarios máximos en memoria
+STATE_TTL = float(os.getenv('STATE_TTL', '900'))
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', '100000'))
+# Cada cuántos segundos se borran los estados expirados
+STATE_PURGE_INTERVAL = float(os.getenv('STATE_PURGE_INTERVAL', '300'))
+
+class MemoryStateStore:
+    """
+    Estado de conversación en un LRU con TTL dentro del proceso.
+
+    La memoria queda acotada por maxsize: los usuarios menos recientes se
+    desalojan y los estados abandonados expiran solos.
+    """
+
+    def __init__(self, maxsize=STATE_CACHE_SIZE, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._states = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, user_id):
+        return self._states.get(user_id)
+
+    async def set(self, user_id, state):
+        self._states.set(user_id, state)
+
+    async def clear(self, user_id):
+        self._states.pop(user_id)
+
+    async def purge_expired(self):
+        return self._states.purge_expired()
+
+    def stats(self):
+        return dict(self._states.stats(), backend='memory')
+
+class PostgresStateStore:
+    """
+    Estado de conversación en la tabla user_states, compartido por todas las
+    instancias del bot. Cada usuario es una fila que se reemplaza con un upsert.
+    """
+
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._purged = 0
+
+    async def get(self, user_id):
+        return await get_user_state_async(user_id)
+
+    async def set(self, user_id, state):
+        await set_user_state_async(user_id, state, self.ttl)
+
+    async def clear(self, user_id):
+        await clear_user_state_async(user_id)
+
+    async def purge_expired(self):
+        purged = await purge_expired_user_states_async()
+        self._purged += purged
+        return purged
+
+    def stats(self):
+        return {'backend': 'postgres', 'purged': self._purged}
+
+class StateStore:
+    """
+    Fachada del estado de conversación por user_id con el backend configurado.
+
+    Además del backend, lleva la tarea que purga periódicamente los estados expirados.
+    """
+
+    def __init__(self, backend, purge_interval=STATE_PURGE_INTERVAL):
+        self.backend = backend
+        self.purge_interval = purge_interval
+        self._task = None
+
+    async def get(self, user_id):
+        """Obtener el estado de un usuario, o None si no tiene o expiró"""
+        return await self.backend.get(user_id)
+
+    async def set(self, user_id, state):
+        """Guardar el estado de un usuario (expira a los STATE_TTL segundos)"""
+        await self.backend.set(user_id, state)
+
+    async def clear(self, user_id):
+        """Olvidar el estado de un usuario"""
+        await self.backend.clear(user_id)
+
+    def stats(self):
+        """Obtener las estadísticas del backend"""
+        return self.backend.stats()
+
+    async def start(self):
+        """Arrancar la purga periódica en el event loop actual"""
+        if self.purge_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detener la purga periódica"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await self.backend.purge_expired()
+                if purged:
+                    logger.info(f"Purgados {purged} estados de conversación expirados")
+            except Exception as e:
+                logger.error(f"Error al purgar estados de conversación: {e}")
+
+def create_state_store(backend=STATE_BACKEND):
+    """Crear el almacén de estado con el backend indicado ('memory' o 'postgres')"""
+    if backend == 'postgres':
+        return StateStore(PostgresStateStore())
+    if backend == 'memory':
+        return StateStore(MemoryStateStore())
+    raise ValueError(f"STATE_BACKEND desconocido: {backend}")
+
+state_store = create_state_store()
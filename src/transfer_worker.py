@@ -0,0 +1,253 @@
+"""
+Worker de la cola de transferencias.
+
+Reclama los jobs de transfer_jobs con SELECT ... FOR UPDATE SKIP LOCKED, firma y
+emite cada transferencia, y sigue sus recibos hasta que se confirman, fallan o
+la red las descarta; las que tardan más de TRANSFER_RECEIPT_TIMEOUT se siguen
+consultando, más despacio. El hash y el nonce de cada transacción se guardan en
+su job antes de emitirla: un job que ya los tiene nunca se vuelve a emitir, solo
+se sigue su recibo, y una emisión que agota el timeout deja el job 'sent' porque
+la transacción pudo llegar al nodo. Los errores y las transacciones que la red
+descarta se reintentan con backoff exponencial. Se pueden arrancar tantos procesos como haga
+falta: ninguno reclama un job que ya tenga otro.
+
+Uso:
+    python src/transfer_worker.py
+"""
+import os
+import socket
+import random
+import asyncio
+import logging
+from dotenv import load_dotenv
+from database import (
+    init_db, run_db, read_user_wallets_async, claim_transfer_jobs, requeue_stale_transfer_jobs,
+    finish_transfer_job, retry_transfer_job, claim_sent_transfer_jobs, touch_transfer_jobs,
+    mark_transfer_job_signed
+)
+from web3_utils import (
+    async_w3, rpc_pool, nonce_manager, send_transfer_async, get_transaction_receipts_async, RPCError
+)
+from wallet import LazyWallet, unlock_wallets
+from crypto_pool import shutdown_crypto_pool
+
+load_dotenv()
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Máximo de wallets firmando/emitiendo a la vez en cada lote del worker
+TRANSFER_MAX_CONCURRENCY = int(os.getenv('TRANSFER_MAX_CONCURRENCY', '10'))
+# Segundos máximos esperando recibos y cada cuánto se consultan
+TRANSFER_RECEIPT_TIMEOUT = float(os.getenv('TRANSFER_RECEIPT_TIMEOUT', '120'))
+TRANSFER_POLL_INTERVAL = float(os.getenv('TRANSFER_POLL_INTERVAL', '2'))
+# Cada cuánto se consultan los recibos que ya superaron TRANSFER_RECEIPT_TIMEOUT
+TRANSFER_SLOW_POLL_INTERVAL = float(os.getenv('TRANSFER_SLOW_POLL_INTERVAL', '30'))
+# Tareas consumidoras por proceso y jobs que reclama cada una por vuelta
+TRANSFER_WORKER_TASKS = int(os.getenv('TRANSFER_WORKER_TASKS', '4'))
+TRANSFER_WORKER_BATCH = int(os.getenv('TRANSFER_WORKER_BATCH', '20'))
+TRANSFER_WORKER_POLL_INTERVAL = float(os.getenv('TRANSFER_WORKER_POLL_INTERVAL', '1'))
+# Intentos por job y backoff entre ellos (segundos)
+TRANSFER_JOB_MAX_ATTEMPTS = int(os.getenv('TRANSFER_JOB_MAX_ATTEMPTS', '5'))
+TRANSFER_RETRY_BASE_DELAY = float(os.getenv('TRANSFER_RETRY_BASE_DELAY', '5'))
+TRANSFER_RETRY_MAX_DELAY = float(os.getenv('TRANSFER_RETRY_MAX_DELAY', '300'))
+# Segundos tras los que un job 'running' se considera abandonado por un worker caído
+TRANSFER_JOB_LOCK_TIMEOUT = float(os.getenv('TRANSFER_JOB_LOCK_TIMEOUT', '300'))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def retry_delay(attempts):
+    """Backoff exponencial con jitter para el intento número attempts"""
+    delay = min(TRANSFER_RETRY_MAX_DELAY, TRANSFER_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+async def fail_or_retry(job, error):
+    """Reintentar un job fallido con backoff, o marcarlo como error si agotó los intentos"""
+    if job['attempts'] >= TRANSFER_JOB_MAX_ATTEMPTS:
+        logger.error(f"Job {job['id']} agotó sus {job['attempts']} intentos: {error}")
+        await run_db(finish_transfer_job, job['id'], {'status': 'error', 'error': error})
+        return
+    delay = retry_delay(job['attempts'])
+    logger.warning(f"Job {job['id']} falló (intento {job['attempts']}), reintento en {delay:.0f}s: {error}")
+    await run_db(retry_transfer_job, job['id'], error, delay)
+
+async def load_wallets(jobs):
+    """
+    Desbloquear las wallets de los jobs, una carga de claves por usuario
+
+    Returns:
+        tuple: (job_id -> LazyWallet, job_id -> error de lectura). Los jobs con
+               error de lectura se reintentan: suele ser un fallo temporal de Postgres
+    """
+    wallets = {}
+    failed = {}
+    by_user = {}
+    for job in jobs:
+        by_user.setdefault(job['user_id'], []).append(job)
+    for user_id, user_jobs in by_user.items():
+        try:
+            # Sin la caché: este proceso no recibe sus invalidaciones
+            rows = {row['address'].lower(): row for row in await read_user_wallets_async(user_id)}
+            user_wallets = []
+            for job in user_jobs:
+                row = rows.get(job['address'].lower())
+                if row is not None:
+                    wallets[job['id']] = LazyWallet(row)
+                    user_wallets.append(wallets[job['id']])
+            await unlock_wallets(user_id, user_wallets)
+        except Exception as e:
+            logger.error(f"Error al cargar las wallets del usuario {user_id}: {e}")
+            for job in user_jobs:
+                wallets.pop(job['id'], None)
+                failed[job['id']] = f"Error al cargar la wallet: {e}"
+    return wallets, failed
+
+async def keep_locked(jobs):
+    """Renovar el lock de los jobs mientras se procesan, para que no parezcan abandonados"""
+    job_ids = [job['id'] for job in jobs]
+    while True:
+        await asyncio.sleep(TRANSFER_JOB_LOCK_TIMEOUT / 3)
+        try:
+            await run_db(touch_transfer_jobs, job_ids, WORKER_ID)
+        except Exception as e:
+            logger.warning(f"No se pudo renovar el lock de {len(job_ids)} jobs: {e}")
+
+async def process_jobs(jobs):
+    """Firmar y emitir en paralelo las transferencias de los jobs reclamados"""
+    heartbeat = asyncio.create_task(keep_locked(jobs))
+    try:
+        await _process_jobs(jobs)
+    finally:
+        heartbeat.cancel()
+
+async def _process_jobs(jobs):
+    try:
+        wallets, failed = await load_wallets(jobs)
+        gas_price = await async_w3.eth.gas_price
+    except Exception as e:
+        # Sin esto los jobs se quedarían 'running' hasta TRANSFER_JOB_LOCK_TIMEOUT
+        logger.error(f"Error al preparar {len(jobs)} jobs: {e}")
+        await asyncio.gather(*(fail_or_retry(job, str(e)) for job in jobs))
+        return
+    semaphore = asyncio.Semaphore(TRANSFER_MAX_CONCURRENCY)
+
+    async def process(job):
+        if job['id'] in failed:
+            await fail_or_retry(job, failed[job['id']])
+            return
+        wallet = wallets.get(job['id'])
+        if wallet is None:
+            await run_db(finish_transfer_job, job['id'], {'status': 'error', 'error': 'La wallet ya no existe'})
+            return
+        if not wallet.unlocked:
+            # Un error de desencriptado no se arregla reintentando
+            await run_db(finish_transfer_job, job['id'], {'status': 'error', 'error': wallet.error})
+            return
+        async def persist(tx_hash, nonce):
+            await run_db(mark_transfer_job_signed, job['id'], tx_hash, nonce)
+
+        async with semaphore:
+            result = await send_transfer_async(
+                wallet.private_key, job['token'], job['destination'], gas_price, on_signed=persist
+            )
+        if result['status'] == 'error':
+            await fail_or_retry(job, result['error'])
+        else:
+            await run_db(finish_transfer_job, job['id'], result)
+
+    await asyncio.gather(*(process(job) for job in jobs))
+
+async def consume():
+    """Reclamar y procesar jobs en bucle"""
+    while True:
+        try:
+            jobs = await run_db(claim_transfer_jobs, WORKER_ID, TRANSFER_WORKER_BATCH)
+            if jobs:
+                await process_jobs(jobs)
+                continue
+        except Exception as e:
+            logger.error(f"Error al procesar jobs de transferencia: {e}")
+        await asyncio.sleep(TRANSFER_WORKER_POLL_INTERVAL)
+
+def apply_receipt(job, receipt):
+    """Actualizar el estado de un job a partir de su recibo JSON-RPC"""
+    job['status'] = 'confirmed' if int(receipt['status'], 16) == 1 else 'failed'
+    nonce_manager.confirm(job['address'], job['nonce'])
+
+def expire_results(jobs):
+    """
+    Marcar los jobs sin recibo como 'dropped' si la red los descartó, o 'timeout' si siguen pendientes
+
+    Cada job tiene que tener su tx_hash y llevar más de TRANSFER_RECEIPT_TIMEOUT sin recibo.
+    """
+    by_address = {}
+    for job in jobs:
+        by_address.setdefault(job['address'], []).append(job)
+    for address, address_jobs in by_address.items():
+        try:
+            dropped = nonce_manager.recover_gaps(address, [job['nonce'] for job in address_jobs])
+        except Exception as e:
+            logger.warning(f"Error al recuperar nonces de {address}: {e}")
+            dropped = []
+        for job in address_jobs:
+            job['status'] = 'dropped' if job['nonce'] in dropped else 'timeout'
+
+async def check_receipts_once():
+    """Consultar una vez los recibos de los jobs emitidos y devolver a la cola los abandonados"""
+    requeued = await run_db(requeue_stale_transfer_jobs, TRANSFER_JOB_LOCK_TIMEOUT)
+    if requeued:
+        logger.warning(f"{requeued} jobs abandonados recuperados (a la cola o a la espera de su recibo)")
+
+    jobs = await run_db(
+        claim_sent_transfer_jobs, 100, TRANSFER_POLL_INTERVAL,
+        TRANSFER_RECEIPT_TIMEOUT, TRANSFER_SLOW_POLL_INTERVAL
+    )
+    if not jobs:
+        return
+    receipts = await get_transaction_receipts_async([job['tx_hash'] for job in jobs])
+    expired = []
+    for job in jobs:
+        receipt = receipts.get(job['tx_hash'])
+        if receipt is not None and not isinstance(receipt, RPCError):
+            apply_receipt(job, receipt)
+            await run_db(finish_transfer_job, job['id'], job)
+        elif job['nonce'] is not None and job['age'] is not None and job['age'] >= TRANSFER_RECEIPT_TIMEOUT:
+            expired.append(job)
+    if expired:
+        await asyncio.to_thread(expire_results, expired)
+        for job in expired:
+            # Sin prueba de que la red la descartó, la transacción puede minarse todavía:
+            # el job sigue 'sent' y se consulta cada TRANSFER_SLOW_POLL_INTERVAL
+            if job['status'] == 'dropped':
+                # La red descartó la transacción: se vuelve a emitir con un nonce nuevo
+                await fail_or_retry(job, 'La red descartó la transacción')
+
+async def check_receipts():
+    """Consultar los recibos de los jobs emitidos en bucle"""
+    while True:
+        try:
+            await check_receipts_once()
+        except Exception as e:
+            logger.error(f"Error al consultar recibos de la cola: {e}")
+        await asyncio.sleep(TRANSFER_POLL_INTERVAL)
+
+async def run():
+    logger.info(f"Worker de transferencias {WORKER_ID} iniciado con {TRANSFER_WORKER_TASKS} tareas")
+    try:
+        await asyncio.gather(check_receipts(), *(consume() for _ in range(TRANSFER_WORKER_TASKS)))
+    finally:
+        await rpc_pool.close_async()
+        await asyncio.to_thread(shutdown_crypto_pool)
+
+def main():
+    init_db()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Worker de transferencias detenido")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+from telegram.ext import BaseUpdateProcessor
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Updates que se procesan a la vez (entre todos los usuarios)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+# Updates admitidos (en curso + en cola) antes de que PTB deje de sacar más de su cola
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '1024'))
+# Comandos de solo lectura que un usuario puede tener en curso a la vez (los limita el control de admisión).
+# /transfer no está: crea una solicitud en la cola y tiene que ver las wallets que el usuario añadió antes
+UPDATE_CONCURRENT_COMMANDS = {
+    command.strip().lower()
+    for command in os.getenv('UPDATE_CONCURRENT_COMMANDS', 'check,wallets').split(',')
+    if command.strip()
+}
+# Usuarios con la cola más larga que se muestran en las métricas
+UPDATE_STATS_TOP_USERS = 20
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesador de updates concurrente que conserva el orden de cada usuario.
+
+    Los updates de usuarios distintos se procesan en paralelo con un máximo de
+    workers. Dentro de un usuario, los updates que pueden cambiar el estado de la
+    conversación (mensajes, botones y el resto de comandos) se procesan de uno en
+    uno y en orden de llegada. Los comandos de UPDATE_CONCURRENT_COMMANDS solo
+    esperan a los updates con estado anteriores y pueden correr a la vez entre sí
+    (el control de admisión limita cuántos), así que solo deben estar los que no
+    escriben. Un update en cola no ocupa worker, así que un usuario con muchos
+    mensajes pendientes no bloquea a los demás.
+    """
+
+    def __init__(self, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING,
+                 concurrent_commands=UPDATE_CONCURRENT_COMMANDS):
+        super().__init__(max_concurrent_updates=max(max_pending, workers))
+        self.workers = workers
+        self.concurrent_commands = set(concurrent_commands)
+        self._workers = asyncio.BoundedSemaphore(workers)
+        # Usuario -> [fin del último update con estado, fines de los comandos concurrentes posteriores, pendientes]
+        self._queues = {}
+        self._running = 0
+        self._processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _key(update):
+        """Usuario (o chat, si no hay usuario) cuyo orden hay que respetar"""
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    def _is_concurrent(self, update):
+        """Indicar si el update es uno de los comandos de solo lectura"""
+        message = getattr(update, 'message', None)
+        text = getattr(message, 'text', None) or ''
+        if not text.startswith('/'):
+            return False
+        return text.split()[0][1:].split('@')[0].lower() in self.concurrent_commands
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = [None, [], 0]
+        finished = asyncio.get_running_loop().create_future()
+        if self._is_concurrent(update):
+            previous = [queue[0]]
+            queue[1].append(finished)
+        else:
+            # Un update con estado espera a todo lo anterior del usuario
+            previous = [queue[0]] + queue[1]
+            queue[0], queue[1] = finished, []
+        queue[2] += 1
+        try:
+            for future in previous:
+                if future is not None:
+                    # shield: si este update se cancela, el anterior sigue su curso
+                    await asyncio.shield(future)
+            await self._run(coroutine)
+        finally:
+            finished.set_result(None)
+            if finished in queue[1]:
+                queue[1].remove(finished)
+            # Sin updates pendientes el usuario no ocupa memoria
+            queue[2] -= 1
+            if not queue[2]:
+                del self._queues[key]
+
+    async def _run(self, coroutine):
+        async with self._workers:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+                self._processed += 1
+
+    def stats(self):
+        """Obtener workers ocupados, updates en cola y las colas por usuario más largas"""
+        lengths = {key: queue[2] for key, queue in self._queues.items()}
+        longest = sorted(lengths.items(), key=lambda item: item[1], reverse=True)[:UPDATE_STATS_TOP_USERS]
+        return {
+            'workers': self.workers,
+            'running': self._running,
+            'pending': sum(lengths.values()),
+            'users_pending': len(lengths),
+            'max_user_queue': longest[0][1] if longest else 0,
+            'user_queues': dict(longest),
+            'processed': self._processed,
+        }
+
+update_processor = PerUserUpdateProcessor()
@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from cache import LRUCache
+
+load_dotenv()
+
+# Usuarios cuyas wallets/destino se mantienen en memoria y durante cuánto tiempo (segundos)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+# Canal de LISTEN/NOTIFY para invalidar la caché entre instancias del bot
+USER_CACHE_CHANNEL = os.getenv('USER_CACHE_CHANNEL', 'virox_user_cache')
+
+class UserCache:
+    """
+    Caché read-through por usuario para las lecturas de wallets y destino.
+
+    Cada usuario tiene una entrada en un LRU con TTL que agrupa todas sus lecturas
+    (una por proyección de wallets y otra para el destino), así que invalidar a
+    un usuario borra todo lo suyo de una vez. Cada lectura caduca a los ttl
+    segundos de guardarse, aunque se sigan guardando otras del mismo usuario.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._version = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def version(self):
+        """Versión actual de la caché; se toma antes de leer de la base de datos"""
+        with self._lock:
+            return self._version
+
+    def get(self, user_id, key):
+        """
+        Buscar una lectura en caché
+
+        Returns:
+            tuple: (encontrado, valor); el valor puede ser None legítimamente
+        """
+        entry = self._entries.get(user_id)
+        with self._lock:
+            if entry is not None and key in entry:
+                value, expires_at = entry[key]
+                if expires_at > time.monotonic():
+                    self._hits += 1
+                    return True, value
+            self._misses += 1
+            return False, None
+
+    def set(self, user_id, key, value, version):
+        """
+        Guardar una lectura hecha con la versión dada
+
+        Si hubo alguna invalidación desde que se tomó la versión, la lectura puede
+        estar obsoleta y no se guarda.
+        """
+        with self._lock:
+            if version != self._version:
+                return
+            now = time.monotonic()
+            entry = self._entries.get(user_id) or {}
+            # Se copian solo las lecturas vigentes: la entrada renueva su TTL en el LRU
+            entry = {name: item for name, item in entry.items() if item[1] > now}
+            entry[key] = (value, now + self.ttl)
+            self._entries.set(user_id, entry)
+
+    def invalidate(self, user_id):
+        """Olvidar todas las lecturas de un usuario"""
+        with self._lock:
+            self._version += 1
+            self._invalidations += 1
+            self._entries.pop(user_id)
+
+    def clear(self):
+        """Olvidar todas las lecturas de todos los usuarios"""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Obtener aciertos, fallos, invalidaciones y tamaño de la caché"""
+        entries = self._entries.stats()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'users': entries['size'],
+                'maxsize': entries['maxsize'],
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'invalidations': self._invalidations,
+                'evictions': entries['evictions'],
+            }
+
+user_cache = UserCache()
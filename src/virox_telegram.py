@@ -3,9 +3,26 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from dotenv import load_dotenv
-from database import init_db, save_wallet, get_user_wallets, save_destination, get_user_destination, delete_user_wallets
-from web3_utils import get_wallets_info, check_balances, transfer_tokens
-from encryption import encrypt_private_key, decrypt_private_key
+from database import (
+    init_db, save_wallet_async, get_user_wallets_async, save_destination_async,
+    get_user_destination_async, delete_user_wallets_async, get_or_create_user_data_key_async,
+    start_user_cache_listener, stop_user_cache_listener, get_user_cache_stats, get_pool_stats, WALLET_LIST_COLUMNS,
+    create_transfer_request_async, set_transfer_request_message_async, get_transfer_request_async,
+    get_latest_transfer_request_id_async
+)
+from web3_utils import (
+    get_token_balances_async, format_token_balance, get_eth_balances_async, rpc_pool, RPCError
+)
+from receipt_tracker import receipt_tracker, request_header, format_sweep_message
+from encryption import new_wrapped_data_key, unwrap_data_key, KEY_VERSION_ENVELOPE
+from crypto_pool import encrypt_new_wallet, shutdown_crypto_pool
+from bulk_import import import_private_keys, format_import_summary, is_key_list, BULK_IMPORT_MAX_BYTES
+from balance_index import get_check_balances_async
+from webhook_server import run_webhook, BOT_MODE
+from state_store import state_store
+from admission import admission
+from message_scheduler import message_scheduler
+from update_processor import update_processor
 from web3 import Web3
 import time
 import asyncio
@@ -18,6 +35,8 @@ load_dotenv()
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TOKEN:
     raise ValueError("No se encontró el token del bot en las variables de entorno")
+# URL base de la Bot API (vacía = api.telegram.org)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '')
 
 BASE_RPC_URL = os.getenv('BASE_RPC_URL', 'https://mainnet.base.org')
 DB_URL = os.getenv('DATABASE_URL')
@@ -44,9 +63,6 @@ logger = logging.getLogger(__name__)
 # Inicializar la base de datos
 init_db()
 
-# Estados de usuario
-user_states = {}
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar el comando /start"""
     # Enviar la imagen del logo
@@ -80,8 +96,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Gestionar wallets\n"
         "/check <dirección> - Verificar balance de tokens\n"
         "/transfer <dirección> - Transferir tokens\n"
+        "/transfer status [n] - Ver el estado de una transferencia\n"
         "/wallets - Ver billeteras y balances en ETH\n"
-        "/help - Mostrar esta ayuda"
+        "/help - Mostrar esta ayuda\n\n"
+        "Para añadir varias wallets a la vez, pega varias private keys en un mensaje "
+        "o envía un fichero .txt/.csv con ellas."
     )
     await update.message.reply_text(help_text)
 
@@ -91,35 +110,34 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if query.data == 'add_wallet':
-        user_states[query.from_user.id] = 'waiting_private_key'
+        await state_store.set(query.from_user.id, 'waiting_private_key')
         await query.message.reply_text(
             "Por favor, envía la private key de tu wallet.\n"
             "⚠️ Asegúrate de que sea una private key válida de Base."
         )
     
     elif query.data == 'view_wallets':
-        wallets = get_user_wallets(query.from_user.id)
+        # Solo se leen las direcciones: listar no necesita material de claves
+        wallets = await get_user_wallets_async(query.from_user.id, WALLET_LIST_COLUMNS)
         if not wallets:
             await query.message.reply_text("No tienes wallets guardadas.")
             return
         
         message = "📋 Tus Wallets:\n\n"
         for wallet in wallets:
-            decrypted_key = decrypt_private_key(wallet['private_key'], wallet['salt'])
-            address = Web3().eth.account.from_key(decrypted_key).address
-            message += f"📍 {address}\n"
+            message += f"📍 {wallet['address']}\n"
         
         await query.message.reply_text(message)
     
     elif query.data == 'set_destination':
-        user_states[query.from_user.id] = 'waiting_destination'
+        await state_store.set(query.from_user.id, 'waiting_destination')
         await query.message.reply_text(
             "Por favor, envía la dirección de destino para las transferencias.\n"
             "⚠️ Asegúrate de que sea una dirección válida de Base."
         )
     
     elif query.data == 'delete_wallets':
-        if delete_user_wallets(query.from_user.id):
+        if await delete_user_wallets_async(query.from_user.id):
             await query.message.reply_text("✅ Todas tus wallets han sido eliminadas.")
         else:
             await query.message.reply_text("❌ Error al eliminar las wallets.")
@@ -128,31 +146,31 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Manejar mensajes de texto"""
     try:
         user_id = update.effective_user.id
-        message_text = update.message.text
+        message_text = update.message.text.strip()
+        state = await state_store.get(user_id)
 
+        if state == 'waiting_destination':
+            await set_destination_and_reply(update, user_id, message_text)
         # Verificar si el mensaje es una clave privada
-        if message_text.startswith('0x') and len(message_text) == 66:
+        elif message_text.startswith('0x') and len(message_text) == 66:
             logger.info(f"Intentando procesar clave privada para usuario {user_id}")
             
             try:
-                # Crear cuenta con la clave privada
-                account = Web3().eth.account.from_key(message_text)
-                logger.info(f"Cuenta creada con dirección: {account.address}")
+                # Obtener (o crear) la data key del usuario
+                wrapped_key = await get_or_create_user_data_key_async(user_id, new_wrapped_data_key())
+                data_key = unwrap_data_key(wrapped_key)
                 
-                # Generar salt único
-                salt = os.urandom(16).hex()
-                logger.info("Salt generado correctamente")
-                
-                # Encriptar la clave privada
-                encrypted_key = encrypt_private_key(message_text, salt)
-                logger.info("Clave encriptada correctamente")
+                # Validar la clave, derivar la dirección y encriptarla en el executor de criptografía
+                address, encrypted_key = await encrypt_new_wallet(message_text, data_key)
+                logger.info(f"Clave encriptada correctamente para la dirección: {address}")
                 
                 # Guardar en la base de datos
-                if save_wallet(user_id, account.address, encrypted_key, salt):
+                if await save_wallet_async(user_id, address, encrypted_key, '', KEY_VERSION_ENVELOPE):
                     logger.info(f"Wallet guardada correctamente para usuario {user_id}")
+                    await state_store.clear(user_id)
                     await update.message.reply_text(
                         f"✅ Wallet añadida correctamente\n"
-                        f"📍 Dirección: {account.address}\n"
+                        f"📍 Dirección: {address}\n"
                         f"🔑 Clave encriptada y guardada de forma segura"
                     )
                 else:
@@ -167,6 +185,10 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     "❌ Error al procesar la wallet.\n"
                     "Por favor, intenta de nuevo o contacta al soporte."
                 )
+        elif is_key_list(message_text):
+            # Varias claves pegadas en un mismo mensaje, separadas por espacios, líneas, comas o
+            # puntos y coma: importación en bloque (una frase cualquiera recibe la respuesta de siempre)
+            await import_keys_and_reply(update, user_id, message_text)
         else:
             # Si no es una clave privada, pedir una
             await update.message.reply_text(
@@ -180,6 +202,62 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "Por favor, intenta de nuevo más tarde."
         )
 
+async def set_destination_and_reply(update: Update, user_id, destination):
+    """Guardar la dirección de destino enviada tras pulsar '🎯 Configurar Destino'"""
+    if not Web3().is_address(destination):
+        await update.message.reply_text("❌ Dirección inválida. Por favor, envía una dirección válida de Base.")
+        return
+    
+    if await save_destination_async(user_id, destination):
+        await state_store.clear(user_id)
+        await update.message.reply_text(
+            f"✅ Dirección de destino guardada correctamente:\n"
+            f"🎯 {destination}"
+        )
+    else:
+        await update.message.reply_text("❌ Error al guardar la dirección de destino.")
+
+async def import_keys_and_reply(update: Update, user_id, text):
+    """Importar en bloque las claves de un texto y responder con el resumen"""
+    try:
+        summary = await import_private_keys(user_id, text)
+        if not summary['added'] and not summary['duplicate'] and not summary['invalid']:
+            await update.message.reply_text(
+                "❌ No se encontraron private keys.\n"
+                "Envía una clave por línea, separadas por comas o en un fichero .txt/.csv."
+            )
+            return
+        await update.message.reply_text(format_import_summary(summary))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {str(e)}")
+    except Exception as e:
+        logger.error(f"Error en la importación en bloque para usuario {user_id}: {e}")
+        await update.message.reply_text(
+            "❌ Error al importar las wallets.\n"
+            "Por favor, intenta de nuevo o contacta al soporte."
+        )
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Manejar ficheros .txt/.csv con varias private keys"""
+    user_id = update.effective_user.id
+    document = update.message.document
+    if document.file_size and document.file_size > BULK_IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"❌ El fichero es demasiado grande (máximo {BULK_IMPORT_MAX_BYTES // 1024} KB)."
+        )
+        return
+    
+    try:
+        file = await document.get_file()
+        content = await file.download_as_bytearray()
+        text = bytes(content).decode('utf-8-sig', errors='replace')
+    except Exception as e:
+        logger.error(f"Error al descargar el fichero de claves: {e}")
+        await update.message.reply_text("❌ No se pudo leer el fichero. Por favor, intenta de nuevo.")
+        return
+    
+    await import_keys_and_reply(update, user_id, text)
+
 async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar el comando /check"""
     if not context.args or len(context.args) != 1:
@@ -193,22 +271,19 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Dirección de token inválida.")
         return
     
-    wallets = get_user_wallets(update.message.from_user.id)
+    wallets = await get_user_wallets_async(update.message.from_user.id, WALLET_LIST_COLUMNS)
     if not wallets:
         await update.message.reply_text("❌ No tienes wallets guardadas.")
         return
     
     try:
         message = "🔍 Verificando balances...\n\n"
-        for wallet in wallets:
-            try:
-                decrypted_key = decrypt_private_key(wallet['private_key'], wallet['salt'])
-                address = Web3().eth.account.from_key(decrypted_key).address
-                balance = check_balances(decrypted_key, token_address)
-                message += f"📍 {address}\n💰 {balance}\n\n"
-            except Exception as e:
-                logger.error(f"Error al procesar wallet {address}: {e}")
-                message += f"❌ Error al verificar balance: {str(e)}\n\n"
+        addresses = [wallet['address'] for wallet in wallets]
+        
+        # Desde el índice de balances si está al día; si no, en un único aggregate3
+        result = await get_check_balances_async(addresses, token_address)
+        for wallet in result['wallets']:
+            message += f"{format_token_balance(wallet, result['token'])}\n\n"
         
         await update.message.reply_text(message)
     except Exception as e:
@@ -217,9 +292,14 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar el comando /transfer"""
+    if context.args and context.args[0] == 'status':
+        await transfer_status(update, context.args[1:])
+        return
+    
     if not context.args or len(context.args) != 1:
         await update.message.reply_text(
-            "❌ Uso incorrecto. Por favor usa: /transfer <dirección_del_token>"
+            "❌ Uso incorrecto. Por favor usa: /transfer <dirección_del_token>\n"
+            "o /transfer status [número_de_solicitud]"
         )
         return
     
@@ -228,7 +308,7 @@ async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Dirección de token inválida.")
         return
     
-    destination = get_user_destination(update.message.from_user.id)
+    destination = await get_user_destination_async(update.message.from_user.id)
     if not destination:
         await update.message.reply_text(
             "❌ No has configurado una dirección de destino.\n"
@@ -236,24 +316,73 @@ async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    wallets = get_user_wallets(update.message.from_user.id)
+    user_id = update.message.from_user.id
+    wallets = await get_user_wallets_async(user_id, WALLET_LIST_COLUMNS)
     if not wallets:
         await update.message.reply_text("No tienes wallets guardadas.")
         return
     
-    message = "🔄 Iniciando transferencias...\n\n"
-    for wallet in wallets:
-        decrypted_key = decrypt_private_key(wallet['private_key'], wallet['salt'])
-        result = transfer_tokens(decrypted_key, token_address, destination)
-        message += f"📝 {result}\n"
+    try:
+        balances = await get_token_balances_async([wallet['address'] for wallet in wallets], token_address)
+    except Exception as e:
+        logger.error(f"Error en transfer_command: {e}")
+        await update.message.reply_text(f"❌ Error al verificar balances: {str(e)}")
+        return
+    
+    # Las wallets sin balance se guardan ya terminadas y las que tienen van a la cola de
+    # transferencias; las que no se pudieron leer (balanceOf revertió) no se encolan
+    to_send = [wallet['address'] for wallet in balances['wallets'] if wallet['balance']]
+    empty = [wallet['address'] for wallet in balances['wallets'] if wallet['balance'] == 0]
+    unreadable = [wallet for wallet in balances['wallets'] if wallet['balance'] is None]
+    if unreadable:
+        await update.message.reply_text(
+            "⚠️ Estas wallets no se transferirán:\n\n"
+            + "\n\n".join(format_token_balance(wallet, balances['token']) for wallet in unreadable)
+        )
+    if not to_send and not empty:
+        return
+    
+    # Si Telegram reenvía el mismo comando no se encola una segunda solicitud
+    idempotency_key = f"{update.message.chat_id}:{update.message.message_id}"
+    request_id, created = await create_transfer_request_async(
+        idempotency_key, user_id, token_address, destination, to_send, empty
+    )
+    if not created:
+        await transfer_status(update, [str(request_id)])
+        return
     
-    await update.message.reply_text(message)
+    # Los workers de la cola emiten y confirman las transferencias; el mensaje se
+    # va editando a medida que cada wallet avanza
+    header = request_header(request_id)
+    request = await get_transfer_request_async(request_id)
+    sent_message = await update.message.reply_text(format_sweep_message(header, request['jobs']))
+    await set_transfer_request_message_async(
+        request_id, sent_message.chat_id, sent_message.message_id, tracked_by=receipt_tracker.owner
+    )
+    receipt_tracker.track(context.bot, sent_message.chat_id, sent_message.message_id, header, request_id)
+
+async def transfer_status(update: Update, args):
+    """Mostrar el estado de una solicitud de transferencia (por defecto la última del usuario)"""
+    user_id = update.message.from_user.id
+    if args:
+        if not args[0].lstrip('#').isdigit():
+            await update.message.reply_text("❌ Número de solicitud inválido.")
+            return
+        request_id = int(args[0].lstrip('#'))
+    else:
+        request_id = await get_latest_transfer_request_id_async(user_id)
+    
+    request = await get_transfer_request_async(request_id, user_id) if request_id else None
+    if not request:
+        await update.message.reply_text("❌ No se encontró la solicitud de transferencia.")
+        return
+    await update.message.reply_text(format_sweep_message(request_header(request_id), request['jobs']))
 
 async def wallets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mostrar las wallets del usuario"""
     try:
         user_id = update.effective_user.id
-        wallets = get_user_wallets(user_id)
+        wallets = await get_user_wallets_async(user_id, WALLET_LIST_COLUMNS)
         
         if not wallets:
             await update.message.reply_text(
@@ -263,39 +392,39 @@ async def wallets_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
             
         # Obtener la dirección de destino
-        destination = get_user_destination(user_id)
-        destination_address = destination[0] if destination else None
+        destination_address = await get_user_destination_async(user_id)
+        
+        # Todos los balances (wallets y destino) en un único batch JSON-RPC
+        addresses = [wallet['address'] for wallet in wallets]
+        if destination_address:
+            addresses.append(destination_address)
+        balances = await get_eth_balances_async(addresses)
         
         # Construir el mensaje
         message = "📋 Tus Wallets:\n\n"
         
         for wallet in wallets:
-            try:
-                # Desencriptar la clave privada
-                private_key = decrypt_private_key(wallet['private_key'], wallet['salt'])
-                
-                # Obtener el balance
-                balance = get_wallet_balance(wallet['address'])
-                
-                message += f"📍 Dirección: {wallet['address']}\n"
-                message += f"💰 Balance: {balance} ETH\n"
-                if wallet['is_default']:
-                    message += "⭐️ Wallet predeterminada\n"
-                message += "\n"
-            except Exception as e:
-                logger.error(f"Error al procesar wallet {wallet['address']}: {e}")
+            balance = balances[wallet['address']]
+            if isinstance(balance, RPCError):
+                logger.error(f"Error al procesar wallet {wallet['address']}: {balance}")
                 message += f"❌ Error al procesar wallet {wallet['address']}\n\n"
+                continue
+            
+            message += f"📍 Dirección: {wallet['address']}\n"
+            message += f"💰 Balance: {balance} ETH\n"
+            if wallet['is_default']:
+                message += "⭐️ Wallet predeterminada\n"
+            message += "\n"
         
         if destination_address:
-            try:
-                # Obtener el balance de la dirección de destino
-                dest_balance = get_wallet_balance(destination_address)
+            dest_balance = balances[destination_address]
+            if isinstance(dest_balance, RPCError):
+                logger.error(f"Error al obtener balance de destino: {dest_balance}")
+                message += f"\n❌ Error al obtener balance de destino: {str(dest_balance)}"
+            else:
                 message += f"\n🎯 Dirección de destino:\n"
                 message += f"📍 {destination_address}\n"
                 message += f"💰 Balance: {dest_balance} ETH"
-            except Exception as e:
-                logger.error(f"Error al obtener balance de destino: {e}")
-                message += f"\n❌ Error al obtener balance de destino: {str(e)}"
         
         await update.message.reply_text(message)
     except Exception as e:
@@ -309,7 +438,7 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar el comando /delete"""
     try:
         user_id = update.message.from_user.id
-        if delete_user_wallets(user_id):
+        if await delete_user_wallets_async(user_id):
             await update.message.reply_text("✅ Todas tus wallets han sido eliminadas correctamente.")
         else:
             await update.message.reply_text("❌ No tienes wallets guardadas para eliminar.")
@@ -334,7 +463,7 @@ async def destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("❌ Dirección inválida. Por favor, envía una dirección válida de Base.")
             return
         
-        if save_destination(user_id, destination):
+        if await save_destination_async(user_id, destination):
             await update.message.reply_text(
                 f"✅ Dirección de destino guardada correctamente:\n"
                 f"🎯 {destination}"
@@ -345,27 +474,84 @@ async def destination_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.error(f"Error en destination_command: {e}")
         await update.message.reply_text(f"❌ Error al configurar destino: {str(e)}")
 
+def get_bot_stats():
+    """Reunir las métricas de la instancia (se sirven en /stats en modo webhook)"""
+    return {
+        'admission': admission.stats(),
+        'rpc_limiter': rpc_pool.limiter_stats(),
+        'rpc_endpoints': rpc_pool.stats(),
+        'db_pool': get_pool_stats(),
+        'user_cache': get_user_cache_stats(),
+        'state_store': state_store.stats(),
+        'receipt_tracker': receipt_tracker.stats(),
+        'message_scheduler': message_scheduler.stats(),
+        'updates': update_processor.stats(),
+    }
+
+async def post_init(application: Application) -> None:
+    """Arrancar las tareas en segundo plano cuando la aplicación está lista"""
+    await receipt_tracker.start(application.bot)
+    await state_store.start()
+    start_user_cache_listener()
+
+async def post_shutdown(application: Application) -> None:
+    """Detener las tareas en segundo plano al apagar la aplicación"""
+    await receipt_tracker.stop()
+    await state_store.stop()
+    stop_user_cache_listener()
+    await rpc_pool.close_async()
+    # shutdown espera a las tareas en curso: fuera del event loop
+    await asyncio.to_thread(shutdown_crypto_pool)
+
+def build_application():
+    """Crear la aplicación de PTB con sus handlers (la usan main() y las pruebas de carga)"""
+    # Crear la aplicación; todos los mensajes salientes pasan por el planificador
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .rate_limiter(message_scheduler)
+        # Updates en paralelo entre usuarios, en orden dentro de cada usuario
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        # Bot API alternativa (servidor local o falso para pruebas de carga)
+        builder = builder.base_url(TELEGRAM_API_BASE_URL.rstrip('/') + '/bot')
+    application = builder.build()
+
+    # Añadir manejadores
+    application.add_handler(CommandHandler("start", start))
+    # Los comandos de solo lectura que un usuario puede solapar pasan por el control de admisión;
+    # /transfer no lo necesita: el orden por usuario ya lo procesa de uno en uno
+    application.add_handler(CommandHandler("wallets", admission.guard("wallets", wallets_command)))
+    application.add_handler(CommandHandler("check", admission.guard("check", check_command)))
+    application.add_handler(CommandHandler("transfer", transfer_command))
+    application.add_handler(CommandHandler("delete", delete_command))
+    application.add_handler(CommandHandler("destination", destination_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_messages))
+    application.add_handler(MessageHandler(
+        filters.Document.TXT | filters.Document.FileExtension('csv') | filters.Document.MimeType('text/csv'),
+        handle_document
+    ))
+    application.add_handler(CallbackQueryHandler(button_handler))
+
+    # Añadir manejador de errores
+    application.add_error_handler(error_handler)
+    return application
+
 def main():
     """Función principal para iniciar el bot"""
     try:
-        # Crear la aplicación
-        application = Application.builder().token(TOKEN).build()
-
-        # Añadir manejadores
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("wallets", wallets_command))
-        application.add_handler(CommandHandler("check", check_command))
-        application.add_handler(CommandHandler("delete", delete_command))
-        application.add_handler(CommandHandler("destination", destination_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_messages))
-        application.add_handler(CallbackQueryHandler(button_handler))
-
-        # Añadir manejador de errores
-        application.add_error_handler(error_handler)
+        application = build_application()
 
         # Iniciar el bot
-        logger.info("Iniciando bot...")
+        logger.info(f"Iniciando bot en modo {BOT_MODE}...")
+        
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application, allowed_updates=Update.ALL_TYPES, stats=get_bot_stats))
+            return
         
         # Configurar el polling con parámetros específicos
         application.run_polling(
@@ -0,0 +1,65 @@
+import logging
+from database import get_user_data_key_async
+from encryption import unwrap_data_key
+from crypto_pool import decrypt_wallets
+
+logger = logging.getLogger(__name__)
+
+async def load_user_data_key(user_id):
+    """Obtener la data key desenvuelta de un usuario (None si solo tiene wallets del formato antiguo)"""
+    wrapped_key = await get_user_data_key_async(user_id)
+    return unwrap_data_key(wrapped_key) if wrapped_key else None
+
+class LazyWallet:
+    """
+    Wallet guardada que solo desencripta su clave privada cuando hay que firmar.
+
+    Se construye a partir de una fila de get_user_wallets; la dirección y el resto
+    de columnas están disponibles sin tocar el material de claves.
+    """
+
+    def __init__(self, row):
+        self._row = row
+        self._private_key = None
+        self.error = None
+
+    @property
+    def address(self):
+        return self._row['address']
+
+    @property
+    def is_default(self):
+        return self._row.get('is_default', False)
+
+    @property
+    def unlocked(self):
+        return self._private_key is not None
+
+    @property
+    def private_key(self):
+        """Clave privada en claro (hay que llamar antes a unlock_wallets)"""
+        if self._private_key is None:
+            raise ValueError(f"La wallet {self.address} no está desbloqueada")
+        return self._private_key
+
+async def unlock_wallets(user_id, wallets):
+    """
+    Desencriptar en el executor de criptografía las wallets que aún no lo están
+
+    La data key del usuario solo se carga si hay alguna wallet que desbloquear.
+    Las wallets que fallan quedan bloqueadas con el motivo en wallet.error.
+
+    Returns:
+        list: Las wallets desbloqueadas correctamente
+    """
+    locked = [wallet for wallet in wallets if not wallet.unlocked]
+    if locked:
+        data_key = await load_user_data_key(user_id)
+        results = await decrypt_wallets([wallet._row for wallet in locked], data_key)
+        for wallet, result in zip(locked, results):
+            if result['error']:
+                logger.error(f"Error al desencriptar wallet {wallet.address}: {result['error']}")
+                wallet.error = result['error']
+            else:
+                wallet._private_key = result['private_key']
+    return [wallet for wallet in wallets if wallet.unlocked]
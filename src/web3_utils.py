@@ -1,12 +1,45 @@
 import os
-from web3 import Web3
+import asyncio
+import logging
+import threading
+import requests
+from decimal import Decimal
+from web3 import Web3, AsyncWeb3
 from dotenv import load_dotenv
+from cache import LRUCache
+from nonce_manager import NonceManager, PostgresNonceManager, is_nonce_error, is_nonce_too_high, is_already_known
+from rpc_pool import ProviderPool, PooledProvider, PooledAsyncProvider
+from database import get_stored_token_metadata, get_recent_token_metadata, save_token_metadata
 
 load_dotenv()
 
-# Configuración de la red Base
+logger = logging.getLogger(__name__)
+
+# Configuración de la red Base: las peticiones se reparten entre los endpoints de BASE_RPC_URLS
 BASE_RPC_URL = os.getenv('BASE_RPC_URL')
-w3 = Web3(Web3.HTTPProvider(BASE_RPC_URL))
+rpc_pool = ProviderPool()
+w3 = Web3(PooledProvider(rpc_pool))
+# Misma red y mismos endpoints para el código async, con una sesión aiohttp compartida
+async_w3 = AsyncWeb3(PooledAsyncProvider(rpc_pool))
+
+# Nonces repartidos localmente; la red solo se consulta al ver una dirección nueva o al resincronizar
+# Nonces en Postgres ('postgres', compartidos entre workers) o en memoria ('memory', un solo proceso)
+NONCE_BACKEND = os.getenv('NONCE_BACKEND', 'postgres')
+_nonce_manager_class = PostgresNonceManager if NONCE_BACKEND == 'postgres' else NonceManager
+nonce_manager = _nonce_manager_class(
+    lambda address: w3.eth.get_transaction_count(address, 'pending'),
+    lambda address: get_highest_pending_nonce(address)
+)
+
+# Multicall3 está desplegado en la misma dirección en Base y en la mayoría de redes EVM
+MULTICALL3_ADDRESS = os.getenv('MULTICALL3_ADDRESS', '0xcA11bde05977b3631167028862bE2a173976CA11')
+# Número máximo de llamadas por cada aggregate3
+MULTICALL_CHUNK_SIZE = int(os.getenv('MULTICALL_CHUNK_SIZE', '500'))
+# Número máximo de peticiones por cada batch JSON-RPC
+RPC_BATCH_SIZE = int(os.getenv('RPC_BATCH_SIZE', '100'))
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', '30'))
+# Tokens cuya metadata se mantiene en memoria
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '1024'))
 
 # ABI del token ERC20
 ERC20_ABI = [
@@ -50,79 +83,644 @@ ERC20_ABI = [
     }
 ]
 
-def check_balances(private_key, token_address):
+# ABI de Multicall3 (solo aggregate3)
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"}
+                ],
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"}
+                ],
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+# Codec ERC20 mínimo: selectores precalculados (primeros 4 bytes de keccak256 de la
+# firma) y codificación/decodificación a mano de las cinco funciones de ERC20_ABI,
+# sin pasar por la maquinaria genérica de ABI de web3
+SELECTOR_NAME = bytes.fromhex('06fdde03')       # name()
+SELECTOR_SYMBOL = bytes.fromhex('95d89b41')     # symbol()
+SELECTOR_DECIMALS = bytes.fromhex('313ce567')   # decimals()
+SELECTOR_BALANCE_OF = bytes.fromhex('70a08231') # balanceOf(address)
+SELECTOR_TRANSFER = bytes.fromhex('a9059cbb')   # transfer(address,uint256)
+
+_WORD_PADDING = bytes(12)
+
+def _encode_address(address):
+    raw = bytes.fromhex(address[2:] if address[:2] in ('0x', '0X') else address)
+    if len(raw) != 20:
+        raise ValueError(f"Dirección inválida: {address}")
+    return _WORD_PADDING + raw
+
+def encode_balance_of(address):
+    """Calldata de balanceOf(address)"""
+    return SELECTOR_BALANCE_OF + _encode_address(address)
+
+def encode_transfer(destination, amount):
+    """Calldata de transfer(address,uint256)"""
+    if not 0 <= amount < 2 ** 256:
+        raise ValueError(f"Cantidad fuera de rango uint256: {amount}")
+    return SELECTOR_TRANSFER + _encode_address(destination) + amount.to_bytes(32, 'big')
+
+def decode_uint(data):
+    """Decodificar un uint256/uint8 devuelto por balanceOf() o decimals()"""
+    if len(data) < 32:
+        raise ValueError(f"Respuesta ABI demasiado corta ({len(data)} bytes)")
+    return int.from_bytes(data[:32], 'big')
+
+def decode_bool(data):
+    """Decodificar el bool de transfer(); los tokens que no devuelven nada cuentan como éxito"""
+    return True if not data else decode_uint(data) != 0
+
+def decode_string(data):
+    """Decodificar name()/symbol(), aceptando tokens antiguos que devuelven bytes32"""
+    if len(data) >= 64:
+        offset = int.from_bytes(data[:32], 'big')
+        if offset + 32 <= len(data):
+            length = int.from_bytes(data[offset:offset + 32], 'big')
+            if offset + 32 + length <= len(data):
+                return data[offset + 32:offset + 32 + length].decode('utf-8', errors='replace')
+    if len(data) < 32:
+        raise ValueError(f"Respuesta ABI demasiado corta ({len(data)} bytes)")
+    return data[:32].rstrip(b'\x00').decode(errors='replace')
+
+# Contratos ya construidos por (instancia de Web3, dirección), para no rehacerlos en cada llamada
+_contract_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+
+def _get_contract(web3, address, abi):
+    key = (id(web3), address)
+    contract = _contract_cache.get(key)
+    if contract is None:
+        contract = web3.eth.contract(address=Web3.to_checksum_address(address), abi=abi)
+        _contract_cache.set(key, contract)
+    return contract
+
+def get_token_contract(token_address, web3=None):
+    """Obtener (reutilizando) el contrato web3 de un token ERC20"""
+    return _get_contract(web3 or w3, Web3.to_checksum_address(token_address), ERC20_ABI)
+
+def multicall(calls, web3=None, chunk_size=MULTICALL_CHUNK_SIZE, block_identifier='latest'):
+    """
+    Ejecutar varias llamadas de solo lectura con Multicall3.aggregate3
+
+    Args:
+        calls: Lista de tuplas (target, call_data)
+        web3: Instancia de Web3 a usar (por defecto la global)
+        chunk_size: Máximo de llamadas por cada eth_call
+        block_identifier: Bloque en el que se leen los datos
+
+    Returns:
+        list: Tuplas (success, return_data) en el mismo orden que calls
+    """
+    web3 = web3 or w3
+    multicall_contract = _get_contract(web3, MULTICALL3_ADDRESS, MULTICALL3_ABI)
+    results = []
+    for chunk in _multicall_chunks(calls, chunk_size):
+        results.extend(multicall_contract.functions.aggregate3(chunk).call(block_identifier=block_identifier))
+    return results
+
+async def multicall_async(calls, web3=None, chunk_size=MULTICALL_CHUNK_SIZE, block_identifier='latest'):
+    """Versión async de multicall: todos los chunks se envían a la vez"""
+    web3 = web3 or async_w3
+    multicall_contract = _get_contract(web3, MULTICALL3_ADDRESS, MULTICALL3_ABI)
+    chunks = await asyncio.gather(*(
+        multicall_contract.functions.aggregate3(chunk).call(block_identifier=block_identifier)
+        for chunk in _multicall_chunks(calls, chunk_size)
+    ))
+    return [result for chunk in chunks for result in chunk]
+
+def _multicall_chunks(calls, chunk_size):
+    for start in range(0, len(calls), chunk_size):
+        yield [(target, True, call_data) for target, call_data in calls[start:start + chunk_size]]
+
+# Caché de metadata de tokens: LRU en memoria respaldada por la tabla token_metadata
+_token_metadata_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+_token_cache_warmed = False
+_token_cache_lock = threading.Lock()
+
+def _warm_token_cache():
+    """Cargar en memoria la metadata guardada en Postgres la primera vez que se usa la caché"""
+    global _token_cache_warmed
+    if _token_cache_warmed:
+        return
+    with _token_cache_lock:
+        if _token_cache_warmed:
+            return
+        for metadata in get_recent_token_metadata(TOKEN_CACHE_SIZE):
+            _token_metadata_cache.set(metadata['address'], metadata)
+        _token_cache_warmed = True
+
+def get_cached_token_metadata(token_address):
+    """Obtener la metadata de un token desde la caché o Postgres, sin llamadas RPC"""
+    token = Web3.to_checksum_address(token_address)
+    _warm_token_cache()
+    metadata = _token_metadata_cache.get(token)
+    if metadata is None:
+        metadata = get_stored_token_metadata(token)
+        if metadata is not None:
+            _token_metadata_cache.set(token, metadata)
+    return metadata
+
+def _store_token_metadata(metadata):
+    _token_metadata_cache.set(metadata['address'], metadata)
+    save_token_metadata(metadata['address'], metadata['name'], metadata['symbol'], metadata['decimals'])
+
+def get_token_metadata(token_address, web3=None):
+    """Obtener name/symbol/decimals de un token, consultando la red solo si no está en caché"""
+    metadata = get_cached_token_metadata(token_address)
+    if metadata is None:
+        metadata = get_token_balances([], token_address, web3=web3)['token']
+    return metadata
+
+async def get_token_metadata_async(token_address):
+    """Versión async de get_token_metadata"""
+    metadata = await asyncio.to_thread(get_cached_token_metadata, token_address)
+    if metadata is None:
+        metadata = (await get_token_balances_async([], token_address))['token']
+    return metadata
+
+def get_token_cache_stats():
+    """Obtener los contadores de la caché de metadata de tokens"""
+    return _token_metadata_cache.stats()
+
+def get_token_balances(addresses, token_address, web3=None, chunk_size=MULTICALL_CHUNK_SIZE,
+                       block_identifier='latest'):
+    """
+    Obtener la metadata del token y el balance de varias wallets en lotes de Multicall3
+
+    Args:
+        addresses: Direcciones de las wallets
+        token_address: Dirección del token ERC20
+        web3: Instancia de Web3 a usar (por defecto la global)
+        chunk_size: Máximo de llamadas por cada eth_call
+        block_identifier: Bloque en el que se leen los balances
+
+    Returns:
+        dict: 'token' con name/symbol/decimals y 'wallets' con una entrada por
+              dirección (address, balance, readable_balance, error)
+    """
+    web3 = web3 or w3
+    token = Web3.to_checksum_address(token_address)
+    addresses = [Web3.to_checksum_address(address) for address in addresses]
+    metadata = get_cached_token_metadata(token)
+    calls = _token_balance_calls(token, addresses, metadata)
+    results = multicall(calls, web3=web3, chunk_size=chunk_size, block_identifier=block_identifier)
+    metadata, wallets, new_metadata = _decode_token_balances(token, addresses, metadata, results)
+    if new_metadata:
+        _store_token_metadata(metadata)
+    return {'token': metadata, 'wallets': wallets}
+
+async def get_token_balances_async(addresses, token_address, web3=None, chunk_size=MULTICALL_CHUNK_SIZE,
+                                   block_identifier='latest'):
+    """Versión async de get_token_balances: los lotes de Multicall3 se envían a la vez"""
+    web3 = web3 or async_w3
+    token = Web3.to_checksum_address(token_address)
+    addresses = [Web3.to_checksum_address(address) for address in addresses]
+    metadata = await asyncio.to_thread(get_cached_token_metadata, token)
+    calls = _token_balance_calls(token, addresses, metadata)
+    results = await multicall_async(calls, web3=web3, chunk_size=chunk_size, block_identifier=block_identifier)
+    metadata, wallets, new_metadata = _decode_token_balances(token, addresses, metadata, results)
+    if new_metadata:
+        await asyncio.to_thread(_store_token_metadata, metadata)
+    return {'token': metadata, 'wallets': wallets}
+
+def _token_balance_calls(token, addresses, metadata):
+    # La metadata solo se pide a la red si no está en caché, y en el mismo aggregate3
+    calls = []
+    if metadata is None:
+        calls = [(token, SELECTOR_NAME), (token, SELECTOR_SYMBOL), (token, SELECTOR_DECIMALS)]
+    calls.extend((token, encode_balance_of(address)) for address in addresses)
+    return calls
+
+def _decode_token_balances(token, addresses, metadata, results):
+    new_metadata = metadata is None
+    if new_metadata:
+        (name_ok, name_data), (symbol_ok, symbol_data), (decimals_ok, decimals_data) = results[:3]
+        if not (name_ok and symbol_ok and decimals_ok):
+            raise ValueError(f"El contrato {token} no responde como un token ERC20")
+        metadata = {
+            'address': token,
+            'name': decode_string(name_data),
+            'symbol': decode_string(symbol_data),
+            'decimals': decode_uint(decimals_data),
+        }
+        results = results[3:]
+
+    wallets = []
+    for address, (success, data) in zip(addresses, results):
+        if not success:
+            wallets.append({'address': address, 'balance': None, 'readable_balance': None,
+                            'error': 'balanceOf revertió'})
+            continue
+        balance = decode_uint(data)
+        wallets.append({
+            'address': address,
+            'balance': balance,
+            'readable_balance': balance / (10 ** metadata['decimals']),
+            'error': None,
+        })
+    return metadata, wallets, new_metadata
+
+def format_token_balance(wallet, token):
+    """Formatear una entrada de get_token_balances para mostrarla al usuario"""
+    if wallet['error']:
+        return f"📍 {wallet['address']}\n❌ Error al verificar balance: {wallet['error']}"
+    return f"📍 {wallet['address']}\n💰 {wallet['readable_balance']:.4f} {token['symbol']} ({token['name']})"
+
+async def check_balances_async(private_key, token_address):
     """Verificar el balance de tokens en una wallet"""
     try:
         account = w3.eth.account.from_key(private_key)
-        token_contract = w3.eth.contract(
-            address=Web3.to_checksum_address(token_address),
-            abi=ERC20_ABI
-        )
-        
-        name = token_contract.functions.name().call()
-        symbol = token_contract.functions.symbol().call()
-        decimals = token_contract.functions.decimals().call()
-        balance = token_contract.functions.balanceOf(account.address).call()
-        readable_balance = balance / (10 ** decimals)
-        
-        return f"📍 {account.address}\n💰 {readable_balance:.4f} {symbol} ({name})"
+        result = await get_token_balances_async([account.address], token_address)
+        return format_token_balance(result['wallets'][0], result['token'])
     
     except Exception as e:
         return f"❌ Error al verificar balance: {str(e)}"
 
-def transfer_tokens(private_key, token_address, destination):
-    """Transferir tokens desde una wallet a la dirección de destino"""
+def check_balances(private_key, token_address):
+    """Versión síncrona de check_balances_async, para scripts"""
+    return run_sync(check_balances_async(private_key, token_address))
+
+def _is_send_timeout(error):
+    # El pool no repite en otro endpoint un eth_sendRawTransaction que agotó el timeout
+    return isinstance(error, (requests.Timeout, asyncio.TimeoutError))
+
+def send_transfer(private_key, token_address, destination, gas_price=None, on_signed=None):
+    """
+    Firmar y emitir la transferencia de todo el balance de una wallet, sin esperar el recibo
+
+    El nonce lo reparte nonce_manager; si el nodo lo rechaza se resincroniza con la
+    red y se reintenta una vez. Si la emisión agota el timeout, la transacción pudo
+    llegar al nodo: se devuelve como 'sent', sin liberar su nonce, y no se vuelve a firmar.
+
+    Args:
+        on_signed: Función (tx_hash, nonce) llamada con cada transacción firmada antes
+                   de emitirla, para guardarla; si falla, la transacción no se emite
+
+    Returns:
+        dict: address, status ('sent', 'empty' o 'error'), tx_hash, nonce, readable_balance y error
+    """
+    result = {'address': None, 'status': 'error', 'tx_hash': None, 'nonce': None,
+              'readable_balance': None, 'error': None}
     try:
         account = w3.eth.account.from_key(private_key)
-        token_contract = w3.eth.contract(
-            address=Web3.to_checksum_address(token_address),
-            abi=ERC20_ABI
-        )
+        result['address'] = account.address
+        token = Web3.to_checksum_address(token_address)
         
-        balance = token_contract.functions.balanceOf(account.address).call()
-        decimals = token_contract.functions.decimals().call()
-        readable_balance = balance / (10 ** decimals)
+        balance = decode_uint(w3.eth.call({'to': token, 'data': encode_balance_of(account.address)}))
+        decimals = get_token_metadata(token_address)['decimals']
+        result['readable_balance'] = balance / (10 ** decimals)
         
         if balance == 0:
-            return f"📍 {account.address}\n❌ Sin tokens para transferir"
+            result['status'] = 'empty'
+            return result
         
-        nonce = w3.eth.get_transaction_count(account.address)
-        gas_price = w3.eth.gas_price
+        if gas_price is None:
+            gas_price = w3.eth.gas_price
         
-        tx = token_contract.functions.transfer(
-            Web3.to_checksum_address(destination),
-            balance
-        ).build_transaction({
-            'chainId': 8453,
-            'gas': 100000,
-            'gasPrice': gas_price,
-            'nonce': nonce,
-        })
+        for attempt in range(2):
+            nonce = nonce_manager.reserve(account.address)
+            broadcasting = False
+            try:
+                tx = _transfer_tx(token, destination, balance, gas_price, nonce)
+                signed_tx = w3.eth.account.sign_transaction(tx, private_key)
+                if on_signed is not None:
+                    on_signed(signed_tx.hash.hex(), nonce)
+                broadcasting = True
+                result['tx_hash'] = w3.eth.send_raw_transaction(signed_tx.rawTransaction).hex()
+                result['nonce'] = nonce
+                result['status'] = 'sent'
+                return result
+            except Exception as e:
+                # Tras un timeout la transacción pudo llegar al nodo: se trata como emitida y
+                # la resuelven su recibo o su expiración, nunca una segunda firma
+                timed_out = broadcasting and _is_send_timeout(e)
+                if timed_out:
+                    logger.warning(f"Timeout al emitir {signed_tx.hash.hex()}, se sigue como enviada")
+                if is_already_known(e) or timed_out:
+                    # El nodo ya tenía esta misma transacción: está emitida con este nonce
+                    result['tx_hash'] = signed_tx.hash.hex()
+                    result['nonce'] = nonce
+                    result['status'] = 'sent'
+                    return result
+                if is_nonce_error(e) and attempt == 0:
+                    nonce_manager.resync(account.address, allow_lower=is_nonce_too_high(e))
+                    continue
+                nonce_manager.release(account.address, nonce)
+                raise
+    
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+
+async def send_transfer_async(private_key, token_address, destination, gas_price=None, on_signed=None):
+    """Versión async de send_transfer, con AsyncWeb3 (on_signed es una corrutina)"""
+    result = {'address': None, 'status': 'error', 'tx_hash': None, 'nonce': None,
+              'readable_balance': None, 'error': None}
+    try:
+        account = w3.eth.account.from_key(private_key)
+        result['address'] = account.address
+        token = Web3.to_checksum_address(token_address)
+        
+        balance_data, metadata = await asyncio.gather(
+            async_w3.eth.call({'to': token, 'data': encode_balance_of(account.address)}),
+            get_token_metadata_async(token)
+        )
+        balance = decode_uint(balance_data)
+        result['readable_balance'] = balance / (10 ** metadata['decimals'])
+        
+        if balance == 0:
+            result['status'] = 'empty'
+            return result
         
-        signed_tx = w3.eth.account.sign_transaction(tx, private_key)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        w3.eth.wait_for_transaction_receipt(tx_hash)
+        if gas_price is None:
+            gas_price = await async_w3.eth.gas_price
         
-        return f"📍 {account.address}\n✅ Transferencia exitosa\n💰 {readable_balance:.4f} tokens\n🔗 Tx: {tx_hash.hex()}"
+        for attempt in range(2):
+            # reserve puede consultar la red con la instancia síncrona la primera vez
+            nonce = await asyncio.to_thread(nonce_manager.reserve, account.address)
+            broadcasting = False
+            try:
+                tx = _transfer_tx(token, destination, balance, gas_price, nonce)
+                signed_tx = w3.eth.account.sign_transaction(tx, private_key)
+                if on_signed is not None:
+                    await on_signed(signed_tx.hash.hex(), nonce)
+                broadcasting = True
+                result['tx_hash'] = (await async_w3.eth.send_raw_transaction(signed_tx.rawTransaction)).hex()
+                result['nonce'] = nonce
+                result['status'] = 'sent'
+                return result
+            except Exception as e:
+                # Tras un timeout la transacción pudo llegar al nodo: se trata como emitida y
+                # la resuelven su recibo o su expiración, nunca una segunda firma
+                timed_out = broadcasting and _is_send_timeout(e)
+                if timed_out:
+                    logger.warning(f"Timeout al emitir {signed_tx.hash.hex()}, se sigue como enviada")
+                if is_already_known(e) or timed_out:
+                    # El nodo ya tenía esta misma transacción: está emitida con este nonce
+                    result['tx_hash'] = signed_tx.hash.hex()
+                    result['nonce'] = nonce
+                    result['status'] = 'sent'
+                    return result
+                if is_nonce_error(e) and attempt == 0:
+                    await asyncio.to_thread(nonce_manager.resync, account.address, is_nonce_too_high(e))
+                    continue
+                await asyncio.to_thread(nonce_manager.release, account.address, nonce)
+                raise
     
     except Exception as e:
-        return f"❌ Error al transferir desde {account.address}: {str(e)}"
+        result['error'] = str(e)
+        return result
 
-def get_wallets_info(private_keys):
+def _transfer_tx(token, destination, balance, gas_price, nonce):
+    # Gas fijo: no hace falta estimarlo, así que la transacción se construye sin llamadas a la red
+    return {
+        'to': token,
+        'value': 0,
+        'data': encode_transfer(Web3.to_checksum_address(destination), balance),
+        'chainId': 8453,
+        'gas': 100000,
+        'gasPrice': gas_price,
+        'nonce': nonce,
+    }
+
+def format_transfer_result(result):
+    """Formatear el resultado de una transferencia para mostrarlo al usuario"""
+    address = result['address']
+    status = result['status']
+    if status == 'empty':
+        return f"📍 {address}\n❌ Sin tokens para transferir"
+    if status == 'confirmed':
+        return (f"📍 {address}\n✅ Transferencia exitosa\n"
+                f"💰 {result['readable_balance']:.4f} tokens\n🔗 Tx: {result['tx_hash']}")
+    if status == 'failed':
+        return f"📍 {address}\n❌ Transferencia revertida\n🔗 Tx: {result['tx_hash']}"
+    if status == 'dropped':
+        return f"📍 {address}\n❌ Transacción descartada por la red, vuelve a intentarlo\n🔗 Tx: {result['tx_hash']}"
+    if status in ('queued', 'running'):
+        return f"📍 {address}\n⏳ En cola para transferir" + (f" (reintentando: {result['error']})" if result.get('error') else "")
+    if status in ('sent', 'timeout'):
+        return f"📍 {address}\n⏳ Transferencia enviada, sin confirmar todavía\n🔗 Tx: {result['tx_hash']}"
+    return f"❌ Error al transferir desde {address}: {result['error']}"
+
+async def transfer_tokens_async(private_key, token_address, destination):
+    """Transferir tokens desde una wallet a la dirección de destino"""
+    result = await send_transfer_async(private_key, token_address, destination)
+    if result['status'] == 'sent':
+        try:
+            receipt = await async_w3.eth.wait_for_transaction_receipt(result['tx_hash'])
+            result['status'] = 'confirmed' if receipt['status'] == 1 else 'failed'
+            nonce_manager.confirm(result['address'], result['nonce'])
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+    return format_transfer_result(result)
+
+def transfer_tokens(private_key, token_address, destination):
+    """Versión síncrona de transfer_tokens_async, para scripts"""
+    return run_sync(transfer_tokens_async(private_key, token_address, destination))
+
+class RPCError(Exception):
+    """Error devuelto por el nodo para una petición concreta de un batch JSON-RPC"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{message} (código {code})")
+        self.code = code
+        self.message = message
+
+def rpc_batch(calls, url=None, chunk_size=RPC_BATCH_SIZE, timeout=RPC_TIMEOUT):
+    """
+    Enviar varias peticiones JSON-RPC como arrays batch (una petición HTTP por chunk)
+
+    Args:
+        calls: Lista de tuplas (method, params)
+        url: Endpoint JSON-RPC concreto, sin failover (por defecto el más sano de rpc_pool);
+             las dos formas pasan por el límite global de peticiones
+        chunk_size: Máximo de peticiones por batch
+        timeout: Timeout HTTP en segundos
+
+    Returns:
+        list: El resultado de cada petición, o un RPCError si esa petición falló,
+              en el mismo orden que calls
+    """
+    results = []
+    for start in range(0, len(calls), chunk_size):
+        chunk = calls[start:start + chunk_size]
+        payload = _batch_payload(chunk)
+        if url is None:
+            body = rpc_pool.post(payload, timeout=timeout)
+        else:
+            body = rpc_pool.post_to(url, payload, timeout=timeout)
+        results.extend(_batch_results(body, len(chunk)))
+    return results
+
+async def rpc_batch_async(calls, chunk_size=RPC_BATCH_SIZE, timeout=RPC_TIMEOUT):
+    """Versión async de rpc_batch: todos los chunks se envían a la vez por rpc_pool"""
+    chunks = [calls[start:start + chunk_size] for start in range(0, len(calls), chunk_size)]
+    bodies = await asyncio.gather(*(rpc_pool.post_async(_batch_payload(chunk), timeout=timeout) for chunk in chunks))
+    return [result for chunk, body in zip(chunks, bodies) for result in _batch_results(body, len(chunk))]
+
+def _batch_payload(chunk):
+    return [
+        {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+        for request_id, (method, params) in enumerate(chunk)
+    ]
+
+def _batch_results(body, size):
+    # Algunos nodos responden con un único objeto de error si rechazan el batch entero
+    if isinstance(body, dict):
+        error = body.get('error') or {}
+        batch_error = RPCError(error.get('code', -32603), error.get('message', 'Batch rechazado por el nodo'))
+        return [batch_error] * size
+
+    # Las respuestas de un batch pueden llegar en cualquier orden
+    by_id = {item.get('id'): item for item in body}
+    results = []
+    for request_id in range(size):
+        item = by_id.get(request_id)
+        if item is None:
+            results.append(RPCError(-32603, 'Sin respuesta para la petición'))
+        elif 'error' in item:
+            results.append(RPCError(item['error'].get('code'), item['error'].get('message')))
+        else:
+            results.append(item['result'])
+    return results
+
+def get_highest_pending_nonce(address):
+    """
+    Obtener el mayor nonce pendiente de una dirección entre todos los endpoints
+
+    Un nodo atrasado o que no recibió una transacción devuelve un nonce menor; el
+    mayor es el único que prueba que ningún mempool la tiene. Los endpoints que no
+    responden se ignoran.
+    """
+    nonces = []
+    for endpoint in rpc_pool.endpoints:
+        try:
+            result = rpc_batch([('eth_getTransactionCount', [address, 'pending'])], url=endpoint.url)[0]
+        except Exception as e:
+            logger.warning(f"Error al consultar el nonce de {address} en {endpoint.url}: {e}")
+            continue
+        if isinstance(result, RPCError):
+            logger.warning(f"Error al consultar el nonce de {address} en {endpoint.url}: {result}")
+            continue
+        nonces.append(int(result, 16))
+    if not nonces:
+        raise RPCError(-32603, f"Ningún endpoint devolvió el nonce de {address}")
+    return max(nonces)
+
+def get_rpc_pool_stats():
+    """Obtener latencia, tasa de errores y estado del circuito de cada endpoint RPC"""
+    return rpc_pool.stats()
+
+def get_eth_balances(addresses, block='latest', url=None, chunk_size=RPC_BATCH_SIZE):
+    """
+    Obtener el balance de ETH de varias direcciones con un batch de eth_getBalance
+
+    Returns:
+        dict: Dirección -> balance en ETH (Decimal), o RPCError si falló esa dirección
+    """
+    addresses = list(dict.fromkeys(addresses))
+    results = rpc_batch(
+        [('eth_getBalance', [address, block]) for address in addresses],
+        url=url,
+        chunk_size=chunk_size
+    )
+    return _eth_balances(addresses, results)
+
+async def get_eth_balances_async(addresses, block='latest', chunk_size=RPC_BATCH_SIZE):
+    """Versión async de get_eth_balances"""
+    addresses = list(dict.fromkeys(addresses))
+    results = await rpc_batch_async(
+        [('eth_getBalance', [address, block]) for address in addresses],
+        chunk_size=chunk_size
+    )
+    return _eth_balances(addresses, results)
+
+def _eth_balances(addresses, results):
+    balances = {}
+    for address, result in zip(addresses, results):
+        if isinstance(result, RPCError):
+            balances[address] = result
+        else:
+            balances[address] = Decimal(int(result, 16)) / Decimal(10 ** 18)
+    return balances
+
+def get_transaction_receipts(tx_hashes, url=None):
+    """
+    Obtener los recibos de varias transacciones con un batch de eth_getTransactionReceipt
+
+    Returns:
+        dict: Hash -> recibo (dict JSON-RPC), None si aún está pendiente, o RPCError
+    """
+    results = rpc_batch([('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes], url=url)
+    return dict(zip(tx_hashes, results))
+
+async def get_transaction_receipts_async(tx_hashes):
+    """Versión async de get_transaction_receipts"""
+    results = await rpc_batch_async([('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes])
+    return dict(zip(tx_hashes, results))
+
+async def get_wallets_info_async(private_keys):
     """
     Obtiene información de las wallets incluyendo balance de ETH y dirección
     """
-    wallets_info = []
+    addresses = []
     for pk in private_keys:
         try:
-            account = w3.eth.account.from_key(pk)
-            balance = w3.eth.get_balance(account.address)
-            balance_eth = w3.from_wei(balance, 'ether')
-            wallets_info.append({
-                'address': account.address,
-                'balance': balance_eth
-            })
+            addresses.append(w3.eth.account.from_key(pk).address)
         except Exception as e:
-            print(f"Error al obtener información de wallet: {e}")
+            logger.error(f"Error al obtener información de wallet: {e}")
+
+    try:
+        balances = await get_eth_balances_async(addresses)
+    except Exception as e:
+        logger.error(f"Error al obtener información de wallet: {e}")
+        return []
+
+    wallets_info = []
+    for address in addresses:
+        balance = balances[address]
+        if isinstance(balance, RPCError):
+            logger.error(f"Error al obtener información de wallet {address}: {balance}")
             continue
-    return wallets_info 
\ No newline at end of file
+        wallets_info.append({
+            'address': address,
+            'balance': balance
+        })
+    return wallets_info
+
+def get_wallets_info(private_keys):
+    """Versión síncrona de get_wallets_info_async, para scripts"""
+    return run_sync(get_wallets_info_async(private_keys))
+
+def run_sync(coro):
+    """
+    Ejecutar una corrutina de este módulo desde código síncrono (scripts)
+
+    Usa un event loop propio y cierra al terminar la sesión aiohttp que abrió.
+    """
+    async def run():
+        try:
+            return await coro
+        finally:
+            await rpc_pool.close_async()
+    return asyncio.run(run())
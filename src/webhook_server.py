@@ -0,0 +1,141 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from aiohttp import web
+from telegram import Update
+from dotenv import load_dotenv
+from database import ping_db_async
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Modo de recepción de updates: 'polling' o 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# URL pública del webhook (si está vacía no se registra en Telegram, útil en local)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Secreto que Telegram envía en la cabecera X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', '8080'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """
+    Servidor HTTP embebido que recibe los updates de Telegram por webhook.
+
+    Los updates válidos se meten en la cola de la aplicación de PTB, igual que
+    haría el polling. También expone /healthz (el proceso responde) y /readyz
+    (la aplicación está corriendo y la base de datos responde) para el balanceador,
+    y /stats con las métricas de la instancia (protegido con el mismo secreto).
+    """
+
+    def __init__(self, application, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=PORT,
+                 stats=None):
+        # Sin secreto cualquiera que llegue al puerto podría inyectar updates de cualquier usuario
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET es obligatorio con BOT_MODE=webhook")
+        self.application = application
+        self.stats = stats
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get('/healthz', self.handle_health)
+        self.app.router.add_get('/readyz', self.handle_ready)
+        self.app.router.add_get('/stats', self.handle_stats)
+
+    def _authorized(self, request):
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret)
+
+    async def handle_update(self, request):
+        """Validar el secreto y encolar el update recibido"""
+        if not self._authorized(request):
+            logger.warning(f"Webhook rechazado desde {request.remote}: secreto inválido")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Webhook con un update inválido: {e}")
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def handle_health(self, request):
+        return web.json_response({'status': 'ok'})
+
+    async def handle_ready(self, request):
+        checks = {'application': self.application.running}
+        try:
+            checks['database'] = await ping_db_async()
+        except Exception as e:
+            logger.warning(f"Readiness: la base de datos no responde: {e}")
+            checks['database'] = False
+        status = 200 if all(checks.values()) else 503
+        return web.json_response({'status': 'ok' if status == 200 else 'unavailable', 'checks': checks}, status=status)
+
+    async def handle_stats(self, request):
+        if not self._authorized(request):
+            return web.Response(status=403)
+        return web.json_response(self.stats() if self.stats else {}, dumps=lambda data: json.dumps(data, default=str))
+
+    async def start(self):
+        """Empezar a escuchar en host:port"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Servidor webhook escuchando en {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Dejar de aceptar peticiones"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def run_webhook(application, allowed_updates=None, stats=None):
+    """
+    Arrancar la aplicación en modo webhook hasta recibir SIGINT/SIGTERM
+
+    Si WEBHOOK_URL está configurada se registra el webhook en Telegram; si no, el
+    servidor solo acepta los updates que se le envíen directamente (pruebas locales).
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(application, stats=stats)
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            if WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=allowed_updates
+                )
+                logger.info(f"Webhook registrado en {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+            await server.start()
+            try:
+                await stop_event.wait()
+            finally:
+                await server.stop()
+                await application.stop()
+    finally:
+        # Como run_polling: post_shutdown después de application.shutdown(), al salir del async with
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# rpc_pool necesita algún endpoint al importarse; las pruebas crean sus propios pools
+os.environ.setdefault('BASE_RPC_URL', 'http://127.0.0.1:8546/')
+# encryption necesita una clave maestra al importarse (wallet, transfer_worker)
+os.environ.setdefault('ENCRYPTION_KEY', 'test-encryption-key')
+# virox_telegram necesita un token al importarse; las pruebas no llaman a la Bot API
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:test-token')
+
+# Los módulos del bot y los servidores falsos se importan por su nombre, como en producción
+for path in (os.path.join(ROOT, 'src'), os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Tablas que se vacían antes de cada prueba con Postgres
+_TABLES = (
+    'wallets', 'user_keys', 'destinations', 'token_metadata', 'user_states', 'transfer_requests',
+    'transfer_jobs', 'token_balances', 'balance_deltas', 'indexed_blocks', 'wallet_nonces', 'indexer_state',
+)
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """
+    Módulo database apuntando a TEST_DATABASE_URL, con las tablas creadas y vacías
+
+    La prueba se salta si no está configurada. Las tablas se vacían, así que tiene
+    que ser un Postgres desechable, nunca el de producción.
+    """
+    url = os.getenv('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("Falta TEST_DATABASE_URL (un Postgres desechable)")
+    monkeypatch.setenv('DATABASE_URL', url)
+    import database
+    database.close_pool()
+    database.init_db()
+    with database.db_connection() as conn:
+        conn.cursor().execute(f"TRUNCATE {', '.join(_TABLES)} CASCADE")
+        conn.commit()
+    yield database
+    database.close_pool()
@@ -0,0 +1,115 @@
+"""
+Pruebas del control de admisión: los duplicados de un comando en curso comparten
+su resultado (o su error) sin repetir el trabajo, y los comandos de un usuario
+por encima del límite se rechazan con un aviso.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from admission import AdmissionController
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+def make_update(user_id=1):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_message=FakeMessage())
+
+def make_context(*args):
+    return SimpleNamespace(args=list(args))
+
+class SlowHandler:
+    """Handler que no termina hasta que se abre la puerta, y cuenta sus llamadas"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.gate = None
+
+    async def __call__(self, update, context):
+        self.calls += 1
+        await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return f"{update.effective_user.id}:{' '.join(context.args)}"
+
+def run_concurrently(controller, handler, requests):
+    """Lanzar los (update, context) a la vez y abrir la puerta cuando todos esperan"""
+    async def main():
+        handler.gate = asyncio.Event()
+        wrapped = controller.guard('check', handler)
+        tasks = [asyncio.create_task(wrapped(update, context)) for update, context in requests]
+        await asyncio.sleep(0.01)
+        stats = controller.stats()
+        handler.gate.set()
+        return stats, await asyncio.gather(*tasks, return_exceptions=True)
+    return asyncio.run(main())
+
+def test_duplicates_share_one_call():
+    controller = AdmissionController(max_per_user=2)
+    handler = SlowHandler()
+    stats, results = run_concurrently(controller, handler, [(make_update(), make_context('0xABC')) for _ in range(3)])
+    assert handler.calls == 1
+    assert results == ['1:0xABC'] * 3
+    assert (stats['in_flight'], stats['users_in_flight']) == (1, 1)
+    assert controller.stats() == {'in_flight': 0, 'users_in_flight': 0, 'admitted': 1, 'coalesced': 2, 'rejected': 0}
+
+def test_arguments_are_compared_case_insensitively():
+    controller = AdmissionController(max_per_user=2)
+    handler = SlowHandler()
+    _, results = run_concurrently(controller, handler, [
+        (make_update(), make_context('0xabc')), (make_update(), make_context('0xABC')),
+        (make_update(2), make_context('0xabc')),
+    ])
+    # El mismo comando de otro usuario no es un duplicado
+    assert handler.calls == 2
+    assert results == ['1:0xabc', '1:0xabc', '2:0xabc']
+
+def test_error_reaches_every_duplicate_and_clears_the_entry():
+    controller = AdmissionController(max_per_user=2)
+    handler = SlowHandler(error=RuntimeError('nodo caído'))
+    _, results = run_concurrently(controller, handler, [(make_update(), make_context('0xabc')) for _ in range(3)])
+    assert handler.calls == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == 'nodo caído' for result in results)
+    assert (controller.stats()['in_flight'], controller.stats()['users_in_flight']) == (0, 0)
+
+    # El siguiente comando igual vuelve a ejecutarse
+    handler.error = None
+    _, results = run_concurrently(controller, handler, [(make_update(), make_context('0xabc'))])
+    assert (handler.calls, results) == (2, ['1:0xabc'])
+
+def test_cancelled_duplicate_does_not_cancel_the_command():
+    controller = AdmissionController(max_per_user=2)
+    handler = SlowHandler()
+
+    async def main():
+        handler.gate = asyncio.Event()
+        wrapped = controller.guard('check', handler)
+        first = asyncio.create_task(wrapped(make_update(), make_context('0xabc')))
+        duplicate = asyncio.create_task(wrapped(make_update(), make_context('0xabc')))
+        await asyncio.sleep(0.01)
+        duplicate.cancel()
+        await asyncio.sleep(0)
+        handler.gate.set()
+        return await first, duplicate.cancelled()
+
+    assert asyncio.run(main()) == ('1:0xabc', True)
+
+def test_commands_over_the_user_limit_are_rejected():
+    controller = AdmissionController(max_per_user=2)
+    handler = SlowHandler()
+    requests = [(make_update(), make_context(f'0x{index}')) for index in range(3)] + [(make_update(2), make_context('0x0'))]
+    stats, results = run_concurrently(controller, handler, requests)
+
+    assert handler.calls == 3
+    assert results == ['1:0x0', '1:0x1', None, '2:0x0']
+    rejected = requests[2][0].effective_message
+    assert len(rejected.replies) == 1 and 'demasiados comandos' in rejected.replies[0]
+    assert (stats['users_in_flight'], controller.stats()['rejected']) == (2, 1)
+
+    # Al terminar los anteriores el usuario vuelve a tener hueco
+    _, results = run_concurrently(controller, handler, [(make_update(), make_context('0x2'))])
+    assert results == ['1:0x2']
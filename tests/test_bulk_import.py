@@ -0,0 +1,70 @@
+"""
+Pruebas de la importación en bloque: extracción de claves de un texto pegado o
+de un CSV, detección de las listas de claves (con cualquier separador) y ruta del
+handler de mensajes hacia la importación.
+"""
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+from bulk_import import parse_private_keys, is_key_list
+
+KEY_A = '0x' + 'a1' * 32
+KEY_B = '0x' + 'b2' * 32
+
+def test_keys_are_normalized_and_deduplicated():
+    text = f"{KEY_A}\n{KEY_B.upper().replace('0X', '0x')}\n{KEY_A[2:]}\n"
+    keys, duplicates, invalid = parse_private_keys(text)
+    assert keys == [KEY_A, KEY_B]
+    assert duplicates == 1
+    assert invalid == 0
+
+def test_csv_headers_are_ignored_and_short_hex_is_invalid():
+    text = f'address,private_key\n0x{"12" * 20},"{KEY_A}"\nwallet;0x{"ab" * 20}ff'
+    keys, duplicates, invalid = parse_private_keys(text)
+    assert keys == [KEY_A]
+    assert duplicates == 0
+    # Las dos direcciones tienen forma hexadecimal pero no longitud de clave
+    assert invalid == 2
+
+def test_key_lists_with_any_separator_are_detected():
+    assert is_key_list(f"{KEY_A},{KEY_B}")
+    assert is_key_list(f"{KEY_A};{KEY_B}")
+    assert is_key_list(f"{KEY_A}\n{KEY_B}")
+    assert is_key_list(f'"{KEY_A}", "{KEY_B}"')
+
+def test_single_keys_and_sentences_are_not_key_lists():
+    assert not is_key_list(KEY_A)
+    assert not is_key_list(f"{KEY_A},")
+    assert not is_key_list("hola, quiero añadir mi wallet")
+    assert not is_key_list("0xabc,0xdef")
+
+def route_message(monkeypatch, text):
+    """Pasar un mensaje por handle_messages y devolver (textos importados, respuestas)"""
+    virox_telegram = importlib.import_module('virox_telegram')
+    imported, replies = [], []
+
+    async def import_keys_and_reply(update, user_id, message_text):
+        imported.append(message_text)
+
+    async def reply_text(message, **kwargs):
+        replies.append(message)
+
+    monkeypatch.setattr(virox_telegram, 'import_keys_and_reply', import_keys_and_reply)
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=42),
+        message=SimpleNamespace(text=text, reply_text=reply_text),
+    )
+    asyncio.run(virox_telegram.handle_messages(update, None))
+    return imported, replies
+
+def test_comma_separated_keys_are_imported_in_bulk(postgres, monkeypatch):
+    imported, replies = route_message(monkeypatch, f"{KEY_A},{KEY_B}")
+    assert imported == [f"{KEY_A},{KEY_B}"]
+    assert replies == []
+
+def test_other_text_gets_the_private_key_prompt(postgres, monkeypatch):
+    imported, replies = route_message(monkeypatch, "hola, quiero añadir mi wallet")
+    assert imported == []
+    assert len(replies) == 1
+    assert 'private key' in replies[0]
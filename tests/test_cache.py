@@ -0,0 +1,83 @@
+"""
+Pruebas de LRUCache (desalojo, expiración y contadores) y de la caché de
+cifradores Fernet derivados por salt de encryption.
+"""
+import pytest
+
+import cache
+import encryption
+from cache import LRUCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock.monotonic)
+    return clock
+
+def test_least_recently_used_entry_is_evicted():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+    stats = lru.stats()
+    assert stats['evictions'] == 1
+    assert (stats['hits'], stats['misses']) == (3, 1)
+    assert stats['hit_rate'] == 0.75
+
+def test_entries_expire_after_their_ttl(clock):
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set('a', 1)
+    lru.set('forever', 2, ttl=None)
+    lru.set('short', 3, ttl=1)
+    clock.now += 2
+    assert lru.get('short') is None
+    assert lru.get('a') == 1
+    clock.now += 4
+    assert lru.get('a', 'default') == 'default'
+    assert lru.get('forever') == 2
+    assert lru.stats()['expirations'] == 2
+
+def test_purge_expired_removes_only_expired_entries(clock):
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set('old', 1)
+    clock.now += 3
+    lru.set('new', 2)
+    clock.now += 3
+    assert lru.purge_expired() == 1
+    assert len(lru) == 1
+    assert lru.pop('new') == 2
+    assert lru.pop('new', 'gone') == 'gone'
+
+def test_a_cached_value_of_none_is_stored():
+    lru = LRUCache(maxsize=2)
+    lru.set('none', None)
+    assert lru.get('none', 'missing') is None
+    assert lru.stats()['hits'] == 1
+
+def test_fernet_is_derived_once_per_salt(monkeypatch):
+    derivations = []
+    derive = encryption.get_encryption_key
+    monkeypatch.setattr(encryption, 'get_encryption_key', lambda salt: derivations.append(salt) or derive(salt))
+    monkeypatch.setattr(encryption, 'start_key_cache_cleaner', lambda: None)
+    monkeypatch.setattr(encryption, '_fernet_cache', LRUCache(maxsize=10))
+
+    first = encryption.get_fernet('salt-a')
+    assert encryption.get_fernet(b'salt-a') is first
+    encryption.get_fernet('salt-b')
+    assert derivations == [b'salt-a', b'salt-b']
+
+    token = encryption.encrypt_private_key('0x' + '11' * 32, 'salt-a')
+    encryption.clear_key_cache()
+    # Tras vaciar la caché se vuelve a derivar la misma clave
+    assert encryption.decrypt_private_key(token, 'salt-a') == '0x' + '11' * 32
+    assert derivations == [b'salt-a', b'salt-b', b'salt-a']
@@ -0,0 +1,35 @@
+"""
+Pruebas del pool de criptografía: el límite de tareas en vuelo por event loop y
+los semáforos de los loops cerrados, que no se acumulan.
+"""
+import time
+import asyncio
+
+import crypto_pool
+from crypto_pool import run_crypto
+
+def test_closed_loops_do_not_keep_their_semaphore(monkeypatch):
+    monkeypatch.setattr(crypto_pool, '_semaphores', {})
+    for exponent in range(5):
+        assert asyncio.run(run_crypto(pow, 2, exponent)) == 2 ** exponent
+    # Solo queda el del último loop, que se olvida en la siguiente llamada
+    assert len(crypto_pool._semaphores) == 1
+
+def test_tasks_in_flight_are_limited(monkeypatch):
+    monkeypatch.setattr(crypto_pool, 'CRYPTO_MAX_CONCURRENCY', 2)
+    monkeypatch.setattr(crypto_pool, '_semaphores', {})
+    running = []
+    peak = []
+
+    def work(index):
+        running.append(index)
+        peak.append(len(running))
+        time.sleep(0.02)
+        running.remove(index)
+        return index
+
+    async def main():
+        return await asyncio.gather(*(run_crypto(work, index) for index in range(6)))
+
+    assert asyncio.run(main()) == list(range(6))
+    assert max(peak) <= 2
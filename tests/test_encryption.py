@@ -0,0 +1,109 @@
+"""
+Pruebas del formato envelope de las claves privadas (AES-GCM con la data key de
+cada usuario, ligada a la dirección de la wallet), del formato Fernet antiguo y,
+con Postgres, de la migración de uno a otro.
+"""
+import pytest
+from cryptography.exceptions import InvalidTag
+
+import encryption
+import migrate_encryption
+from encryption import (
+    encrypt_private_key, encrypt_with_data_key, decrypt_with_data_key, decrypt_wallet_key,
+    new_wrapped_data_key, unwrap_data_key, KEY_VERSION_LEGACY, KEY_VERSION_ENVELOPE
+)
+
+ADDRESS = '0x' + 'Ab' * 20
+OTHER_ADDRESS = '0x' + 'Cd' * 20
+PRIVATE_KEY = '0x' + '01' * 32
+
+def test_envelope_round_trip():
+    data_key = unwrap_data_key(new_wrapped_data_key())
+    encrypted = encrypt_with_data_key(PRIVATE_KEY, data_key, ADDRESS)
+    assert PRIVATE_KEY not in encrypted
+    # La dirección se compara en minúsculas
+    assert decrypt_with_data_key(encrypted, data_key, ADDRESS.lower()) == PRIVATE_KEY
+    wallet = {'address': ADDRESS, 'private_key': encrypted, 'salt': '', 'key_version': KEY_VERSION_ENVELOPE}
+    assert decrypt_wallet_key(wallet, data_key) == PRIVATE_KEY
+
+def test_each_encryption_uses_a_new_nonce():
+    data_key = unwrap_data_key(new_wrapped_data_key())
+    assert encrypt_with_data_key(PRIVATE_KEY, data_key, ADDRESS) != encrypt_with_data_key(PRIVATE_KEY, data_key, ADDRESS)
+
+def test_ciphertext_is_bound_to_its_wallet():
+    data_key = unwrap_data_key(new_wrapped_data_key())
+    encrypted = encrypt_with_data_key(PRIVATE_KEY, data_key, ADDRESS)
+    with pytest.raises(InvalidTag):
+        decrypt_with_data_key(encrypted, data_key, OTHER_ADDRESS)
+    moved = {'address': OTHER_ADDRESS, 'private_key': encrypted, 'salt': '', 'key_version': KEY_VERSION_ENVELOPE}
+    with pytest.raises(InvalidTag):
+        decrypt_wallet_key(moved, data_key)
+
+def test_ciphertext_needs_its_user_data_key():
+    encrypted = encrypt_with_data_key(PRIVATE_KEY, unwrap_data_key(new_wrapped_data_key()), ADDRESS)
+    with pytest.raises(InvalidTag):
+        decrypt_with_data_key(encrypted, unwrap_data_key(new_wrapped_data_key()), ADDRESS)
+    wallet = {'address': ADDRESS, 'private_key': encrypted, 'salt': '', 'key_version': KEY_VERSION_ENVELOPE}
+    with pytest.raises(ValueError):
+        decrypt_wallet_key(wallet)
+
+def test_wrapped_data_key_needs_the_master_key(monkeypatch):
+    wrapped = new_wrapped_data_key()
+    monkeypatch.setattr(encryption, 'MASTER_KEY_SALT', 'otra-master-key')
+    monkeypatch.setattr(encryption, '_master_key', encryption._derive_master_key())
+    with pytest.raises(InvalidTag):
+        unwrap_data_key(wrapped)
+
+def test_legacy_fernet_ciphertext_still_decrypts():
+    encrypted = encrypt_private_key(PRIVATE_KEY, 'salt-1')
+    wallet = {'address': ADDRESS, 'private_key': encrypted, 'salt': 'salt-1', 'key_version': KEY_VERSION_LEGACY}
+    assert decrypt_wallet_key(wallet) == PRIVATE_KEY
+    # Filas antiguas guardadas como bytea en la columna TEXT
+    assert decrypt_wallet_key(dict(wallet, private_key=b'\\x' + encrypted.hex().encode())) == PRIVATE_KEY
+    # Sin key_version la fila es del formato antiguo
+    del wallet['key_version']
+    assert decrypt_wallet_key(wallet) == PRIVATE_KEY
+
+def test_unknown_key_version_is_rejected():
+    wallet = {'address': ADDRESS, 'private_key': b'', 'salt': '', 'key_version': 3}
+    with pytest.raises(ValueError, match='desconocida'):
+        decrypt_wallet_key(wallet, unwrap_data_key(new_wrapped_data_key()))
+
+def stored_wallets(postgres):
+    wallets = postgres.get_wallets_by_version(KEY_VERSION_LEGACY) + postgres.get_wallets_by_version(KEY_VERSION_ENVELOPE)
+    return sorted(wallets, key=lambda wallet: wallet['id'])
+
+@pytest.fixture
+def legacy_wallets(postgres):
+    keys = {}
+    for index, user_id in enumerate((1, 1, 2)):
+        address = '0x' + f'{index + 1:02x}' * 20
+        keys[address] = '0x' + f'{index + 10:02x}' * 32
+        salt = f'salt-{index}'
+        encrypted = encrypt_private_key(keys[address], salt)
+        # La primera como la guardaban las versiones antiguas: bytes que psycopg2 envía como bytea
+        assert postgres.save_wallet(user_id, address, encrypted if index == 0 else encrypted.decode(), salt)
+    assert postgres.save_wallet(2, '0x' + 'ff' * 20, 'no-es-fernet', 'salt-x')
+    return keys
+
+def test_dry_run_writes_nothing(postgres, legacy_wallets):
+    before = stored_wallets(postgres)
+    assert migrate_encryption.migrate(chunk_size=2, workers=1, dry_run=True) == (3, 1)
+    assert stored_wallets(postgres) == before
+    assert postgres.get_user_data_key(1) is None
+
+def test_migration_reencrypts_every_wallet_once(postgres, legacy_wallets):
+    assert migrate_encryption.migrate(chunk_size=2, workers=1) == (3, 1)
+    migrated = stored_wallets(postgres)
+    for wallet in migrated:
+        if wallet['address'] not in legacy_wallets:
+            # La que no se pudo desencriptar se queda en el formato antiguo
+            assert wallet['key_version'] == KEY_VERSION_LEGACY
+            continue
+        assert (wallet['key_version'], wallet['salt']) == (KEY_VERSION_ENVELOPE, '')
+        data_key = unwrap_data_key(postgres.get_user_data_key(wallet['user_id']))
+        assert decrypt_wallet_key(wallet, data_key) == legacy_wallets[wallet['address']]
+
+    # Una segunda pasada no vuelve a tocar las migradas
+    assert migrate_encryption.migrate(chunk_size=2, workers=1) == (0, 1)
+    assert stored_wallets(postgres) == migrated
@@ -0,0 +1,20 @@
+"""
+Prueba del micro-benchmark del codec ERC20: antes de medir comprueba que el
+codec y web3 producen lo mismo en cada caso, así que basta con ejecutarlo.
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def test_benchmark_self_check_passes():
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'erc20_codec.py'), '--iterations', '10'],
+        capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.strip().splitlines()
+    # Cabecera y una fila por caso
+    assert len(lines) == 6
+    assert lines[-1].startswith('contrato del token')
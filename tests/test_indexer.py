@@ -0,0 +1,170 @@
+"""
+Pruebas del indexador de balances: conversión de eventos Transfer en deltas,
+detección del último bloque común tras un reorg y, con Postgres, la reversión
+del índice, la reindexación sobre la nueva cadena y el cursor que no pasa de
+los bloques que el nodo consultado todavía no tiene.
+"""
+import pytest
+
+import indexer
+
+TOKEN = '0x' + '56' * 20
+ALICE = '0x' + 'a1' * 20
+BOB = '0x' + 'b2' * 20
+CAROL = '0x' + 'c3' * 20
+
+def transfer_log(block_number, sender, receiver, value, block_hash=None, log_index=0):
+    return {
+        'address': TOKEN, 'blockNumber': hex(block_number), 'blockHash': block_hash or block_id(block_number),
+        'transactionHash': f'0x{block_number:064x}', 'logIndex': hex(log_index),
+        'topics': [indexer.TRANSFER_TOPIC, indexer._address_topic(sender), indexer._address_topic(receiver)],
+        'data': '0x' + hex(value)[2:].rjust(64, '0'),
+    }
+
+def block_id(number, fork='a'):
+    return '0x' + fork * 2 + f'{number:062x}'
+
+class FakeChain:
+    """Cadena falsa que responde a los batches de rpc_batch del indexador"""
+
+    def __init__(self, head, fork='a'):
+        self.head = head
+        self.hashes = {number: block_id(number, fork) for number in range(head + 1)}
+        self.logs = []
+        self.urls = set()
+
+    def pick_url(self):
+        return 'http://node-1/'
+
+    def reorg(self, from_block, fork):
+        for number in range(from_block, self.head + 1):
+            self.hashes[number] = block_id(number, fork)
+        self.logs = [log for log in self.logs if int(log['blockNumber'], 16) < from_block]
+
+    def rpc_batch(self, calls, url=None):
+        self.urls.add(url)
+        return [self.call(method, params) for method, params in calls]
+
+    def call(self, method, params):
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_getBlockByNumber':
+            number = int(params[0], 16)
+            return {'hash': self.hashes[number]} if number in self.hashes else None
+        assert method == 'eth_getLogs'
+        query = params[0]
+        start, end = int(query['fromBlock'], 16), int(query['toBlock'], 16)
+        position = 1 if query['topics'][1] is not None else 2
+        return [
+            log for log in self.logs
+            if start <= int(log['blockNumber'], 16) <= end and log['topics'][position] in query['topics'][position]
+        ]
+
+def test_deltas_only_track_bot_wallets():
+    logs = [
+        transfer_log(12, ALICE, CAROL, 300),
+        transfer_log(10, CAROL, ALICE, 1000),
+        # Entre dos wallets del bot: un delta por cada lado
+        transfer_log(12, ALICE, BOB, 50, log_index=1),
+    ]
+    assert indexer.compute_deltas(logs, {ALICE, BOB}) == [
+        (10, TOKEN, ALICE, 1000),
+        (12, TOKEN, ALICE, -350),
+        (12, TOKEN, BOB, 50),
+    ]
+
+def test_deltas_skip_nft_transfers_and_zero_sums():
+    nft = transfer_log(10, CAROL, ALICE, 0)
+    nft['topics'].append('0x' + '0' * 63 + '7')
+    nft['data'] = '0x'
+    logs = [nft, transfer_log(11, ALICE, BOB, 20), transfer_log(11, BOB, ALICE, 20, log_index=1)]
+    assert indexer.compute_deltas(logs, {ALICE}) == []
+
+def test_detect_reorg_returns_last_common_block(monkeypatch):
+    chain = FakeChain(105)
+    stored = {number: block_id(number) for number in range(100, 106)}
+    chain.reorg(103, 'b')
+    monkeypatch.setattr(indexer, 'rpc_batch', chain.rpc_batch)
+    monkeypatch.setattr(indexer, 'get_indexed_block_hashes', lambda from_block: dict(stored))
+    assert indexer.detect_reorg(105) == 102
+
+def test_detect_reorg_ignores_a_matching_cursor(monkeypatch):
+    chain = FakeChain(105)
+    monkeypatch.setattr(indexer, 'rpc_batch', chain.rpc_batch)
+    monkeypatch.setattr(indexer, 'get_indexed_block_hashes', lambda from_block: {105: block_id(105)})
+    assert indexer.detect_reorg(105) is None
+
+@pytest.fixture
+def indexed_chain(postgres, monkeypatch):
+    chain = FakeChain(100)
+    monkeypatch.setattr(indexer, 'rpc_batch', chain.rpc_batch)
+    monkeypatch.setattr(indexer, 'rpc_pool', chain)
+    monkeypatch.setattr(indexer, 'get_tracked_addresses', lambda: [ALICE, BOB])
+    assert indexer.index_once() is False
+    assert postgres.get_indexer_state()['block_number'] == 100
+    return chain
+
+def test_index_applies_deltas_to_seeded_balances(postgres, indexed_chain):
+    assert postgres.seed_token_balances(TOKEN, {ALICE: 1000}, 100)
+    indexed_chain.head = 102
+    indexed_chain.hashes.update({101: block_id(101), 102: block_id(102)})
+    indexed_chain.logs = [transfer_log(101, ALICE, CAROL, 300)]
+
+    assert indexer.index_once() is False
+    assert postgres.get_indexer_state()['block_number'] == 102
+    # BOB no está sembrado: su fila se leerá de la red cuando se pida
+    assert postgres.get_indexed_balances(TOKEN, [ALICE, BOB]) == {ALICE: 700}
+
+def test_cursor_stops_at_the_last_block_the_node_has(postgres, indexed_chain):
+    assert postgres.seed_token_balances(TOKEN, {ALICE: 1000}, 100)
+    # El nodo anuncia la cabeza 105 pero todavía no sirve los bloques 103-105
+    indexed_chain.head = 105
+    indexed_chain.hashes.update({101: block_id(101), 102: block_id(102)})
+    indexed_chain.logs = [transfer_log(102, ALICE, CAROL, 100), transfer_log(104, ALICE, CAROL, 300)]
+
+    assert indexer.index_once() is False
+    assert postgres.get_indexer_state()['block_number'] == 102
+    assert postgres.get_indexed_balances(TOKEN, [ALICE]) == {ALICE: 900}
+
+    indexed_chain.hashes.update({number: block_id(number) for number in range(103, 106)})
+    assert indexer.index_once() is False
+    assert postgres.get_indexer_state()['block_number'] == 105
+    assert postgres.get_indexed_balances(TOKEN, [ALICE]) == {ALICE: 600}
+    # Cabeza, logs y hashes salen siempre del mismo nodo
+    assert indexed_chain.urls == {'http://node-1/'}
+
+def test_range_is_not_indexed_before_the_node_has_it(postgres, indexed_chain):
+    indexed_chain.head = 103
+    assert indexer.index_once() is False
+    assert postgres.get_indexer_state()['block_number'] == 100
+
+def test_reorg_rolls_back_and_reindexes_the_new_chain(postgres, indexed_chain):
+    assert postgres.seed_token_balances(TOKEN, {ALICE: 1000}, 100)
+    indexed_chain.head = 102
+    indexed_chain.hashes.update({101: block_id(101), 102: block_id(102)})
+    indexed_chain.logs = [transfer_log(101, ALICE, CAROL, 300)]
+    indexer.index_once()
+    # BOB se siembra en un bloque que el reorg va a descartar
+    assert postgres.seed_token_balances(TOKEN, {BOB: 5}, 102)
+
+    indexed_chain.reorg(101, 'b')
+    indexed_chain.logs.append(transfer_log(102, CAROL, ALICE, 40, block_hash=block_id(102, 'b')))
+    assert indexer.index_once() is False
+
+    assert postgres.get_indexer_state()['block_number'] == 102
+    assert postgres.get_indexed_balances(TOKEN, [ALICE, BOB]) == {ALICE: 1040}
+    assert postgres.get_indexed_block_hashes(101) == {101: block_id(101, 'b'), 102: block_id(102, 'b')}
+
+def test_rollback_index_undoes_deltas_after_the_block(postgres):
+    postgres.save_indexed_range([], {100: block_id(100)}, 100, 64, [ALICE], 100)
+    assert postgres.seed_token_balances(TOKEN, {ALICE: 1000}, 100)
+    postgres.save_indexed_range(
+        [(101, TOKEN, ALICE, -300), (103, TOKEN, ALICE, 50)],
+        {number: block_id(number) for number in range(101, 104)}, 103, 64, [ALICE], 103
+    )
+    assert postgres.get_indexed_balances(TOKEN, [ALICE]) == {ALICE: 750}
+
+    postgres.rollback_index(101)
+    assert postgres.get_indexed_balances(TOKEN, [ALICE]) == {ALICE: 700}
+    assert postgres.get_indexer_state()['block_number'] == 101
+    assert sorted(postgres.get_indexed_block_hashes(0)) == [100, 101]
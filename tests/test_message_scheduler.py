@@ -0,0 +1,114 @@
+"""
+Pruebas del MessageScheduler: agrupación de ediciones del mismo mensaje,
+prioridad de las respuestas interactivas, ritmo por chat también para envíos
+seguidos y pausas por RetryAfter limitadas al chat afectado.
+"""
+import asyncio
+from telegram.error import RetryAfter
+
+from message_scheduler import MessageScheduler, PRIORITY_BULK
+
+def request(scheduler, calls, name, endpoint, data, priority=None, fail_first=None):
+    """Pasar por el planificador una llamada que anota name en calls al ejecutarse"""
+    async def callback():
+        if fail_first is not None and fail_first['pending']:
+            fail_first['pending'] -= 1
+            raise RetryAfter(fail_first['seconds'])
+        calls.append((name, asyncio.get_running_loop().time()))
+        return name
+
+    rate_limit_args = {'priority': priority} if priority is not None else None
+    return scheduler.process_request(callback, (), {}, endpoint, data, rate_limit_args)
+
+def test_queued_edits_of_a_message_are_coalesced():
+    calls = []
+
+    async def main():
+        scheduler = MessageScheduler(global_rate=0, chat_rate=20)
+        results = await asyncio.gather(
+            request(scheduler, calls, 'progress', 'sendMessage', {'chat_id': 1}),
+            *(request(scheduler, calls, f'edit {n}', 'editMessageText', {'chat_id': 1, 'message_id': 7})
+              for n in range(1, 4)),
+        )
+        return scheduler, results
+
+    scheduler, results = asyncio.run(main())
+    assert [name for name, _ in calls] == ['progress', 'edit 3']
+    # Las ediciones superadas se dan por hechas sin llamar a la Bot API
+    assert results == ['progress', True, True, 'edit 3']
+    stats = scheduler.stats()
+    assert stats['coalesced_edits'] == 2
+    assert stats['sent'] == 2
+    assert stats['pending_edits'] == 0
+
+def test_edits_of_different_messages_are_not_coalesced():
+    calls = []
+
+    async def main():
+        scheduler = MessageScheduler(global_rate=0, chat_rate=50)
+        await asyncio.gather(
+            request(scheduler, calls, 'edit a', 'editMessageText', {'chat_id': 1, 'message_id': 7}),
+            request(scheduler, calls, 'edit b', 'editMessageText', {'chat_id': 1, 'message_id': 8}),
+        )
+
+    asyncio.run(main())
+    assert sorted(name for name, _ in calls) == ['edit a', 'edit b']
+
+def test_interactive_replies_pass_bulk_notifications():
+    calls = []
+
+    async def main():
+        scheduler = MessageScheduler(global_rate=0, chat_rate=20)
+        await asyncio.gather(
+            *(request(scheduler, calls, f'bulk {n}', 'sendMessage', {'chat_id': 1}, priority=PRIORITY_BULK)
+              for n in range(3)),
+            request(scheduler, calls, 'reply', 'sendMessage', {'chat_id': 1}),
+        )
+
+    asyncio.run(main())
+    # Todas esperan turno a la vez: la respuesta sale antes aunque llegó la última
+    assert [name for name, _ in calls] == ['reply', 'bulk 0', 'bulk 1', 'bulk 2']
+
+def test_back_to_back_sends_to_a_chat_are_spaced():
+    calls = []
+    rate = 10
+
+    async def main():
+        scheduler = MessageScheduler(global_rate=0, chat_rate=rate)
+        start = asyncio.get_running_loop().time()
+        # Cada envío espera al anterior: nunca hay dos en cola a la vez
+        for n in range(4):
+            await request(scheduler, calls, f'message {n}', 'sendMessage', {'chat_id': 1})
+        return start
+
+    start = asyncio.run(main())
+    sent_at = [at - start for _, at in calls]
+    assert sent_at[0] < 1 / rate
+    for previous, current in zip(sent_at, sent_at[1:]):
+        assert current - previous >= 1 / rate * 0.9
+
+def test_retry_after_pauses_only_the_affected_chat():
+    calls = []
+    pause = 0.3
+
+    async def main():
+        scheduler = MessageScheduler(global_rate=0, chat_rate=100)
+        start = asyncio.get_running_loop().time()
+        limited = asyncio.create_task(request(
+            scheduler, calls, 'limited', 'sendMessage', {'chat_id': 1},
+            fail_first={'pending': 1, 'seconds': pause}
+        ))
+        await asyncio.sleep(0.05)
+        await asyncio.gather(
+            limited,
+            request(scheduler, calls, 'same chat', 'sendMessage', {'chat_id': 1}),
+            request(scheduler, calls, 'other chat', 'sendMessage', {'chat_id': 2}),
+        )
+        return scheduler, start
+
+    scheduler, start = asyncio.run(main())
+    sent_at = {name: at - start for name, at in calls}
+    assert sent_at['other chat'] < pause
+    assert sent_at['limited'] >= pause
+    assert sent_at['same chat'] >= pause
+    assert scheduler.stats()['retries'] == 1
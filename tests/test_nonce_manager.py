@@ -0,0 +1,126 @@
+"""
+Pruebas del reparto de nonces en memoria (NonceManager) y en Postgres
+(PostgresNonceManager) con la misma batería: reserva consecutiva, reutilización
+de los nonces liberados, resincronización (también contra un nodo atrasado) y
+recuperación de los huecos que deja una transacción descartada, sin bajar nunca
+el siguiente nonce salvo tras un 'nonce too high'.
+"""
+import pytest
+
+from nonce_manager import NonceManager, PostgresNonceManager, is_nonce_error, is_nonce_too_high, is_already_known
+
+ADDRESS = '0x' + 'Ab' * 20
+
+class Chain:
+    """Nonce pendiente de la dirección según la red, y cuántas veces se consultó"""
+
+    def __init__(self, nonce):
+        self.nonce = nonce
+        self.fetches = 0
+
+    def fetch(self, address):
+        self.fetches += 1
+        return self.nonce
+
+@pytest.fixture(params=['memory', 'postgres'])
+def backend(request):
+    if request.param == 'postgres':
+        request.getfixturevalue('postgres')
+        return PostgresNonceManager
+    return NonceManager
+
+def test_nonces_are_consecutive_and_fetched_once(backend):
+    chain = Chain(7)
+    manager = backend(chain.fetch)
+    assert [manager.reserve(ADDRESS) for _ in range(3)] == [7, 8, 9]
+    assert chain.fetches == 1
+
+def test_released_last_nonce_is_handed_out_again(backend):
+    manager = backend(Chain(0).fetch)
+    assert manager.reserve(ADDRESS) == 0
+    assert manager.reserve(ADDRESS) == 1
+    manager.release(ADDRESS, 1)
+    assert manager.reserve(ADDRESS) == 1
+    assert manager.reserve(ADDRESS) == 2
+
+def test_released_gap_is_filled_before_new_nonces(backend):
+    manager = backend(Chain(0).fetch)
+    for _ in range(4):
+        manager.reserve(ADDRESS)
+    # Fallan las transacciones con nonce 1 y 2, pero la 3 ya está emitida
+    manager.release(ADDRESS, 2)
+    manager.release(ADDRESS, 1)
+    manager.release(ADDRESS, 1)
+    assert [manager.reserve(ADDRESS) for _ in range(3)] == [1, 2, 4]
+
+def test_resync_takes_the_network_nonce(backend):
+    chain = Chain(0)
+    manager = backend(chain.fetch)
+    manager.reserve(ADDRESS)
+    manager.release(ADDRESS, 0)
+    chain.nonce = 5
+    assert manager.resync(ADDRESS) == 5
+    # La resincronización olvida los liberados
+    assert manager.reserve(ADDRESS) == 5
+
+def test_resync_against_a_lagging_node_never_lowers_the_nonce(backend):
+    chain = Chain(0)
+    manager = backend(chain.fetch)
+    for _ in range(5):
+        manager.reserve(ADDRESS)
+    manager.release(ADDRESS, 2)
+    # El nodo que responde aún no ha visto las transacciones 1-4
+    chain.nonce = 1
+    assert manager.resync(ADDRESS) == 5
+    # El 2 sigue liberado y los nonces 3 y 4 siguen siendo de sus transacciones
+    assert [manager.reserve(ADDRESS) for _ in range(2)] == [2, 5]
+
+def test_resync_forgets_released_nonces_the_network_used(backend):
+    chain = Chain(0)
+    manager = backend(chain.fetch)
+    for _ in range(4):
+        manager.reserve(ADDRESS)
+    manager.release(ADDRESS, 1)
+    chain.nonce = 6
+    assert manager.resync(ADDRESS) == 6
+    assert manager.reserve(ADDRESS) == 6
+
+def test_nonce_too_high_lowers_the_nonce(backend):
+    chain = Chain(0)
+    manager = backend(chain.fetch)
+    for _ in range(5):
+        manager.reserve(ADDRESS)
+    manager.release(ADDRESS, 3)
+    chain.nonce = 2
+    assert manager.resync(ADDRESS, allow_lower=True) == 2
+    assert [manager.reserve(ADDRESS) for _ in range(2)] == [2, 3]
+
+def test_dropped_transactions_free_their_nonces(backend):
+    chain = Chain(0)
+    manager = backend(chain.fetch)
+    for _ in range(4):
+        manager.reserve(ADDRESS)
+    # La red tiene las transacciones 0 y 1; la 2 se descartó y la 3 sigue en curso
+    chain.nonce = 2
+    assert manager.recover_gaps(ADDRESS, [0, 2]) == [2]
+    assert manager.reserve(ADDRESS) == 2
+    # El siguiente nonce no baja: el 3 sigue siendo de su transacción
+    assert manager.reserve(ADDRESS) == 4
+
+def test_recover_gaps_follows_a_network_ahead_of_us(backend):
+    chain = Chain(0)
+    highest = Chain(10)
+    manager = backend(chain.fetch, highest.fetch)
+    manager.reserve(ADDRESS)
+    assert manager.recover_gaps(ADDRESS, [0]) == []
+    assert manager.reserve(ADDRESS) == 10
+    assert highest.fetches == 1
+
+def test_node_errors_are_classified():
+    assert is_nonce_error(ValueError({'code': -32000, 'message': 'nonce too low'}))
+    assert is_nonce_error(Exception('Replacement transaction underpriced'))
+    assert not is_nonce_error(Exception('insufficient funds'))
+    assert is_nonce_too_high(ValueError({'code': -32000, 'message': 'Nonce too high'}))
+    assert not is_nonce_too_high(Exception('nonce too low'))
+    assert is_already_known(Exception('already known'))
+    assert not is_already_known(Exception('nonce too low'))
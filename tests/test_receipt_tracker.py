@@ -0,0 +1,55 @@
+"""
+Pruebas del reparto de solicitudes entre instancias del ReceiptTracker con
+Postgres: cada solicitud activa la sigue una sola instancia, y las de una
+instancia que deja de renovar su reserva las retoma otra.
+"""
+import asyncio
+
+from receipt_tracker import ReceiptTracker
+
+def create_request(database, key, chat_id, tracked_by=None):
+    request_id, _ = database.create_transfer_request(
+        key, 42, '0x' + '56' * 20, '0x' + '78' * 20, ['0x' + '12' * 20]
+    )
+    database.set_transfer_request_message(request_id, chat_id, 100 + request_id, tracked_by=tracked_by)
+    return request_id
+
+def expire_lease(database, request_id):
+    with database.db_connection() as conn:
+        conn.cursor().execute(
+            "UPDATE transfer_requests SET tracked_at = CURRENT_TIMESTAMP - INTERVAL '1 hour' WHERE id = %s",
+            (request_id,)
+        )
+        conn.commit()
+
+def test_each_active_request_is_tracked_by_one_instance(postgres):
+    orphan = create_request(postgres, 'orphan', 1)
+    mine = create_request(postgres, 'mine', 2, tracked_by='a')
+    first, second = ReceiptTracker(owner='a'), ReceiptTracker(owner='b')
+
+    async def main():
+        await first.renew()
+        await second.renew()
+
+    first._bot = second._bot = object()
+    asyncio.run(main())
+    assert set(first._sweeps) == {orphan, mine}
+    assert second._sweeps == {}
+
+def test_requests_of_a_dead_instance_are_taken_over(postgres):
+    request_id = create_request(postgres, 'taken', 1, tracked_by='a')
+    first, second = ReceiptTracker(owner='a'), ReceiptTracker(owner='b')
+    first._bot = second._bot = object()
+
+    async def main():
+        await first.renew()
+        await second.renew()
+        assert request_id in first._sweeps and request_id not in second._sweeps
+        # La instancia 'a' deja de renovar: 'b' la reclama y 'a' la suelta al volver
+        expire_lease(postgres, request_id)
+        await second.renew()
+        await first.renew()
+
+    asyncio.run(main())
+    assert request_id in second._sweeps
+    assert request_id not in first._sweeps
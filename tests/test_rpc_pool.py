@@ -0,0 +1,209 @@
+"""
+Pruebas del ProviderPool contra varios nodos JSON-RPC falsos: failover,
+apertura del circuito y recuperación con la petición de prueba (half-open), que
+solo libera la petición que la reservó, y la elección de un nodo para fijar consultas.
+"""
+import time
+import asyncio
+import pytest
+
+import rpc_pool
+from rpc_pool import ProviderPool, Endpoint, NoHealthyEndpoint
+from harness import start_server
+from mock_rpc import MockRpcServer, BLOCK_NUMBER
+
+REQUEST = {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_blockNumber', 'params': []}
+TIMEOUT = 2.0
+
+def run_pool(test, *servers, rate_limit=0):
+    """Arrancar los servidores, crear un pool con sus URLs y ejecutar test(pool)"""
+    async def main():
+        runners, urls = [], []
+        for server in servers:
+            runner = await start_server(server.app, '127.0.0.1', 0)
+            runners.append(runner)
+            urls.append(f'http://127.0.0.1:{runner.addresses[0][1]}/')
+        pool = ProviderPool(urls, timeout=TIMEOUT, rate_limit=rate_limit, rate_burst=1000)
+        try:
+            return await test(pool)
+        finally:
+            await pool.close_async()
+            for runner in runners:
+                await runner.cleanup()
+    return asyncio.run(main())
+
+async def open_circuit(pool):
+    for _ in range(rpc_pool.RPC_BREAKER_FAILURES):
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+    assert pool.stats()[0]['circuit'] == 'open'
+
+@pytest.fixture
+def short_cooldown(monkeypatch):
+    monkeypatch.setattr(rpc_pool, 'RPC_BREAKER_COOLDOWN', 0.2)
+    return 0.2
+
+def test_failover_to_healthy_endpoint():
+    down, up = MockRpcServer(fail_status=500), MockRpcServer()
+
+    async def test(pool):
+        for _ in range(10):
+            assert (await pool.post_async(REQUEST))['result'] == hex(BLOCK_NUMBER)
+
+    run_pool(test, down, up)
+    assert up.requests == 10
+    # Tras su primer fallo, el endpoint caído puntúa como un timeout y deja de elegirse
+    assert down.requests <= 1
+
+def test_failover_sync():
+    down, up = MockRpcServer(fail_status=503), MockRpcServer()
+
+    async def test(pool):
+        for _ in range(5):
+            response = await asyncio.to_thread(pool.post, REQUEST)
+            assert response['result'] == hex(BLOCK_NUMBER)
+
+    run_pool(test, down, up)
+    assert up.requests == 5
+    assert down.requests <= 1
+
+def test_rate_limited_endpoint_is_skipped():
+    limited, up = MockRpcServer(fail_status=429), MockRpcServer()
+
+    async def test(pool):
+        for _ in range(5):
+            await pool.post_async(REQUEST)
+
+    run_pool(test, limited, up)
+    assert up.requests == 5
+
+def test_every_attempt_pays_the_rate_limit():
+    first, second = MockRpcServer(fail_status=500), MockRpcServer(fail_status=503)
+
+    async def test(pool):
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        with pytest.raises(NoHealthyEndpoint):
+            await asyncio.to_thread(pool.post, REQUEST)
+        return pool.limiter_stats()
+
+    stats = run_pool(test, first, second, rate_limit=1000)
+    # Dos peticiones, cada una probada en los dos endpoints
+    assert stats['acquired'] == 4
+    assert first.requests == second.requests == 2
+
+def test_slow_endpoint_loses_traffic():
+    slow, fast = MockRpcServer(latency=0.2), MockRpcServer()
+
+    async def test(pool):
+        # Hasta que ambos tienen medidas, el reparto es al azar
+        for _ in range(50):
+            if slow.requests and fast.requests:
+                break
+            await pool.post_async(REQUEST)
+        slow_requests = slow.requests
+        for _ in range(10):
+            await pool.post_async(REQUEST)
+        assert slow.requests == slow_requests
+
+    run_pool(test, slow, fast)
+
+def test_circuit_opens_after_consecutive_failures():
+    down = MockRpcServer(fail_status=500)
+
+    async def test(pool):
+        await open_circuit(pool)
+        requests = down.requests
+        # Con el circuito abierto no se llega a contactar con el endpoint
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        assert down.requests == requests
+
+    run_pool(test, down)
+
+def test_half_open_probe_closes_circuit(short_cooldown):
+    server = MockRpcServer(fail_status=500)
+
+    async def test(pool):
+        await open_circuit(pool)
+        server.fail_status = None
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        await asyncio.sleep(short_cooldown * 1.5)
+        assert (await pool.post_async(REQUEST))['result'] == hex(BLOCK_NUMBER)
+        assert pool.stats()[0]['circuit'] == 'closed'
+        await pool.post_async(REQUEST)
+
+    run_pool(test, server)
+    assert server.requests == rpc_pool.RPC_BREAKER_FAILURES + 2
+
+def test_failed_probe_reopens_circuit(short_cooldown):
+    server = MockRpcServer(fail_status=500)
+
+    async def test(pool):
+        await open_circuit(pool)
+        await asyncio.sleep(short_cooldown * 1.5)
+        requests = server.requests
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        assert server.requests == requests + 1
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        assert server.requests == requests + 1
+
+    run_pool(test, server)
+
+def test_cancelled_probe_is_released(short_cooldown):
+    server = MockRpcServer(fail_status=500)
+
+    async def test(pool):
+        await open_circuit(pool)
+        server.fail_status = None
+        server.latency = 1
+        await asyncio.sleep(short_cooldown * 1.5)
+        probe = asyncio.create_task(pool.post_async(REQUEST))
+        await asyncio.sleep(0.1)
+        # Solo hay una petición de prueba a la vez
+        with pytest.raises(NoHealthyEndpoint):
+            await pool.post_async(REQUEST)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        server.latency = 0
+        assert (await pool.post_async(REQUEST))['result'] == hex(BLOCK_NUMBER)
+        assert pool.stats()[0]['circuit'] == 'closed'
+
+    run_pool(test, server)
+
+def test_late_request_does_not_free_the_probe(short_cooldown):
+    endpoint = Endpoint('http://127.0.0.1:1/')
+    # Una petición normal empieza con el circuito cerrado
+    assert endpoint.acquire() is False
+    for _ in range(rpc_pool.RPC_BREAKER_FAILURES):
+        endpoint.record(TIMEOUT, False)
+    assert endpoint.acquire() is None
+    time.sleep(short_cooldown * 1.5)
+    assert endpoint.acquire() is True
+    # La petición normal termina mientras la prueba sigue en curso
+    endpoint.record(TIMEOUT, False)
+    time.sleep(short_cooldown * 1.5)
+    assert endpoint.acquire() is None
+    # Al liberarla la prueba su dueño, el circuito admite otra
+    endpoint.release()
+    assert endpoint.acquire() is True
+
+def test_pick_url_skips_open_circuits(short_cooldown):
+    pool = ProviderPool(['http://node-1/', 'http://node-2/'], timeout=TIMEOUT, rate_limit=0)
+    for _ in range(rpc_pool.RPC_BREAKER_FAILURES):
+        pool.endpoints[0].record(TIMEOUT, False)
+    assert {pool.pick_url() for _ in range(10)} == {'http://node-2/'}
+
+    for _ in range(rpc_pool.RPC_BREAKER_FAILURES):
+        pool.endpoints[1].record(TIMEOUT, False)
+    with pytest.raises(NoHealthyEndpoint):
+        pool.pick_url()
+    # Pasado el cooldown, elegir no consume la petición de prueba
+    time.sleep(short_cooldown)
+    with pytest.raises(NoHealthyEndpoint):
+        pool.pick_url()
+    assert pool.endpoints[0].acquire() is True
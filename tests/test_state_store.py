@@ -0,0 +1,111 @@
+"""
+Pruebas del estado de conversación: el backend en memoria (LRU con TTL), la
+purga periódica de la fachada y, con Postgres, el backend compartido.
+"""
+import asyncio
+import pytest
+
+import cache
+from state_store import MemoryStateStore, PostgresStateStore, StateStore, create_state_store
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock.monotonic)
+    return clock
+
+@pytest.fixture(params=['memory', 'postgres'])
+def store(request):
+    if request.param == 'postgres':
+        request.getfixturevalue('postgres')
+        return StateStore(PostgresStateStore(ttl=60), purge_interval=0)
+    return StateStore(MemoryStateStore(maxsize=10, ttl=60), purge_interval=0)
+
+def test_state_is_kept_per_user_until_cleared(store):
+    async def main():
+        await store.set(1, 'waiting_private_key')
+        await store.set(2, 'waiting_destination')
+        await store.set(1, 'waiting_destination')
+        states = [await store.get(user_id) for user_id in (1, 2, 3)]
+        await store.clear(1)
+        await store.clear(3)
+        return states, await store.get(1), await store.get(2)
+
+    states, cleared, kept = asyncio.run(main())
+    assert states == ['waiting_destination', 'waiting_destination', None]
+    assert cleared is None
+    assert kept == 'waiting_destination'
+
+def test_memory_states_expire_and_are_purged(clock):
+    backend = MemoryStateStore(maxsize=10, ttl=60)
+
+    async def main():
+        await backend.set(1, 'waiting_private_key')
+        clock.now += 30
+        await backend.set(2, 'waiting_destination')
+        clock.now += 31
+        return await backend.get(1), await backend.purge_expired(), await backend.get(2)
+
+    assert asyncio.run(main()) == (None, 0, 'waiting_destination')
+    clock.now += 30
+    assert asyncio.run(backend.purge_expired()) == 1
+    stats = backend.stats()
+    assert (stats['backend'], stats['size'], stats['expirations']) == ('memory', 0, 2)
+
+def test_memory_store_evicts_least_recent_users():
+    backend = MemoryStateStore(maxsize=2, ttl=60)
+
+    async def main():
+        for user_id in (1, 2, 3):
+            await backend.set(user_id, 'waiting_destination')
+        return [await backend.get(user_id) for user_id in (1, 2, 3)]
+
+    assert asyncio.run(main()) == [None, 'waiting_destination', 'waiting_destination']
+    assert backend.stats()['evictions'] == 1
+
+def test_postgres_states_expire_and_are_purged(postgres):
+    backend = PostgresStateStore(ttl=-1)
+
+    async def main():
+        await backend.set(1, 'waiting_private_key')
+        expired = await backend.get(1)
+        return expired, await backend.purge_expired(), await backend.purge_expired()
+
+    assert asyncio.run(main()) == (None, 1, 0)
+    assert backend.stats() == {'backend': 'postgres', 'purged': 1}
+
+def test_purge_task_runs_until_stopped():
+    class CountingBackend(MemoryStateStore):
+        purges = 0
+
+        async def purge_expired(self):
+            self.purges += 1
+            return 0
+
+    backend = CountingBackend()
+    store = StateStore(backend, purge_interval=0.01)
+
+    async def main():
+        await store.start()
+        await asyncio.sleep(0.1)
+        await store.stop()
+        purges = backend.purges
+        await asyncio.sleep(0.05)
+        return purges
+
+    purges = asyncio.run(main())
+    assert purges >= 2
+    assert backend.purges == purges
+
+def test_unknown_backend_is_rejected():
+    assert isinstance(create_state_store('memory').backend, MemoryStateStore)
+    assert isinstance(create_state_store('postgres').backend, PostgresStateStore)
+    with pytest.raises(ValueError):
+        create_state_store('redis')
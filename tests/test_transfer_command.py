@@ -0,0 +1,80 @@
+"""
+Pruebas de /transfer: solo se encolan las wallets con balance, las que no se
+pudieron leer se avisan sin encolarse y un error al leer los balances se
+responde sin crear la solicitud.
+"""
+import asyncio
+import importlib
+from types import SimpleNamespace
+import pytest
+
+TOKEN = '0x' + '56' * 20
+DESTINATION = '0x' + '78' * 20
+FULL, EMPTY, REVERTED = ('0x' + digit * 40 for digit in '123')
+TOKEN_INFO = {'address': TOKEN, 'name': 'Token', 'symbol': 'TKN', 'decimals': 18}
+
+def balance(address, amount):
+    if amount is None:
+        return {'address': address, 'balance': None, 'readable_balance': None, 'error': 'balanceOf revertió'}
+    return {'address': address, 'balance': amount, 'readable_balance': amount / 10 ** 18, 'error': None}
+
+@pytest.fixture
+def bot(postgres, monkeypatch):
+    """virox_telegram con la base de datos y la red sustituidas; apunta las solicitudes creadas"""
+    virox_telegram = importlib.import_module('virox_telegram')
+    bot = SimpleNamespace(module=virox_telegram, requests=[], replies=[], balances=None, tracked=[])
+
+    async def get_user_destination_async(user_id):
+        return DESTINATION
+
+    async def get_user_wallets_async(user_id, columns):
+        return [{'address': address} for address in (FULL, EMPTY, REVERTED)]
+
+    async def get_token_balances_async(addresses, token):
+        if isinstance(bot.balances, Exception):
+            raise bot.balances
+        return {'token': TOKEN_INFO, 'wallets': bot.balances}
+
+    async def create_transfer_request_async(key, user_id, token, destination, addresses, empty_addresses=()):
+        bot.requests.append((list(addresses), list(empty_addresses)))
+        return 7, True
+
+    async def get_transfer_request_async(request_id, user_id=None):
+        return {'id': request_id, 'jobs': []}
+
+    async def set_transfer_request_message_async(*args, **kwargs):
+        pass
+
+    for function in (get_user_destination_async, get_user_wallets_async, get_token_balances_async,
+                     create_transfer_request_async, get_transfer_request_async,
+                     set_transfer_request_message_async):
+        monkeypatch.setattr(virox_telegram, function.__name__, function)
+    monkeypatch.setattr(virox_telegram.receipt_tracker, 'track', lambda *args: bot.tracked.append(args))
+    return bot
+
+def run_transfer(bot):
+    async def reply_text(text, **kwargs):
+        bot.replies.append(text)
+        return SimpleNamespace(chat_id=1, message_id=2)
+
+    message = SimpleNamespace(from_user=SimpleNamespace(id=42), chat_id=1, message_id=1, reply_text=reply_text)
+    asyncio.run(bot.module.transfer_command(SimpleNamespace(message=message), SimpleNamespace(args=[TOKEN], bot=None)))
+
+def test_only_wallets_with_balance_are_queued(bot):
+    bot.balances = [balance(FULL, 10 ** 18), balance(EMPTY, 0), balance(REVERTED, None)]
+    run_transfer(bot)
+    assert bot.requests == [([FULL], [EMPTY])]
+    assert REVERTED in bot.replies[0] and 'balanceOf revertió' in bot.replies[0]
+    assert len(bot.tracked) == 1
+
+def test_no_request_when_no_balance_could_be_read(bot):
+    bot.balances = [balance(FULL, None), balance(EMPTY, None), balance(REVERTED, None)]
+    run_transfer(bot)
+    assert bot.requests == []
+    assert len(bot.replies) == 1
+
+def test_balance_read_error_is_reported(bot):
+    bot.balances = ConnectionError('Ningún endpoint RPC disponible')
+    run_transfer(bot)
+    assert bot.requests == []
+    assert bot.replies == ['❌ Error al verificar balances: Ningún endpoint RPC disponible']
@@ -0,0 +1,247 @@
+"""
+Pruebas del worker de transferencias: los jobs que fallan vuelven a la cola, un
+eth_sendRawTransaction que agota el timeout deja el job 'sent' con su transacción
+guardada, sin liberar el nonce ni volver a firmarla, y de los jobs sin recibo solo
+se reintentan los que la red descartó. Con Postgres, el ciclo de la cola: reclamo,
+recuperación de jobs abandonados, reintento y seguimiento de recibos.
+"""
+import asyncio
+from types import SimpleNamespace
+import pytest
+from web3 import AsyncWeb3
+
+import web3_utils
+import transfer_worker
+from nonce_manager import NonceManager
+from rpc_pool import ProviderPool, PooledAsyncProvider
+from harness import start_server
+from mock_rpc import MockRpcServer, mock_balance
+
+TOKEN = '0x' + '56' * 20
+DESTINATION = '0x' + '78' * 20
+PRIVATE_KEY = '0x' + '01' * 32
+ADDRESS = web3_utils.w3.eth.account.from_key(PRIVATE_KEY).address
+
+class SlowSendServer(MockRpcServer):
+    """Nodo falso que tarda delay segundos en responder a eth_sendRawTransaction"""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.sends = 0
+
+    async def handle(self, request):
+        body = await request.json()
+        if isinstance(body, dict) and body.get('method') == 'eth_sendRawTransaction':
+            self.sends += 1
+            await asyncio.sleep(self.delay)
+        return await super().handle(request)
+
+class FakeEth:
+    @property
+    def gas_price(self):
+        return asyncio.sleep(0, 10 ** 7)
+
+def make_job(attempts=1):
+    return {'id': 1, 'request_id': 1, 'user_id': 42, 'address': ADDRESS, 'token': TOKEN,
+            'destination': DESTINATION, 'status': 'running', 'attempts': attempts,
+            'tx_hash': None, 'nonce': None, 'readable_balance': None, 'error': None}
+
+@pytest.fixture
+def db_calls(monkeypatch):
+    """Sin Postgres: las llamadas a la base de datos se apuntan (nombre, argumentos)"""
+    calls = []
+
+    async def run_db(func, *args):
+        calls.append((func.__name__, args))
+
+    monkeypatch.setattr(transfer_worker, 'run_db', run_db)
+    return calls
+
+@pytest.fixture
+def unlocked_wallet(monkeypatch):
+    async def load_wallets(jobs):
+        wallet = SimpleNamespace(unlocked=True, private_key=PRIVATE_KEY, error=None)
+        return {job['id']: wallet for job in jobs}, {}
+
+    monkeypatch.setattr(transfer_worker, 'load_wallets', load_wallets)
+
+def test_failed_send_is_retried(monkeypatch, db_calls, unlocked_wallet):
+    async def send_transfer_async(*args, **kwargs):
+        return {'address': ADDRESS, 'status': 'error', 'tx_hash': None, 'nonce': None,
+                'readable_balance': 1.0, 'error': 'connection refused'}
+
+    monkeypatch.setattr(transfer_worker, 'send_transfer_async', send_transfer_async)
+    monkeypatch.setattr(transfer_worker, 'async_w3', SimpleNamespace(eth=FakeEth()))
+    asyncio.run(transfer_worker.process_jobs([make_job()]))
+
+    [(name, (job_id, error, delay))] = db_calls
+    assert (name, job_id, error) == ('retry_transfer_job', 1, 'connection refused')
+    assert 0 < delay <= transfer_worker.TRANSFER_RETRY_BASE_DELAY
+
+def test_gas_price_error_retries_the_whole_batch(monkeypatch, db_calls, unlocked_wallet):
+    class FailingEth:
+        @property
+        def gas_price(self):
+            async def fail():
+                raise ConnectionError('Ningún endpoint RPC disponible')
+            return fail()
+
+    monkeypatch.setattr(transfer_worker, 'async_w3', SimpleNamespace(eth=FailingEth()))
+    jobs = [make_job(), dict(make_job(), id=2)]
+    asyncio.run(transfer_worker.process_jobs(jobs))
+
+    assert sorted((name, args[0], args[1]) for name, args in db_calls) == [
+        ('retry_transfer_job', 1, 'Ningún endpoint RPC disponible'),
+        ('retry_transfer_job', 2, 'Ningún endpoint RPC disponible'),
+    ]
+
+def test_failed_send_without_attempts_left_is_an_error(monkeypatch, db_calls):
+    asyncio.run(transfer_worker.fail_or_retry(make_job(transfer_worker.TRANSFER_JOB_MAX_ATTEMPTS), 'boom'))
+    assert db_calls == [('finish_transfer_job', (1, {'status': 'error', 'error': 'boom'}))]
+
+def test_send_timeout_keeps_the_job_sent(monkeypatch, db_calls, unlocked_wallet):
+    assert mock_balance(ADDRESS) > 0
+    server = SlowSendServer(delay=2.0)
+    nonces = NonceManager(lambda address: 0)
+    monkeypatch.setattr(web3_utils, 'nonce_manager', nonces)
+    monkeypatch.setattr(web3_utils, 'get_cached_token_metadata', lambda token: None)
+    monkeypatch.setattr(web3_utils, '_store_token_metadata', lambda metadata: None)
+
+    async def main():
+        runner = await start_server(server.app, '127.0.0.1', 0)
+        pool = ProviderPool([f'http://127.0.0.1:{runner.addresses[0][1]}/'], timeout=0.3, rate_limit=0)
+        async_w3 = AsyncWeb3(PooledAsyncProvider(pool))
+        monkeypatch.setattr(web3_utils, 'async_w3', async_w3)
+        monkeypatch.setattr(transfer_worker, 'async_w3', async_w3)
+        try:
+            await transfer_worker.process_jobs([make_job()])
+        finally:
+            await pool.close_async()
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+    assert server.sends == 1
+    names = [name for name, _ in db_calls]
+    assert names == ['mark_transfer_job_signed', 'finish_transfer_job']
+    _, (job_id, tx_hash, nonce) = db_calls[0]
+    _, (_, result) = db_calls[1]
+    assert (job_id, nonce) == (1, 0)
+    assert result['status'] == 'sent'
+    assert result['tx_hash'] == tx_hash
+    assert result['nonce'] == 0
+    # El nonce sigue reservado por la transacción que pudo emitirse
+    assert nonces.reserve(ADDRESS) == 1
+
+class Chain:
+    """Nonce pendiente de ADDRESS según la red"""
+
+    def __init__(self, nonce):
+        self.nonce = nonce
+
+    def fetch(self, address):
+        return self.nonce
+
+@pytest.fixture
+def chain(monkeypatch):
+    """Nonces 0-6 de ADDRESS reservados por transacciones emitidas"""
+    chain = Chain(0)
+    nonces = NonceManager(chain.fetch)
+    for _ in range(7):
+        nonces.reserve(ADDRESS)
+    monkeypatch.setattr(transfer_worker, 'nonce_manager', nonces)
+    return chain
+
+def sent_job(job_id, nonce, age):
+    return dict(make_job(), id=job_id, status='sent', tx_hash=f'0x{job_id:064x}', nonce=nonce, age=age)
+
+def test_only_dropped_transactions_are_retried(monkeypatch, chain):
+    jobs = [
+        sent_job(1, 0, 5),
+        # Sin recibo pasado el timeout: la 3 sigue en el mempool, la 5 ya no está
+        sent_job(2, 3, 200),
+        sent_job(3, 5, 200),
+        sent_job(4, 6, 10),
+    ]
+    calls = []
+
+    async def run_db(func, *args):
+        calls.append((func.__name__, args))
+        return jobs if func.__name__ == 'claim_sent_transfer_jobs' else 0
+
+    async def get_transaction_receipts_async(tx_hashes):
+        return {jobs[0]['tx_hash']: {'status': '0x1'}}
+
+    monkeypatch.setattr(transfer_worker, 'run_db', run_db)
+    monkeypatch.setattr(transfer_worker, 'get_transaction_receipts_async', get_transaction_receipts_async)
+    chain.nonce = 5
+    asyncio.run(transfer_worker.check_receipts_once())
+
+    assert [name for name, _ in calls] == [
+        'requeue_stale_transfer_jobs', 'claim_sent_transfer_jobs', 'finish_transfer_job', 'retry_transfer_job'
+    ]
+    assert calls[2][1] == (1, jobs[0])
+    assert jobs[0]['status'] == 'confirmed'
+    assert calls[3][1][:2] == (3, 'La red descartó la transacción')
+    # El job 2 sigue 'sent' con su transacción y el nonce 5 se vuelve a usar
+    assert (jobs[1]['status'], jobs[1]['tx_hash']) == ('timeout', f'0x{2:064x}')
+    assert transfer_worker.nonce_manager.reserve(ADDRESS) == 5
+
+def job_statuses(postgres, request_id):
+    return [(job['status'], job['tx_hash'], job['nonce']) for job in postgres.get_transfer_request(request_id)['jobs']]
+
+@pytest.fixture
+def queued_request(postgres):
+    other = '0x' + '9a' * 20
+    request_id, created = postgres.create_transfer_request('chat:1', 42, TOKEN, DESTINATION, [ADDRESS, other])
+    assert created
+    assert postgres.create_transfer_request('chat:1', 42, TOKEN, DESTINATION, [ADDRESS, other]) == (request_id, False)
+    return request_id
+
+def test_jobs_are_claimed_once_and_abandoned_ones_recovered(postgres, queued_request):
+    jobs = postgres.claim_transfer_jobs('worker-1', 10)
+    assert [(job['status'], job['attempts']) for job in jobs] == [('running', 1), ('running', 1)]
+    assert postgres.claim_transfer_jobs('worker-2', 10) == []
+
+    # worker-1 muere tras firmar el primer job: ese se sigue por su recibo, el otro vuelve a la cola
+    postgres.mark_transfer_job_signed(jobs[0]['id'], '0xabc', 7)
+    assert postgres.requeue_stale_transfer_jobs(-1) == 2
+    assert job_statuses(postgres, queued_request) == [('sent', '0xabc', 7), ('queued', None, None)]
+
+    [job] = postgres.claim_transfer_jobs('worker-2', 10)
+    assert (job['id'], job['attempts']) == (jobs[1]['id'], 2)
+    [sent] = postgres.claim_sent_transfer_jobs(10, 60, 120, 300)
+    assert sent['id'] == jobs[0]['id'] and sent['age'] >= 0
+    # Hasta que pase poll_interval no se vuelve a consultar su recibo
+    assert postgres.claim_sent_transfer_jobs(10, 60, 120, 300) == []
+
+def test_retry_forgets_the_transaction_and_waits(postgres, queued_request):
+    first, second = postgres.claim_transfer_jobs('worker-1', 10)
+    postgres.mark_transfer_job_signed(first['id'], '0xabc', 7)
+    postgres.retry_transfer_job(first['id'], 'La red descartó la transacción', 60)
+    postgres.finish_transfer_job(second['id'], {'status': 'confirmed', 'tx_hash': '0xdef', 'nonce': 8,
+                                                'readable_balance': 1.5, 'error': None})
+    assert job_statuses(postgres, queued_request) == [('queued', None, None), ('confirmed', '0xdef', 8)]
+    assert postgres.claim_transfer_jobs('worker-1', 10) == []
+
+    postgres.retry_transfer_job(first['id'], 'La red descartó la transacción', 0)
+    [job] = postgres.claim_transfer_jobs('worker-1', 10)
+    assert (job['id'], job['attempts'], job['error']) == (first['id'], 2, 'La red descartó la transacción')
+
+def test_expired_jobs_stay_sent_unless_dropped(postgres, queued_request, monkeypatch, chain):
+    first, second = postgres.claim_transfer_jobs('worker-1', 10)
+    postgres.finish_transfer_job(first['id'], {'status': 'sent', 'tx_hash': '0xabc', 'nonce': 3})
+    postgres.finish_transfer_job(second['id'], {'status': 'sent', 'tx_hash': '0xdef', 'nonce': 5})
+    for _ in range(7):
+        transfer_worker.nonce_manager.reserve(second['address'])
+    chain.nonce = 5
+
+    async def get_transaction_receipts_async(tx_hashes):
+        return {}
+
+    monkeypatch.setattr(transfer_worker, 'get_transaction_receipts_async', get_transaction_receipts_async)
+    monkeypatch.setattr(transfer_worker, 'TRANSFER_RECEIPT_TIMEOUT', 0)
+    asyncio.run(transfer_worker.check_receipts_once())
+
+    assert job_statuses(postgres, queued_request) == [('sent', '0xabc', 3), ('queued', None, None)]
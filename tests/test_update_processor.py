@@ -0,0 +1,93 @@
+"""
+Pruebas del orden por usuario de PerUserUpdateProcessor: los updates con estado
+de un usuario van de uno en uno y en orden, los comandos concurrentes esperan a
+los anteriores y corren a la vez entre sí, y los usuarios no se bloquean entre sí.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from update_processor import PerUserUpdateProcessor
+
+CONCURRENT = {'check', 'wallets'}
+
+def make_update(user_id, text):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(text=text),
+    )
+
+def run_updates(updates, processor=None):
+    """
+    Procesar updates (user_id, texto, segundos) en orden de llegada
+
+    Returns:
+        list: Eventos ('start' | 'end', texto) en el orden en que ocurrieron
+    """
+    events = []
+
+    async def handle(text, seconds):
+        events.append(('start', text))
+        await asyncio.sleep(seconds)
+        events.append(('end', text))
+
+    async def main():
+        nonlocal processor
+        processor = processor or PerUserUpdateProcessor(workers=8, concurrent_commands=CONCURRENT)
+        tasks = [
+            asyncio.create_task(processor.do_process_update(make_update(user_id, text), handle(text, seconds)))
+            for user_id, text, seconds in updates
+        ]
+        await asyncio.gather(*tasks)
+        assert processor.stats()['pending'] == 0
+        assert processor.stats()['users_pending'] == 0
+
+    asyncio.run(main())
+    return events
+
+def test_stateful_updates_run_one_at_a_time_in_order():
+    events = run_updates([(1, 'a', 0.03), (1, 'b', 0.02), (1, 'c', 0.01)])
+    assert events == [
+        ('start', 'a'), ('end', 'a'),
+        ('start', 'b'), ('end', 'b'),
+        ('start', 'c'), ('end', 'c'),
+    ]
+
+def test_concurrent_commands_wait_for_earlier_stateful_updates():
+    events = run_updates([
+        (1, 'wallet key', 0.03),
+        (1, '/check 0xtoken', 0.03),
+        (1, '/wallets@ViroxBot', 0.03),
+        (1, 'next message', 0.01),
+    ])
+    position = {event: index for index, event in enumerate(events)}
+    # Los comandos de lectura ven el estado que dejó el mensaje anterior
+    assert position[('end', 'wallet key')] < position[('start', '/check 0xtoken')]
+    assert position[('end', 'wallet key')] < position[('start', '/wallets@ViroxBot')]
+    # Entre sí corren a la vez
+    assert position[('start', '/wallets@ViroxBot')] < position[('end', '/check 0xtoken')]
+    # El siguiente update con estado espera a que terminen los dos
+    assert position[('end', '/check 0xtoken')] < position[('start', 'next message')]
+    assert position[('end', '/wallets@ViroxBot')] < position[('start', 'next message')]
+
+def test_commands_outside_the_list_keep_their_order():
+    events = run_updates([(1, '/transfer 0xtoken', 0.03), (1, '/check 0xtoken', 0.01)])
+    assert events == [
+        ('start', '/transfer 0xtoken'), ('end', '/transfer 0xtoken'),
+        ('start', '/check 0xtoken'), ('end', '/check 0xtoken'),
+    ]
+
+def test_users_do_not_block_each_other():
+    events = run_updates([(1, 'slow', 0.05), (1, 'after slow', 0.01), (2, 'other user', 0.01)])
+    position = {event: index for index, event in enumerate(events)}
+    assert position[('end', 'other user')] < position[('end', 'slow')]
+
+def test_worker_limit_is_shared_between_users():
+    processor = PerUserUpdateProcessor(workers=1, concurrent_commands=CONCURRENT)
+    events = run_updates([(1, 'a', 0.02), (2, 'b', 0.02), (3, 'c', 0.02)], processor)
+    # Con un solo worker nunca hay dos updates en curso
+    running = 0
+    for kind, _ in events:
+        running += 1 if kind == 'start' else -1
+        assert running <= 1
+    assert processor.stats()['processed'] == 3
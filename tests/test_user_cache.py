@@ -0,0 +1,100 @@
+"""
+Pruebas de la caché read-through por usuario: lecturas agrupadas por usuario,
+invalidación de todo lo suyo de una vez, caducidad de cada lectura por separado,
+lecturas obsoletas que no se guardan y,
+con Postgres, invalidación en cada escritura de wallets y destino.
+"""
+import pytest
+
+import cache
+import database
+from user_cache import UserCache
+from database import WALLET_LIST_COLUMNS
+
+DESTINATION = '0x' + '78' * 20
+OTHER_DESTINATION = '0x' + '9a' * 20
+
+def test_reads_are_cached_per_user_and_key():
+    cache = UserCache(maxsize=10, ttl=60)
+    assert cache.get(1, 'destination') == (False, None)
+    cache.set(1, 'destination', None, cache.version())
+    cache.set(1, ('wallets', ('address',)), [{'address': '0x1'}], cache.version())
+    # None es un valor legítimo: el usuario no tiene destino
+    assert cache.get(1, 'destination') == (True, None)
+    assert cache.get(1, ('wallets', ('address',))) == (True, [{'address': '0x1'}])
+    assert cache.get(2, 'destination') == (False, None)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['users']) == (2, 2, 1)
+
+def test_invalidate_forgets_every_read_of_the_user():
+    cache = UserCache(maxsize=10, ttl=60)
+    for user_id in (1, 2):
+        cache.set(user_id, 'destination', DESTINATION, cache.version())
+        cache.set(user_id, 'wallets', [], cache.version())
+    cache.invalidate(1)
+    assert cache.get(1, 'destination') == (False, None)
+    assert cache.get(1, 'wallets') == (False, None)
+    assert cache.get(2, 'destination') == (True, DESTINATION)
+    assert cache.stats()['invalidations'] == 1
+
+def test_read_started_before_an_invalidation_is_not_stored():
+    cache = UserCache(maxsize=10, ttl=60)
+    version = cache.version()
+    # Una escritura invalida mientras la lectura estaba en curso
+    cache.invalidate(1)
+    cache.set(1, 'destination', DESTINATION, version)
+    assert cache.get(1, 'destination') == (False, None)
+    version = cache.version()
+    cache.clear()
+    cache.set(1, 'destination', DESTINATION, version)
+    assert cache.get(1, 'destination') == (False, None)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+def test_each_read_expires_on_its_own(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock.monotonic)
+    user = UserCache(maxsize=10, ttl=60)
+    user.set(1, 'destination', DESTINATION, user.version())
+    # Guardar otras lecturas del usuario no alarga la vida de la primera
+    for _ in range(3):
+        clock.now += 30
+        user.set(1, 'wallets', [], user.version())
+    assert user.get(1, 'destination') == (False, None)
+    assert user.get(1, 'wallets') == (True, [])
+    clock.now += 61
+    assert user.get(1, 'wallets') == (False, None)
+
+@pytest.fixture
+def user_cache(postgres, monkeypatch):
+    cache = UserCache(maxsize=10, ttl=60)
+    monkeypatch.setattr(database, 'user_cache', cache)
+    return cache
+
+def test_destination_writes_invalidate_the_cache(user_cache):
+    assert database.get_user_destination(42) is None
+    assert database.save_destination(42, DESTINATION)
+    assert database.get_user_destination(42) == DESTINATION
+    assert database.get_user_destination(42) == DESTINATION
+    assert user_cache.stats()['hits'] == 1
+    assert database.save_destination(42, OTHER_DESTINATION)
+    assert database.get_user_destination(42) == OTHER_DESTINATION
+
+def test_wallet_writes_invalidate_the_cache(user_cache):
+    assert database.get_user_wallets(42, WALLET_LIST_COLUMNS) == []
+    assert database.save_wallet(42, '0x' + '12' * 20, 'cifrada', '', 2)
+    wallets = database.get_user_wallets(42, WALLET_LIST_COLUMNS)
+    assert wallets == [{'address': '0x' + '12' * 20, 'is_default': True}]
+    # Cada llamada recibe su copia: modificarla no cambia la caché
+    wallets[0]['address'] = 'modificada'
+    assert database.get_user_wallets(42, WALLET_LIST_COLUMNS)[0]['address'] == '0x' + '12' * 20
+
+    database.save_wallets_bulk(42, [('0x' + '34' * 20, 'cifrada', '', 2)])
+    assert len(database.get_user_wallets(42, WALLET_LIST_COLUMNS)) == 2
+    assert database.delete_user_wallets(42)
+    assert database.get_user_wallets(42, WALLET_LIST_COLUMNS) == []
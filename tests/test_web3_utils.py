@@ -0,0 +1,110 @@
+"""
+Pruebas de la decodificación de Multicall3 y de los batches JSON-RPC contra un
+nodo falso: balanceOf que revierte dentro de aggregate3 (allowFailure), errores
+de una sola petición dentro de un batch y batches a un endpoint concreto que
+pagan el límite global de peticiones.
+"""
+import asyncio
+import pytest
+from web3 import AsyncWeb3
+
+import web3_utils
+from web3_utils import RPCError, rpc_batch, get_token_balances_async, get_highest_pending_nonce, _batch_results
+from rpc_pool import ProviderPool, PooledAsyncProvider
+from harness import start_server
+from mock_rpc import MockRpcServer, mock_balance, BLOCK_NUMBER, CHAIN_ID
+
+TOKEN = '0x' + '56' * 20
+WALLET = '0x' + '12' * 20
+REVERTING_WALLET = '0x' + '34' * 20
+
+def run_server(test, server):
+    """Arrancar el servidor y ejecutar test(url)"""
+    async def main():
+        runner = await start_server(server.app, '127.0.0.1', 0)
+        try:
+            return await test(f'http://127.0.0.1:{runner.addresses[0][1]}/')
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+@pytest.fixture
+def no_token_cache(monkeypatch):
+    """Sin Postgres: la metadata nunca está en caché y no se guarda"""
+    stored = []
+    monkeypatch.setattr(web3_utils, 'get_cached_token_metadata', lambda token: None)
+    monkeypatch.setattr(web3_utils, '_store_token_metadata', stored.append)
+    return stored
+
+def test_reverted_balance_does_not_fail_the_multicall(no_token_cache):
+    server = MockRpcServer(revert_addresses=[REVERTING_WALLET])
+
+    async def test(url):
+        pool = ProviderPool([url], rate_limit=0)
+        try:
+            return await get_token_balances_async(
+                [WALLET, REVERTING_WALLET], TOKEN, web3=AsyncWeb3(PooledAsyncProvider(pool))
+            )
+        finally:
+            await pool.close_async()
+
+    result = run_server(test, server)
+    assert result['token']['symbol'] == 'MOCK'
+    assert result['token']['decimals'] == 18
+    assert len(no_token_cache) == 1
+
+    ok, reverted = result['wallets']
+    assert ok['address'].lower() == WALLET
+    assert ok['balance'] == mock_balance(WALLET)
+    assert ok['readable_balance'] == mock_balance(WALLET) / 10 ** 18
+    assert ok['error'] is None
+    assert reverted['address'].lower() == REVERTING_WALLET
+    assert reverted['balance'] is None
+    assert reverted['readable_balance'] is None
+    assert reverted['error'] == 'balanceOf revertió'
+
+def test_batch_item_error_is_returned_in_place():
+    server = MockRpcServer()
+
+    async def test(url):
+        calls = [('eth_blockNumber', []), ('eth_noSuchMethod', []), ('eth_chainId', [])]
+        return await asyncio.to_thread(rpc_batch, calls, url=url)
+
+    block, error, chain = run_server(test, server)
+    assert block == hex(BLOCK_NUMBER)
+    assert chain == hex(CHAIN_ID)
+    assert isinstance(error, RPCError)
+    assert error.code == -32601
+
+def test_batch_to_one_endpoint_pays_the_rate_limit(monkeypatch):
+    server = MockRpcServer()
+
+    async def test(url):
+        pool = ProviderPool([url], rate_limit=100, rate_burst=100)
+        monkeypatch.setattr(web3_utils, 'rpc_pool', pool)
+        nonce = await asyncio.to_thread(get_highest_pending_nonce, WALLET)
+        await asyncio.to_thread(rpc_batch, [('eth_blockNumber', []), ('eth_chainId', [])], url=url)
+        return nonce, pool.limiter_stats()
+
+    nonce, limiter = run_server(test, server)
+    assert nonce == 0
+    assert limiter['acquired'] == 2
+    assert server.requests == 2
+
+def test_batch_results_follow_request_ids():
+    body = [
+        {'jsonrpc': '2.0', 'id': 2, 'result': '0x2'},
+        {'jsonrpc': '2.0', 'id': 0, 'error': {'code': -32000, 'message': 'execution reverted'}},
+    ]
+    first, missing, third = _batch_results(body, 3)
+    assert isinstance(first, RPCError)
+    assert first.code == -32000
+    assert first.message == 'execution reverted'
+    assert isinstance(missing, RPCError)
+    assert missing.code == -32603
+    assert third == '0x2'
+
+def test_rejected_batch_fails_every_item():
+    results = _batch_results({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32005, 'message': 'limit exceeded'}}, 2)
+    assert len(results) == 2
+    assert all(isinstance(result, RPCError) and result.code == -32005 for result in results)
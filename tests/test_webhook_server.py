@@ -0,0 +1,126 @@
+"""
+Pruebas del servidor webhook con el cliente de pruebas de aiohttp: secreto,
+encolado de updates, /healthz y /readyz, y el orden de parada de run_webhook.
+"""
+import os
+import signal
+import asyncio
+from types import SimpleNamespace
+from aiohttp.test_utils import TestServer, TestClient
+
+import webhook_server
+from webhook_server import WebhookServer, SECRET_HEADER
+
+SECRET = 'test-secret'
+UPDATE = {
+    'update_id': 1001,
+    'message': {
+        'message_id': 1, 'date': 1700000000, 'text': '/start',
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    },
+}
+
+def make_application(running=True):
+    return SimpleNamespace(bot=None, update_queue=asyncio.Queue(), running=running)
+
+def run_client(test, application, monkeypatch, db_ok=True):
+    """Servir un WebhookServer con el cliente de pruebas y ejecutar test(client)"""
+    async def ping_db_async():
+        if not db_ok:
+            raise ConnectionError('sin base de datos')
+        return True
+
+    monkeypatch.setattr(webhook_server, 'ping_db_async', ping_db_async)
+
+    async def main():
+        server = WebhookServer(application, secret=SECRET)
+        async with TestClient(TestServer(server.app)) as client:
+            return await test(client)
+    return asyncio.run(main())
+
+def test_wrong_secret_is_rejected(monkeypatch):
+    application = make_application()
+
+    async def test(client):
+        missing = await client.post('/telegram', json=UPDATE)
+        wrong = await client.post('/telegram', json=UPDATE, headers={SECRET_HEADER: 'otro'})
+        return missing.status, wrong.status
+
+    assert run_client(test, application, monkeypatch) == (403, 403)
+    assert application.update_queue.empty()
+
+def test_valid_update_is_queued(monkeypatch):
+    application = make_application()
+
+    async def test(client):
+        response = await client.post('/telegram', json=UPDATE, headers={SECRET_HEADER: SECRET})
+        invalid = await client.post('/telegram', data='no es json', headers={SECRET_HEADER: SECRET})
+        return response.status, invalid.status
+
+    assert run_client(test, application, monkeypatch) == (200, 400)
+    assert application.update_queue.qsize() == 1
+    update = application.update_queue.get_nowait()
+    assert update.update_id == 1001
+    assert update.message.text == '/start'
+    assert update.effective_user.id == 42
+
+def test_health_and_readiness(monkeypatch):
+    async def test(client):
+        health = await client.get('/healthz')
+        ready = await client.get('/readyz')
+        return health.status, ready.status, await ready.json()
+
+    health, ready, body = run_client(test, make_application(), monkeypatch)
+    assert (health, ready) == (200, 200)
+    assert body['checks'] == {'application': True, 'database': True}
+
+    _, ready, body = run_client(test, make_application(running=False), monkeypatch, db_ok=False)
+    assert ready == 503
+    assert body['checks'] == {'application': False, 'database': False}
+
+class FakeApplication:
+    """Aplicación de PTB mínima que anota en events el orden del ciclo de vida"""
+
+    def __init__(self):
+        self.events = []
+        self.post_init = self._hook('post_init')
+        self.post_shutdown = self._hook('post_shutdown')
+
+    def _hook(self, name):
+        async def hook(application):
+            self.events.append(name)
+        return hook
+
+    async def __aenter__(self):
+        self.events.append('initialize')
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.events.append('shutdown')
+
+    async def start(self):
+        self.events.append('start')
+        # Parar como lo haría el sistema, cuando ya está todo arrancado
+        asyncio.get_running_loop().call_soon(os.kill, os.getpid(), signal.SIGTERM)
+
+    async def stop(self):
+        self.events.append('stop')
+
+def test_post_shutdown_runs_after_shutdown(monkeypatch):
+    class Server:
+        def __init__(self, application, stats=None):
+            pass
+
+        async def start(self):
+            pass
+
+        async def stop(self):
+            pass
+
+    monkeypatch.setattr(webhook_server, 'WebhookServer', Server)
+    monkeypatch.setattr(webhook_server, 'WEBHOOK_URL', '')
+    application = FakeApplication()
+    asyncio.run(webhook_server.run_webhook(application))
+    assert application.events == ['initialize', 'post_init', 'start', 'stop', 'shutdown', 'post_shutdown']